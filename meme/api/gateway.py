@@ -0,0 +1,243 @@
+# coding: utf-8
+# 下单网关：socket 上收命令，交给唯一的撮合线程按批 build + commit，再把回执发回去。
+#
+# 协议是一行一个 JSON：
+#   {"seq": 1, "command": "order", "order_id": "bid1", "side": "bid", "account_id": "account1",
+#    "coin_type": "ltc", "price_type": "btc", "price": "0.1", "amount": "1", "fee_rate": "0.001"}
+#   带 "kind": "market" | "ioc" | "fok" 时是立即成交的吃单，市价单不带 price
+#   {"seq": 2, "command": "cancel", "order_id": "bid1"}
+#   {"seq": 3, "command": "credit", "id": "credit1", "account_id": "account1", "coin_type": "btc", "amount": "1"}
+#   {"seq": 4, "command": "debit", ...}    {"seq": 5, "command": "account", "account_id": "account1"}
+#   {"seq": 6, "command": "auction", "exchange_id": "ltc-btc"}    开始集合竞价
+#   {"seq": 7, "command": "clear", "exchange_id": "ltc-btc"}      集合竞价成交，恢复连续撮合
+#   {"seq": 8, "command": "cancel_all", "account_id": "account1"}  撤销账户的全部挂单，可选 "exchange_id" 和 "side"
+# 回执是 {"seq": 1, "revision": 10}，失败时是 {"seq": 1, "error": "BalanceError", "message": "..."}。
+#
+# Python 2 没有 asyncio，网络部分用 asyncore 的单线程事件循环。命令进一个有界队列，
+# 队列满了就先停止读这个连接（TCP 的窗口会把压力传回客户端），直到队列腾出位置。
+# 撮合线程一次取出一批命令，全部提交后 flush 一次 journal 再发回执，回执意味着已经落盘；
+# 落盘失败时整批回滚，每个命令都回复这个错误。
+import os
+import socket
+import asyncore
+import threading
+from json import dumps, loads
+from collections import deque
+from Queue import Queue, Full, Empty
+from meme.me.entities import BidOrder, AskOrder
+from meme.me.events import AccountCreated, AccountCredited, AccountDebited, OrderCreated, OrderCanceled, OrderTaken, AuctionStarted, AuctionCleared, OrdersMassCanceled
+
+ORDER_SIDES = {BidOrder.side: BidOrder, AskOrder.side: AskOrder}
+
+class Gateway(object):
+    # address 是 (host, port) 或者 Unix socket 的路径
+    def __init__(self, repo, address, queue_size=10000, batch_size=256):
+        self.repo = repo
+        self.queue = Queue(queue_size)
+        self.batch_size = batch_size
+        self.map = {}
+        self.replies = deque()
+        self.running = False
+        self.threads = []
+        self.server = Server(self, address)
+        self.waker = Waker(self)
+
+    @property
+    def address(self):
+        return self.server.socket.getsockname()
+
+    def start(self):
+        self.running = True
+        for target, name in ((self._match, 'gateway-matcher'), (self._loop, 'gateway-io')):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        self.queue.put(None)
+        self.waker.wake()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        for dispatcher in self.map.values():
+            dispatcher.close()
+
+    def _loop(self):
+        while self.running:
+            asyncore.loop(timeout=0.01, map=self.map, count=1)
+            # 被背压挡住的连接等队列腾出位置后再继续
+            for dispatcher in self.map.values():
+                if isinstance(dispatcher, Connection) and dispatcher.pending:
+                    dispatcher.enqueue()
+
+    # 唯一修改 Repository 的线程
+    def _match(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)
+                    break
+                batch.append(item)
+            # 整批一次写 journal 并落盘；单个命令失败只撤销它自己，_execute 不会抛出异常。
+            # 写 journal 失败时整批都撤销了，每个命令都回复这个错误
+            try:
+                with self.repo.batch(flush=True):
+                    replies = [(connection, self._execute(command)) for connection, command in batch]
+            except Exception as e:
+                replies = [(connection, _error_reply(command, e)) for connection, command in batch]
+            self.replies.extend(replies)
+            self.waker.wake()
+
+    def _execute(self, command):
+        reply = {'seq': command.get('seq')}
+        try:
+            # 提交和随后的撮合是一个整体，撮合失败时这个命令连同它的成交一起撤销
+            with self.repo.batch():
+                event = self._build(command)
+                self.repo.commit(event)
+                if type(event) is OrderCreated:
+                    self.repo.exchanges.find(event.order.exchange_id).match_all(self.repo)
+                elif type(event) is AuctionCleared:
+                    self.repo.exchanges.find(event.exchange_id).match_all(self.repo)
+            reply['revision'] = event.revision
+        # 命令里的值类型不对时可能是任何异常，都不能让撮合线程退出
+        except Exception as e:
+            reply.update(_error_reply(command, e))
+        return reply
+
+    def _build(self, command):
+        repo = self.repo
+        name = command['command']
+        if name == 'order':
+            klass = ORDER_SIDES[command['side']]
+            if 'kind' in command:
+                return OrderTaken.build(repo, command['order_id'], klass, command['account_id'], command['coin_type'], command['price_type'],
+                        command['amount'], command['fee_rate'], command['kind'], command.get('price'), command.get('timestamp'))
+            return OrderCreated.build(repo, command['order_id'], klass, command['account_id'], command['coin_type'], command['price_type'],
+                    command['price'], command['amount'], command['fee_rate'], command.get('timestamp'))
+        elif name == 'cancel':
+            return OrderCanceled.build(repo, command['order_id'])
+        elif name == 'cancel_all':
+            return OrdersMassCanceled.build(repo, command['account_id'], command.get('exchange_id'), command.get('side'))
+        elif name == 'credit':
+            return AccountCredited.build(repo, command['id'], command['account_id'], command['coin_type'], command['amount'])
+        elif name == 'debit':
+            return AccountDebited.build(repo, command['id'], command['account_id'], command['coin_type'], command['amount'])
+        elif name == 'account':
+            return AccountCreated.build(repo, command['account_id'])
+        elif name == 'auction':
+            return AuctionStarted.build(repo, command['exchange_id'])
+        elif name == 'clear':
+            return AuctionCleared.build(repo, command['exchange_id'])
+        raise ValueError("Unknown command %s" % name)
+
+    def _dispatch_replies(self):
+        while self.replies:
+            connection, reply = self.replies.popleft()
+            if connection.connected:
+                connection.out_buffer += dumps(reply) + '\n'
+
+def _error_reply(command, error):
+    return {'seq': command.get('seq'), 'error': type(error).__name__, 'message': str(error)}
+
+class Server(asyncore.dispatcher):
+    def __init__(self, gateway, address):
+        asyncore.dispatcher.__init__(self, map=gateway.map)
+        self.gateway = gateway
+        if isinstance(address, basestring):
+            if os.path.exists(address):
+                os.remove(address)
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        self.bind(address)
+        self.listen(128)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            Connection(self.gateway, pair[0])
+
+class Connection(asyncore.dispatcher):
+    def __init__(self, gateway, sock):
+        asyncore.dispatcher.__init__(self, sock, map=gateway.map)
+        self.gateway = gateway
+        self.in_buffer = ''
+        self.out_buffer = ''
+        self.pending = deque()
+
+    # 还有命令没进队列时不再读，背压就这样传回客户端
+    def readable(self):
+        return not self.pending
+
+    def writable(self):
+        return bool(self.out_buffer)
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        lines = (self.in_buffer + data).split('\n')
+        self.in_buffer = lines.pop()
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                command = loads(line)
+                if not isinstance(command, dict):
+                    raise ValueError("Command must be a JSON object")
+            except ValueError as e:
+                self.out_buffer += dumps({'seq': None, 'error': 'ValueError', 'message': str(e)}) + '\n'
+                continue
+            self.pending.append(command)
+        self.enqueue()
+
+    def enqueue(self):
+        while self.pending:
+            try:
+                self.gateway.queue.put_nowait((self, self.pending[0]))
+            except Full:
+                return
+            self.pending.popleft()
+
+    def handle_write(self):
+        sent = self.send(self.out_buffer)
+        self.out_buffer = self.out_buffer[sent:]
+
+    def handle_close(self):
+        self.close()
+
+# 撮合线程通过它唤醒 asyncore 循环去发回执
+class Waker(asyncore.dispatcher):
+    def __init__(self, gateway):
+        reader, self.writer = socket.socketpair()
+        asyncore.dispatcher.__init__(self, reader, map=gateway.map)
+        self.gateway = gateway
+
+    def wake(self):
+        try:
+            self.writer.send('x')
+        except socket.error:
+            pass
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(4096)
+        self.gateway._dispatch_replies()
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        self.writer.close()
@@ -0,0 +1,203 @@
+# coding: utf-8
+# 行情：随成交流式更新的 K 线和 24 小时 ticker。
+#
+# 每个交易对每个周期一个定长的环形缓冲区，开始时间为 t 的 K 线放在 (t / 周期) % 容量 的槽里，
+# 一笔成交只改每个周期最新的那根 K 线，是 O(1) 的。时间取成交里的 timestamp（秒）而不是墙上时钟，
+# 回放 journal 得到的行情和线上一样；时间倒退的成交算进最新的那根 K 线里。
+#
+# ticker 是 24 小时滚动窗口。每分钟的成交量记在一个 1440 槽的环形缓冲区里，
+# 窗口往前走时减掉滑出去的分钟；最高最低价用单调队列维护，每分钟最多一项。
+# 每一分钟只会滑出窗口一次，摊还下来每笔成交仍然是 O(1)。
+# 窗口随成交往前走，读的时候再用当前时间 advance 一次，长时间没有成交也不会给出过期的数据；
+# expires 是窗口里最早那一分钟滑出去的时间，在那之前读到的结果都不会变。
+from collections import deque
+from operator import ge, le
+from meme.me import amounts
+
+INTERVALS = (('1m', 60), ('5m', 300), ('1h', 3600), ('1d', 86400))
+
+# 一根 K 线是 [开始时间, 开盘, 最高, 最低, 收盘, 成交量, 成交额, 成交笔数]
+class Candles(object):
+    def __init__(self, interval, capacity):
+        self.interval = interval
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.last = None
+
+    # timestamp 不早于上一次的
+    def add(self, price, amount, quote, timestamp):
+        start = timestamp - timestamp % self.interval
+        if start == self.last:
+            candle = self.slots[start // self.interval % self.capacity]
+            if price > candle[2]:
+                candle[2] = price
+            elif price < candle[3]:
+                candle[3] = price
+            candle[4] = price
+            candle[5] += amount
+            candle[6] += quote
+            candle[7] += 1
+        else:
+            self.slots[start // self.interval % self.capacity] = [start, price, price, price, price, amount, quote, 1]
+            self.last = start
+
+    # start 开始的那根 K 线，没有成交或者已经被覆盖时返回 None
+    def get(self, start):
+        candle = self.slots[start // self.interval % self.capacity]
+        if candle is not None and candle[0] == start:
+            return candle
+        return None
+
+    # 按时间顺序，最多 limit 根；中间没有成交的周期不出现
+    def items(self, limit=None):
+        if self.last is None:
+            return []
+        limit = self.capacity if limit is None else min(limit, self.capacity)
+        candles = []
+        for start in xrange(self.last, self.last - self.capacity * self.interval, -self.interval):
+            candle = self.get(start)
+            if candle is not None:
+                candles.append(candle)
+                if len(candles) == limit:
+                    break
+        candles.reverse()
+        return candles
+
+class Ticker(object):
+    WINDOW = 86400
+    STEP = 60
+
+    def __init__(self):
+        self._reset()
+        # 已经滑出窗口的分钟都不晚于它
+        self.horizon = None
+
+    def _reset(self):
+        self.minutes = Candles(self.STEP, self.WINDOW // self.STEP)
+        # 窗口里最早一根有成交的分钟
+        self.first = None
+        self.volume = self.quote_volume = amounts.engine.zero
+        self.count = 0
+        self.last_price = None
+        # 单调队列，元素是 (分钟, 价格)
+        self.highs = deque()
+        self.lows = deque()
+
+    def add(self, price, amount, quote, timestamp):
+        start = timestamp - timestamp % self.STEP
+        # 读的时候窗口已经越过了这笔成交
+        if self.horizon is not None and start <= self.horizon:
+            return
+        self.advance(timestamp)
+        if self.first is None:
+            self.first = start
+        self.minutes.add(price, amount, quote, timestamp)
+        self.volume += amount
+        self.quote_volume += quote
+        self.count += 1
+        self.last_price = price
+        _push(self.highs, start, price, ge)
+        _push(self.lows, start, price, le)
+
+    # 窗口移到以 now 所在的分钟结束
+    def advance(self, now):
+        bound = now - now % self.STEP - self.WINDOW
+        if self.horizon is not None and bound <= self.horizon:
+            return
+        self.horizon = bound
+        if self.first is not None and self.first <= bound:
+            self._expire(bound)
+
+    @property
+    def expires(self):
+        return None if self.first is None else self.first + self.WINDOW
+
+    # 开始时间不晚于 bound 的分钟滑出窗口
+    def _expire(self, bound):
+        minutes, step = self.minutes, self.STEP
+        if minutes.last <= bound:
+            self._reset()
+            return
+        start = self.first
+        while start <= bound:
+            candle = minutes.get(start)
+            if candle is not None:
+                self.volume -= candle[5]
+                self.quote_volume -= candle[6]
+                self.count -= candle[7]
+            start += step
+        while minutes.get(start) is None:
+            start += step
+        self.first = start
+        for queue in (self.highs, self.lows):
+            while queue[0][0] <= bound:
+                queue.popleft()
+
+    def as_json(self):
+        if self.last_price is None:
+            return None
+        to_json = amounts.to_json
+        return {
+            'since': self.first,
+            'open': to_json(self.minutes.get(self.first)[1]),
+            'high': to_json(self.highs[0][1]),
+            'low': to_json(self.lows[0][1]),
+            'last': to_json(self.last_price),
+            'volume': to_json(self.volume),
+            'quote_volume': to_json(self.quote_volume),
+            'count': self.count,
+        }
+
+# 队尾里被新价格支配的项都出队；同一分钟里已有更好的价格时不入队
+def _push(queue, start, price, dominates):
+    if queue and queue[-1][0] == start and not dominates(price, queue[-1][1]):
+        return
+    while queue and dominates(price, queue[-1][1]):
+        queue.pop()
+    queue.append((start, price))
+
+class Market(object):
+    def __init__(self, capacity):
+        self.timestamp = 0
+        self.candles = dict((name, Candles(interval, capacity)) for name, interval in INTERVALS)
+        self.ticker = Ticker()
+
+    def add(self, deal):
+        timestamp = self.timestamp = max(deal.timestamp, self.timestamp)
+        price, amount = deal.price, deal.amount
+        quote = amounts.engine.multiply(amount, price)
+        for candles in self.candles.itervalues():
+            candles.add(price, amount, quote, timestamp)
+        self.ticker.add(price, amount, quote, timestamp)
+
+class MarketData(object):
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.markets = {}
+
+    # 每一对成交记一次，deal 取其中任意一边
+    def add(self, exchange_id, deal):
+        market = self.markets.get(exchange_id)
+        if market is None:
+            market = self.markets[exchange_id] = Market(self.capacity)
+        market.add(deal)
+
+    # 周期不认识时返回 None
+    def candles_json(self, exchange_id, name, limit=None):
+        if name not in dict(INTERVALS):
+            return None
+        market = self.markets.get(exchange_id)
+        if market is None:
+            return []
+        to_json = amounts.to_json
+        return [[candle[0]] + [to_json(value) for value in candle[1:7]] + [candle[7]]
+                for candle in market.candles[name].items(limit)]
+
+    # 给了 now 时先把窗口移到 now
+    def ticker(self, exchange_id, now=None):
+        market = self.markets.get(exchange_id)
+        if market is None:
+            return None
+        if now is not None:
+            market.ticker.advance(now)
+        return market.ticker
@@ -1,29 +1,108 @@
-from flask import Flask
+# coding: utf-8
+import sys
+from json import dumps
+from flask import Flask, Response, request, abort, stream_with_context
+from meme.me.entities import Repository
+from meme.me.journal import Journal
+from meme.me import metrics as engine_metrics
+from .read_model import ReadModel
+
 app = Flask(__name__)
+read_model = None
+
+# 把 API 挂到一个 Repository 上，之后提交的 event 会更新读模型
+def attach(repo, **options):
+    global read_model
+    read_model = ReadModel(repo, **options)
+    return read_model
+
+def cached(key):
+    entry = read_model.get(key)
+    if entry is None:
+        abort(404)
+    etag, body = entry
+    if etag is None:
+        return Response(body, mimetype='application/json')
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+@app.route("/exchanges/<id>")
+def exchange(id):
+    return cached(('exchange', id))
 
-@app.route("/exchanges/:id")
-def exchange():
-    pass
+# K 线：[开始时间, 开盘, 最高, 最低, 收盘, 成交量, 成交额, 成交笔数]，周期是 1m、5m、1h 或 1d
+@app.route("/exchanges/<id>/candles/<interval>")
+def candles(id, interval):
+    return cached(('candles', id, interval))
 
-@app.route("/exchanges/:exchange_id/pending_orders/:id")
-def pending_order():
-    pass
+@app.route("/exchanges/<exchange_id>/pending_orders/<id>")
+def pending_order(exchange_id, id):
+    return cached(('order', exchange_id, id))
 
-@app.route("/credits/:id")
-def credit():
-    pass
+@app.route("/credits/<id>")
+def credit(id):
+    return cached(('credit', id))
 
-@app.route("/debits/:id")
-def debit():
-    pass
+@app.route("/debits/<id>")
+def debit(id):
+    return cached(('debit', id))
 
+# 不带 account_id 时返回所有账户的合计
 @app.route("/assets")
 def assets():
-    pass
+    return cached(('assets', request.args.get('account_id')))
 
+# 从 since_revision 之后开始读 event。
+# 默认返回 JSON 数组，timeout 秒内没有新 event 时一直挂着（长轮询）；
+# Accept: text/event-stream 时以 SSE 持续推送，断线重连用 Last-Event-ID 续上。
+# 游标早于缓冲区又没有 journal 可读时返回 410，Last-Event-ID 不是整数时返回 400。
 @app.route("/events")
 def events():
-    pass
+    since = request.args.get('since_revision', request.args.get('since', 0, type=int), type=int)
+    limit = min(request.args.get('limit', 1000, type=int), 1000)
+    if request.accept_mimetypes.best == 'text/event-stream':
+        try:
+            since = int(request.headers.get('Last-Event-ID', since))
+        except ValueError:
+            abort(400)
+        if read_model.events_since(since, 0) is None:
+            abort(410)
+        return Response(stream_with_context(stream_events(since, limit)), mimetype='text/event-stream')
+    timeout = min(request.args.get('timeout', 0, type=float), MAX_TIMEOUT)
+    events = read_model.events_since(since, limit)
+    if events == [] and timeout > 0 and read_model.repo.events.wait(since, timeout):
+        events = read_model.events_since(since, limit)
+    if events is None:
+        abort(410)
+    return Response(dumps([event.as_json() for event in events]), mimetype='application/json')
+
+MAX_TIMEOUT = 30
+
+def stream_events(since, limit):
+    while True:
+        events = read_model.events_since(since, limit)
+        if events is None:
+            return
+        for event in events:
+            yield "id: %d\ndata: %s\n\n" % (event.revision, event.to_json())
+            since = event.revision
+        if not events and not read_model.repo.events.wait(since, MAX_TIMEOUT):
+            yield ": keepalive\n\n"
+
+# Prometheus 文本格式；没有 enable 时只有盘口和挂单这些即时计算的数据
+@app.route("/metrics")
+def metrics():
+    return Response(engine_metrics.render(read_model.repo), mimetype='text/plain; version=0.0.4')
 
+# python -m meme.api.me events.log
 if __name__ == "__main__":
+    repo = Repository(journal=Journal(sys.argv[1]), dedup_path=sys.argv[1] + '.dedup') if len(sys.argv) > 1 else Repository()
+    # 先挂上读模型再回放，K 线和 ticker 从 journal 里的成交重建
+    attach(repo)
+    repo.sync()
+    engine_metrics.enable()
     app.run()
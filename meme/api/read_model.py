@@ -0,0 +1,241 @@
+# coding: utf-8
+# API 用的读模型。
+#
+# 订阅 Repository 的 event，每个资源的 JSON 响应第一次被请求时序列化一次，
+# 连同 ETag（生成时的 revision）缓存起来；只有影响到它的 event 才会让缓存失效。
+# 反复轮询同一个盘口或余额只是一次字典查找。
+#
+# K 线和 ticker 由 MarketData 随成交更新，读的时候和别的资源一样只是序列化一次。
+# ticker 的窗口还会随时间移动，带 ticker 的盘口缓存到窗口里最早那一分钟滑出去为止，
+# ETag 里也带上这个时间。
+#
+# 网关的撮合线程提交 event，Flask 在别的线程处理请求。读模型自己的状态（缓存、行情、合计）
+# 用一把锁保护，生成 JSON 和序列化都在锁外面，慢的请求不会挡住撮合线程里的 on_event。
+# 撮合线程改 Repository 不经过这把锁，所以只缓存已经发布过的状态：生成前后 revision 都等于
+# 最后一个 on_event 的 revision，中间也没有回滚过。batch 里的 event 要到整批落盘之后才发布，
+# 生成时 Repository 领先于读模型、读到一半或者读到后来被撤销的修改时，结果照常返回但不缓存，
+# 也不带 ETag，免得这个 revision 被回滚之后再用到别的内容上。
+#
+# 充值和提现的记录只留最近 records 条，更早的返回 404。
+import time
+import threading
+from json import dumps
+from itertools import islice
+from collections import OrderedDict
+from meme.me import amounts
+from meme.me.events import AccountCreated, AccountCanceled, AccountCredited, AccountDebited, ExchangeCreated, OrderCreated, OrderCanceled, OrderDealt, OrderTaken, AuctionStarted, AuctionCleared, OrdersMassCanceled
+from .market_data import MarketData, INTERVALS
+
+class ReadModel(object):
+    def __init__(self, repo, depth=20, candles=1000, records=100000):
+        self.repo = repo
+        self.depth = depth
+        self.records = records
+        self.lock = threading.RLock()
+        self.clock = time.time
+        self.cache = {}
+        # 最后一个 on_event 的 revision
+        self.revision = repo.revision
+        self.credits = OrderedDict()
+        self.debits = OrderedDict()
+        self.market_data = MarketData(candles)
+        # 成交的 event 里没有交易对，完全成交的订单又已经从 Repository 里删掉了，只能自己记着
+        self.order_exchanges = dict((order.id, order.exchange_id) for order in repo.orders.entities.itervalues())
+        self.totals = {}
+        for coin_type, (active, frozen) in repo.balances.totals().items():
+            self._add_totals(coin_type, active, frozen)
+        repo.subscribe(self.on_event)
+
+    # 返回 (etag, body)，资源不存在时返回 None；结果不能缓存时 etag 是 None
+    def get(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and (entry[2] is None or self.clock() < entry[2]):
+                return entry[:2]
+        repo = self.repo
+        revision, rollbacks = repo.revision, repo.rollbacks
+        json = getattr(self, '_build_' + key[0])(*key[1:])
+        if json is None:
+            return None
+        expires = self._expires(key)
+        body = dumps(json)
+        with self.lock:
+            if revision == self.revision == repo.revision and rollbacks == repo.rollbacks:
+                etag = str(revision) if expires is None else '%s.%s' % (revision, expires)
+                self.cache[key] = (etag, body, expires)
+                return etag, body
+        return None, body
+
+    # 先查 Repository 的环形缓冲区，游标太旧时从 journal 读；都没有时返回 None
+    def events_since(self, revision, limit=1000):
+        events = self.repo.events.since(revision, limit)
+        if events is not None:
+            return events
+        journal = self.repo.journal
+        if journal is None:
+            return None
+        events = list(islice(journal.read(revision), limit))
+        # journal 里只有已经落盘的部分，剩下的接着从缓冲区取
+        last = events[-1].revision if events else revision
+        if len(events) < limit:
+            events.extend(self.repo.events.since(last, limit - len(events)) or [])
+        return events
+
+    def on_event(self, event):
+        with self.lock:
+            self._on_event(event)
+
+    def _on_event(self, event):
+        self.revision = event.revision
+        klass = type(event)
+        keys = []
+        revisions = []
+        if klass is AccountCreated or klass is AccountCanceled:
+            keys.append(('assets', event.account_id))
+        elif klass is AccountCredited or klass is AccountDebited:
+            records = self.credits if klass is AccountCredited else self.debits
+            records[event.id] = event.as_json()
+            if len(records) > self.records:
+                records.popitem(last=False)
+            revisions.append(event.balance_revision)
+        elif klass is ExchangeCreated:
+            keys.append(('exchange', '%s-%s' % (event.coin_type, event.price_type)))
+        elif klass is OrderCreated:
+            self.order_exchanges[event.order.id] = event.order.exchange_id
+            keys.append(('exchange', event.order.exchange_id))
+            keys.append(('order', event.order.exchange_id, event.order.id))
+            revisions.append(event.balance_revision)
+        elif klass is OrderCanceled:
+            keys.extend(self._order_keys(event.order_id, True))
+            revisions.append(event.balance_revision)
+        elif klass is OrderDealt:
+            self._add_deals(self.order_exchanges.get(event.bid_deal.order_id), [event.bid_deal], keys)
+            for deal in (event.bid_deal, event.ask_deal):
+                keys.extend(self._order_keys(deal.order_id, deal.rest_amount == 0))
+            revisions.extend(event.bid_balance_revisions + event.ask_balance_revisions)
+        elif klass is OrderTaken:
+            keys.append(('exchange', event.order.exchange_id))
+            self._add_deals(event.order.exchange_id, [maker_deal for taker_deal, maker_deal in event.deals], keys)
+            for taker_deal, maker_deal in event.deals:
+                keys.extend(self._order_keys(maker_deal.order_id, maker_deal.rest_amount == 0))
+            revisions.extend(event.balance_revisions)
+        elif klass is OrdersMassCanceled:
+            for order_id in event.order_ids:
+                keys.extend(self._order_keys(order_id, True))
+            revisions.extend(event.balance_revisions)
+        elif klass is AuctionStarted:
+            keys.append(('exchange', event.exchange_id))
+        elif klass is AuctionCleared:
+            keys.append(('exchange', event.exchange_id))
+            self._add_deals(event.exchange_id, [bid_deal for bid_deal, ask_deal in event.deals], keys)
+            for deals in event.deals:
+                for deal in deals:
+                    keys.extend(self._order_keys(deal.order_id, deal.rest_amount == 0))
+            revisions.extend(event.balance_revisions)
+        for revision in revisions:
+            self._add_totals(revision.coin_type, revision.active_diff, revision.frozen_diff)
+            keys.append(('assets', revision.account_id))
+        if revisions:
+            keys.append(('assets', None))
+        for key in keys:
+            self.cache.pop(key, None)
+
+    # 每对成交只记一边的 Deal
+    def _add_deals(self, exchange_id, deals, keys):
+        if not deals or exchange_id is None:
+            return
+        for deal in deals:
+            self.market_data.add(exchange_id, deal)
+        keys.append(('exchange', exchange_id))
+        keys.extend(('candles', exchange_id, name) for name, interval in INTERVALS)
+
+    # 不知道属于哪个交易对的订单只好让所有盘口失效
+    def _order_keys(self, order_id, done):
+        exchange_id = self.order_exchanges.pop(order_id, None) if done else self.order_exchanges.get(order_id)
+        if exchange_id is None:
+            keys = [key for key in self.cache if key[0] in ('exchange', 'order')]
+        else:
+            keys = [('exchange', exchange_id), ('order', exchange_id, order_id)]
+        return keys
+
+    def _add_totals(self, coin_type, active, frozen):
+        total = self.totals.setdefault(coin_type, [amounts.engine.zero, amounts.engine.zero])
+        total[0] += active
+        total[1] += frozen
+
+    def _build_exchange(self, exchange_id):
+        exchange = self.repo.exchanges.get(exchange_id)
+        if exchange is None:
+            return None
+        bids, asks = exchange.depth(self.depth)
+        json = {
+            'id': exchange.id,
+            'coin_type': exchange.coin_type,
+            'price_type': exchange.price_type,
+            'revision': self.repo.revision,
+            'auction': exchange.auction,
+            'ticker': self._ticker_json(exchange.id),
+            'bids': [_level_json(level) for level in bids],
+            'asks': [_level_json(level) for level in asks],
+        }
+        # 集合竞价期间给出按当前盘口算的参考成交价和成交量
+        if exchange.auction:
+            price, volume = exchange.clearing_price()
+            json['indicative_price'] = None if price is None else amounts.to_json(price)
+            json['indicative_volume'] = amounts.to_json(volume)
+        return json
+
+    # 行情由 on_event 更新，读的时候也要持有锁
+    def _ticker_json(self, exchange_id):
+        with self.lock:
+            ticker = self.market_data.ticker(exchange_id, int(self.clock()))
+            return None if ticker is None else ticker.as_json()
+
+    # 缓存的过期时间，None 是不会过期
+    def _expires(self, key):
+        if key[0] == 'exchange':
+            with self.lock:
+                ticker = self.market_data.ticker(key[1])
+                return None if ticker is None else ticker.expires
+        return None
+
+    def _build_candles(self, exchange_id, name):
+        if self.repo.exchanges.get(exchange_id) is None:
+            return None
+        with self.lock:
+            return self.market_data.candles_json(exchange_id, name)
+
+    def _build_order(self, exchange_id, order_id):
+        order = self.repo.orders.get(order_id)
+        if order is None or order.exchange_id != exchange_id:
+            return None
+        return order.as_json()
+
+    def _build_credit(self, id):
+        with self.lock:
+            return self.credits.get(id)
+
+    def _build_debit(self, id):
+        with self.lock:
+            return self.debits.get(id)
+
+    # account_id 为 None 时是全部账户的合计
+    def _build_assets(self, account_id):
+        if account_id is None:
+            with self.lock:
+                balances = [(coin_type, tuple(total)) for coin_type, total in self.totals.items()]
+        else:
+            account = self.repo.accounts.get(account_id)
+            if account is None:
+                return None
+            balances = [(coin_type, (b.active, b.frozen)) for coin_type, b in account.balances.items()]
+        return {
+            'account_id': account_id,
+            'revision': self.repo.revision,
+            'balances': dict((coin_type, {'active': amounts.to_json(active), 'frozen': amounts.to_json(frozen)})
+                for coin_type, (active, frozen) in balances),
+        }
+
+def _level_json(level):
+    price, amount, count = level
+    return [amounts.to_json(price), amounts.to_json(amount), count]
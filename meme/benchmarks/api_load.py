@@ -0,0 +1,68 @@
+import sys, os
+import time
+import threading
+import urllib2
+sys.path.append(os.path.realpath(os.path.join(__file__, '../../..')))
+from werkzeug.serving import make_server, WSGIRequestHandler
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated
+from meme.api import me
+
+# python meme/benchmarks/api_load.py [clients] [seconds]
+# polls the book and a balance of a local dev server, half of the clients revalidate with If-None-Match
+
+URLS = ['/exchanges/ltc-btc', '/assets?account_id=account1', '/assets', '/exchanges/ltc-btc/pending_orders/bid1']
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args):
+        pass
+
+def build_repo(orders):
+    repo = Repository()
+    repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+    for account_id in ['account1', 'account2']:
+        repo.commit(AccountCreated.build(repo, account_id))
+        repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 10 ** 9))
+        repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 10 ** 9))
+    for i in xrange(orders):
+        repo.commit(OrderCreated.build(repo, 'bid%d' % i, BidOrder, 'account1', 'ltc', 'btc', price='%.2f' % (0.5 - i % 40 * 0.01), amount=1, fee_rate=0.001, timestamp=i + 1))
+        repo.commit(OrderCreated.build(repo, 'ask%d' % i, AskOrder, 'account2', 'ltc', 'btc', price='%.2f' % (0.6 + i % 40 * 0.01), amount=1, fee_rate=0.001, timestamp=i + 1))
+    return repo
+
+def poll(base, revalidate, deadline, counts):
+    etags = {}
+    count = 0
+    while time.time() < deadline:
+        for url in URLS:
+            request = urllib2.Request(base + url)
+            if revalidate and url in etags:
+                request.add_header('If-None-Match', etags[url])
+            try:
+                response = urllib2.urlopen(request)
+                etags[url] = response.info().getheader('ETag')
+                response.read()
+            except urllib2.HTTPError as e:
+                if e.code != 304:
+                    raise
+            count += 1
+    counts.append(count)
+
+def benchmark(clients, seconds):
+    me.attach(build_repo(10000))
+    server = make_server('127.0.0.1', 0, me.app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base = 'http://127.0.0.1:%d' % server.server_port
+    counts = []
+    deadline = time.time() + seconds
+    pollers = [threading.Thread(target=poll, args=(base, i % 2 == 1, deadline, counts)) for i in range(clients)]
+    [poller.start() for poller in pollers]
+    [poller.join() for poller in pollers]
+    server.shutdown()
+    return (sum(counts), seconds, sum(counts) / float(seconds))
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print "%d requests in %s seconds, %s requests per second" % benchmark(clients, seconds)
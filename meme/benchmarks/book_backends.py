@@ -0,0 +1,68 @@
+import sys, os
+import random
+from timeit import default_timer
+sys.path.append(os.path.realpath(os.path.join(__file__, '../../..')))
+from meme.me.entities import Exchange, AskOrder, BidOrder
+from meme.me import amounts, book
+
+# python meme/benchmarks/book_backends.py [orders] [decimal|integer]
+# compares the book backends on the same order flow, touching only the Exchange:
+#   near_top  new orders land a few ticks from the touch, a third of them are canceled and the best level is read after every order
+#   deep      prices spread evenly over 2000 levels on each side, same mix of adds, cancels and reads
+#   sweep     a fully crossed book over 2000 levels is matched away from the top with match(pop=True)
+
+TICK = 0.0001
+
+# crossed books put the bids above the asks, so that every level matches
+def price(mid, side, distance, crossed):
+    offset = distance * TICK
+    return '%.4f' % (mid - offset if (side is BidOrder) != crossed else mid + offset)
+
+def build_orders(count, distance, crossed):
+    rand = random.Random(7)
+    orders = []
+    for i in xrange(count):
+        side = rand.choice([BidOrder, AskOrder])
+        orders.append(side('order%d' % i, 'account1', 'ltc', 'btc', price(1.0, side, 1 + distance(rand), crossed), '1', '0.001', i + 1))
+    return orders
+
+def churn(orders):
+    exchange = Exchange('ltc', 'btc')
+    rand = random.Random(11)
+    resting = []
+    start = default_timer()
+    for order in orders:
+        exchange.enqueue(order)
+        resting.append(order)
+        if rand.random() < 0.33:
+            exchange.dequeue(resting.pop(rand.randrange(len(resting))))
+        exchange.best_bid()
+        exchange.best_ask()
+    return len(orders), default_timer() - start
+
+def sweep(orders):
+    exchange = Exchange('ltc', 'btc')
+    for order in orders:
+        exchange.enqueue(order)
+    start = default_timer()
+    operations = 0
+    while exchange.match(pop=True) != (None, None):
+        operations += 1
+    return operations, default_timer() - start
+
+SHAPES = [
+    ('near_top', churn, lambda rand: int(rand.expovariate(0.5)), False),
+    ('deep', churn, lambda rand: rand.randrange(2000), False),
+    ('sweep', sweep, lambda rand: rand.randrange(2000), True),
+]
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    if len(sys.argv) > 2:
+        amounts.use(sys.argv[2])
+    for name, run, distance, crossed in SHAPES:
+        orders = build_orders(count, distance, crossed)
+        for book_name in sorted(book.BOOKS):
+            book.use(book_name)
+            operations, seconds = run([order.clone() for order in orders])
+            print "%-10s %-8s %8d ops %10.0f ops/s" % (name, book_name, operations, operations / seconds)
@@ -0,0 +1,48 @@
+import sys, os
+import time
+sys.path.append(os.path.realpath(os.path.join(__file__, '../../..')))
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated, OrderCanceled
+from meme.me.codecs import PickleCodec, JsonCodec, BinaryCodec
+from meme.me import amounts
+
+# python meme/benchmarks/event_codecs.py [decimal|integer]
+
+def build_events(count):
+    repo = Repository()
+    events = []
+    def commit(event):
+        repo.commit(event)
+        events.append(event)
+    commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+    for account_id in ['account1', 'account2']:
+        commit(AccountCreated.build(repo, account_id))
+        commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 1000000))
+        commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 1000000))
+    exchange = repo.exchanges.find('ltc-btc')
+    i = 0
+    while len(events) < count:
+        commit(OrderCreated.build(repo, 'ask%d' % i, AskOrder, 'account1', 'ltc', 'btc', price='0.1', amount='0.02', fee_rate='0.001', timestamp=i + 1))
+        commit(OrderCreated.build(repo, 'bid%d' % i, BidOrder, 'account2', 'ltc', 'btc', price='0.1', amount='0.01', fee_rate='0.001', timestamp=i + 1))
+        events.extend(exchange.match_all(repo))
+        commit(OrderCanceled.build(repo, 'ask%d' % i))
+        i += 1
+    return events
+
+def benchmark(codec, events):
+    timestamp_start = time.time()
+    payloads = [codec.encode(event) for event in events]
+    encode_seconds = time.time() - timestamp_start
+    timestamp_start = time.time()
+    [codec.decode(payload) for payload in payloads]
+    decode_seconds = time.time() - timestamp_start
+    size = sum(len(payload) for payload in payloads)
+    return (len(events) / encode_seconds, len(events) / decode_seconds, float(size) / len(events))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        amounts.use(sys.argv[1])
+    events = build_events(20000)
+    for codec in [PickleCodec(), JsonCodec(), BinaryCodec()]:
+        result = (codec.__class__.__name__, ) + benchmark(codec, events)
+        print "%-12s encode %10.0f events/s  decode %10.0f events/s  %6.1f bytes/event" % result
@@ -0,0 +1,64 @@
+import sys, os
+import time
+import socket
+import multiprocessing
+from json import dumps, loads
+sys.path.append(os.path.realpath(os.path.join(__file__, '../../..')))
+from meme.me.entities import Repository
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated
+from meme.api.gateway import Gateway
+from meme.me import amounts
+
+# python meme/benchmarks/gateway_latency.py [orders] [window] [decimal|integer]
+# end-to-end latency from sending an order to receiving its acknowledgement,
+# with at most `window` orders in flight; the gateway runs in its own process
+
+def serve(conn, engine_name):
+    amounts.use(engine_name)
+    repo = Repository()
+    repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+    for account_id in ['account1', 'account2']:
+        repo.commit(AccountCreated.build(repo, account_id))
+        repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 10 ** 9))
+        repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 10 ** 9))
+    gateway = Gateway(repo, ('127.0.0.1', 0))
+    gateway.start()
+    conn.send(gateway.address)
+    conn.recv()
+    gateway.stop()
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def benchmark(count, window):
+    conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serve, args=(child_conn, amounts.engine.name))
+    process.start()
+    sock = socket.create_connection(conn.recv())
+    reader = sock.makefile('r')
+    sent_at = {}
+    latencies = []
+    timestamp_start = time.time()
+    for seq in xrange(count + window):
+        if seq < count:
+            side, account_id = ('ask', 'account1') if seq % 2 else ('bid', 'account2')
+            command = {'seq': seq, 'command': 'order', 'order_id': 'order%d' % seq, 'side': side, 'account_id': account_id,
+                    'coin_type': 'ltc', 'price_type': 'btc', 'price': '0.1', 'amount': '0.01', 'fee_rate': '0.001', 'timestamp': seq + 1}
+            sent_at[seq] = time.time()
+            sock.sendall(dumps(command) + '\n')
+        if seq >= window:
+            reply = loads(reader.readline())
+            latencies.append(time.time() - sent_at.pop(reply['seq']))
+    seconds = time.time() - timestamp_start
+    conn.send('stop')
+    process.join()
+    sock.close()
+    latencies.sort()
+    return (count, seconds, count / seconds) + tuple(percentile(latencies, p) * 1000 for p in (0.5, 0.99, 0.999))
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    window = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    if len(sys.argv) > 3:
+        amounts.use(sys.argv[3])
+    print "%d orders in %.2f seconds, %.0f orders per second, latency p50 %.2f ms, p99 %.2f ms, p999 %.2f ms" % benchmark(count, window)
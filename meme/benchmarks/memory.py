@@ -0,0 +1,67 @@
+import sys, os
+import gc
+import resource
+import multiprocessing
+sys.path.append(os.path.realpath(os.path.join(__file__, '../../..')))
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated
+from meme.me import amounts
+
+# python meme/benchmarks/memory.py [orders] [accounts] [decimal|integer]
+# resident memory per resting order (entity, book entry and dedup id) and per account with two balances
+
+def rss():
+    gc.collect()
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def create_accounts(repo, count, prefix='account'):
+    for i in xrange(count):
+        account_id = '%s%d' % (prefix, i)
+        repo.commit(AccountCreated.build(repo, account_id))
+        repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 10 ** 6))
+        repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 10 ** 6))
+
+def measure_orders(count):
+    repo = Repository()
+    repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+    create_accounts(repo, 1000)
+    start = rss()
+    for i in xrange(count):
+        account_id = 'account%d' % (i % 1000)
+        if i % 2:
+            repo.commit(OrderCreated.build(repo, 'bid%d' % i, BidOrder, account_id, 'ltc', 'btc', '%.2f' % (0.01 + i % 100 * 0.01), '0.1', '0.001', i + 1))
+        else:
+            repo.commit(OrderCreated.build(repo, 'ask%d' % i, AskOrder, account_id, 'ltc', 'btc', '%.2f' % (2 + i % 100 * 0.01), '0.1', '0.001', i + 1))
+    return (rss() - start) / float(count)
+
+def measure_accounts(count):
+    repo = Repository()
+    start = rss()
+    create_accounts(repo, count)
+    return (rss() - start) / float(count)
+
+def run(task):
+    f, count, engine_name = task
+    amounts.use(engine_name)
+    return f(count)
+
+# a fresh process per measurement so earlier allocations do not skew the numbers
+def measure(f, count):
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run, ((f, count, amounts.engine.name),))
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == '__main__':
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    accounts = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    if len(sys.argv) > 3:
+        amounts.use(sys.argv[3])
+    print "%d resting orders, %.0f bytes per order" % (orders, measure(measure_orders, orders))
+    print "%d accounts, %.0f bytes per account" % (accounts, measure(measure_accounts, accounts))
@@ -0,0 +1,42 @@
+import sys, os
+import time
+import multiprocessing
+sys.path.append(os.path.realpath(os.path.join(__file__, '../../..')))
+from meme.me.shard import ShardedEngine
+from meme.me import amounts
+
+# python meme/benchmarks/sharded_engine.py [decimal|integer]
+# one matcher process per pair; throughput should grow with the pairs until the cores run out
+
+def benchmark(pairs_count, orders_per_pair, batch=100):
+    pairs = [('coin%d' % i, 'btc') for i in range(pairs_count)]
+    engine = ShardedEngine([[pair] for pair in pairs])
+    engine.start()
+    try:
+        for account_id in ['account1', 'account2']:
+            engine.create_account(account_id)
+            engine.credit('btc-' + account_id, account_id, 'btc', 10 ** 9)
+            for coin_type, price_type in pairs:
+                engine.credit('%s-%s' % (coin_type, account_id), account_id, coin_type, 10 ** 9)
+        orders = []
+        for i in range(orders_per_pair):
+            for coin_type, price_type in pairs:
+                for side, account_id in (('ask', 'account1'), ('bid', 'account2')):
+                    orders.append({'id': '%s-%s%d' % (coin_type, side, i), 'side': side, 'account_id': account_id,
+                        'coin_type': coin_type, 'price_type': price_type, 'price': '0.1', 'amount': '0.01',
+                        'fee_rate': '0.001', 'timestamp': i + 1})
+        batch *= pairs_count
+        timestamp_start = time.time()
+        for i in xrange(0, len(orders), batch):
+            engine.submit(orders[i:i + batch])
+        seconds = time.time() - timestamp_start
+    finally:
+        engine.stop()
+    return (len(orders), pairs_count, seconds, len(orders) / seconds)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        amounts.use(sys.argv[1])
+    print "%d cores" % multiprocessing.cpu_count()
+    for pairs_count in [1, 2, 4, 8]:
+        print "trade %d orders on %d pairs in %s seconds, %s orders per second" % benchmark(pairs_count, 2000)
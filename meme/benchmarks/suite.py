@@ -0,0 +1,237 @@
+# coding: utf-8
+from __future__ import print_function
+import sys, os
+import json
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from timeit import default_timer
+sys.path.append(os.path.realpath(os.path.join(__file__, '../../..')))
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated, OrderCanceled
+from meme.me.journal import Journal
+from meme.me.replay import replay_journal
+from meme.me import amounts, book, metrics
+
+# python meme/benchmarks/suite.py [--scale 1.0] [--engine decimal|integer] [--book ladder|rbtree] [--output results.json]
+#                                 [--baseline baseline.json [--tolerance 0.25]] [--only deep_book ...] [--metrics]
+#
+# every scenario runs in its own process so peak memory is per scenario, and reports
+# throughput, per operation latency percentiles and peak RSS. With --baseline the results are
+# compared against a stored run and the exit status is 1 when any scenario regressed by more
+# than the tolerance; --output writes the results, which is also how the baseline is made.
+# A baseline is only comparable when it was recorded with the same engine, book, scale and
+# Python version (exit status 2 otherwise), and on the same machine: the numbers are absolute,
+# so the checked in baseline.json only holds on the machine that recorded it. Regenerate it
+# there with `make benchmark-baseline` before using `make benchmark` elsewhere.
+
+METRICS = (('throughput', -1), ('p99', 1), ('peak_rss', 1))
+
+# settings that must match between a run and its baseline
+SETTINGS = ('engine', 'book', 'scale', 'python')
+
+class Scenario(object):
+    def __init__(self, accounts=2, seed=1, journal=None):
+        self.repo = Repository(journal=journal)
+        self.random = random.Random(seed)
+        self.accounts = ['account%d' % i for i in range(accounts)]
+        self.exchange = self.setup()
+        self.next_id = 0
+        self.latencies = []
+
+    def setup(self):
+        repo = self.repo
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        for account_id in self.accounts:
+            repo.commit(AccountCreated.build(repo, account_id))
+            repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 10 ** 9))
+            repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 10 ** 9))
+        return repo.exchanges.find('ltc-btc')
+
+    def place(self, klass, price, amount, account_id=None):
+        self.next_id += 1
+        order_id = 'order%d' % self.next_id
+        account_id = account_id or self.accounts[self.next_id % len(self.accounts)]
+        start = default_timer()
+        self.repo.commit(OrderCreated.build(self.repo, order_id, klass, account_id, 'ltc', 'btc', price, amount, '0.001', self.next_id))
+        self.exchange.match_all(self.repo)
+        self.latencies.append(default_timer() - start)
+        return order_id
+
+    def cancel(self, order_id):
+        start = default_timer()
+        self.repo.commit(OrderCanceled.build(self.repo, order_id))
+        self.latencies.append(default_timer() - start)
+
+    def price(self, low, high):
+        return '%.3f' % (self.random.randint(low, high) * 0.001)
+
+# 买卖各 500 档，约 10% 的单子会吃掉对手盘
+def deep_book(count, scenario=None):
+    scenario = scenario or Scenario()
+    for i in range(count):
+        crossing = scenario.random.random() < 0.1
+        if i % 2:
+            scenario.place(BidOrder, scenario.price(100, 110) if crossing else scenario.price(50, 549), '0.1')
+        else:
+            scenario.place(AskOrder, scenario.price(540, 550) if crossing else scenario.price(550, 1049), '0.1')
+    return scenario
+
+# 每下一单撤九成，撤的是随机一个还挂着的单子
+def heavy_cancel(count):
+    scenario = Scenario()
+    live = []
+    while len(scenario.latencies) < count:
+        klass = BidOrder if scenario.random.random() < 0.5 else AskOrder
+        price = scenario.price(50, 99) if klass is BidOrder else scenario.price(101, 150)
+        live.append(scenario.place(klass, price, '0.1'))
+        if scenario.random.random() < 0.9:
+            index = scenario.random.randrange(len(live))
+            live[index], live[-1] = live[-1], live[index]
+            scenario.cancel(live.pop())
+    return scenario
+
+def many_accounts(count):
+    scenario = Scenario(accounts=5000)
+    for i in range(count):
+        account_id = scenario.random.choice(scenario.accounts)
+        if i % 2:
+            scenario.place(BidOrder, scenario.price(95, 104), '0.1', account_id)
+        else:
+            scenario.place(AskOrder, scenario.price(96, 105), '0.1', account_id)
+    return scenario
+
+# 大卖单被很多小买单一点点吃掉
+def partial_fills(count):
+    scenario = Scenario()
+    for i in range(count):
+        if i % 50 == 0:
+            scenario.place(AskOrder, '0.100', '10', 'account0')
+        else:
+            scenario.place(BidOrder, '0.100', '0.%02d' % scenario.random.randint(1, 20), 'account1')
+    return scenario
+
+# 先铺 50 档卖单，再用一个大买单一次扫光
+def aggressive_sweep(count):
+    scenario = Scenario()
+    while len(scenario.latencies) < count:
+        for level in range(50):
+            scenario.place(AskOrder, '%.3f' % ((100 + level) * 0.001), '0.1', 'account0')
+        scenario.place(BidOrder, '0.149', '5', 'account1')
+    return scenario
+
+# 把 deep_book 的 event 写进 journal，计时的是打开 journal 并重放出 Repository
+def restart(count, repeat=5):
+    path = tempfile.mkdtemp()
+    filename = os.path.join(path, 'events.log')
+    try:
+        journal = Journal(filename, group_interval=0)
+        scenario = deep_book(count, Scenario(journal=journal))
+        journal.close()
+        scenario.latencies = []
+        for i in range(repeat):
+            start = default_timer()
+            journal = Journal(filename, group_interval=0)
+            replay_journal(journal, processes=1)
+            journal.close()
+            scenario.latencies.append(default_timer() - start)
+        scenario.operations = journal.revision * repeat
+        return scenario
+    finally:
+        shutil.rmtree(path)
+
+SCENARIOS = [
+    ('deep_book', deep_book, 20000),
+    ('heavy_cancel', heavy_cancel, 20000),
+    ('many_accounts', many_accounts, 20000),
+    ('partial_fills', partial_fills, 20000),
+    ('aggressive_sweep', aggressive_sweep, 20000),
+    ('restart', restart, 5000),
+]
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run(task):
+    name, count, engine_name, book_name, instrumented = task
+    amounts.use(engine_name)
+    book.use(book_name)
+    if instrumented:
+        metrics.enable()
+    scenario = dict((n, f) for n, f, c in SCENARIOS)[name](count)
+    latencies = sorted(scenario.latencies)
+    seconds = sum(latencies)
+    operations = getattr(scenario, 'operations', len(latencies))
+    # Linux 上 ru_maxrss 的单位是 KB
+    return {
+        'operations': operations,
+        'seconds': seconds,
+        'throughput': operations / seconds,
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'p999': percentile(latencies, 0.999) * 1000,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for metric, direction in METRICS:
+            change = (result[metric] - expected[metric]) / float(expected[metric])
+            if change * direction > tolerance:
+                regressions.append((name, metric, expected[metric], result[metric], change * 100))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the matching engine benchmark scenarios')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the operations of every scenario')
+    parser.add_argument('--engine', default=amounts.engine.name, choices=sorted(amounts.ENGINES))
+    parser.add_argument('--book', default=book.book, choices=sorted(book.BOOKS))
+    parser.add_argument('--only', nargs='+', choices=[name for name, f, c in SCENARIOS])
+    parser.add_argument('--metrics', action='store_true', help='run with meme.me.metrics enabled')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against the results stored in this file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative change before flagging a regression')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, f, count in SCENARIOS:
+        if args.only and name not in args.only:
+            continue
+        pool = multiprocessing.Pool(1)
+        try:
+            results[name] = result = pool.apply(run, ((name, max(1, int(count * args.scale)), args.engine, args.book, args.metrics),))
+        finally:
+            pool.close()
+            pool.join()
+        print("%-16s %8d ops %10.0f ops/s  p50 %8.3f ms  p99 %8.3f ms  p999 %8.3f ms  peak %7d KB" % (
+            name, result['operations'], result['throughput'], result['p50'], result['p99'], result['p999'], result['peak_rss']))
+
+    report = {'engine': args.engine, 'book': args.book, 'scale': args.scale, 'python': sys.version.split()[0], 'scenarios': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatched = [key for key in SETTINGS if baseline.get(key) != report[key]]
+        if mismatched:
+            print("baseline was recorded with %s, not comparable" % ', '.join(
+                '%s %s' % (key, baseline.get(key, 'unknown')) for key in mismatched))
+            return 2
+        regressions = compare(results, baseline['scenarios'], args.tolerance)
+        for regression in regressions:
+            print("REGRESSION %s %s: %.3f -> %.3f (%+.1f%%)" % regression)
+        if regressions:
+            return 1
+        print("no regressions against %s" % args.baseline)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# coding: utf-8
+# 金额运算引擎。
+#
+# 默认的 DecimalAmounts 就是原来的 Decimal 实现；IntegerAmounts 把所有金额
+# 存成 10^PRECISION 为单位的整数，舍入规则与 Decimal 版逐位一致，
+# 只在数据进出撮合引擎时才和 Decimal 互转。
+#
+# 引擎是全局的，要在创建任何实体之前用 use() 选好，不同引擎产生的值不能混用。
+from decimal import Decimal, Context, ROUND_DOWN, ROUND_HALF_EVEN
+from .consts import PRECISION, PRECISION_EXP
+from .errors import ValidationError
+
+# 精度足够大，乘法和加法都是精确的，只在最后 quantize 时舍入一次，和整数版一样。
+# 默认 context 只有 28 位，金额大的时候乘积会先被舍入一次，结果可能差一位
+EXACT = Context(prec=999999999, Emax=999999999, Emin=-999999999)
+
+class DecimalAmounts(object):
+    name = 'decimal'
+    zero = Decimal(0)
+    interned = {}
+
+    # 外部传进来的值
+    def price(self, value):
+        return Decimal(value).quantize(PRECISION_EXP)
+
+    def amount(self, value):
+        return Decimal(value).quantize(PRECISION_EXP, ROUND_DOWN)
+
+    def rate(self, value):
+        return Decimal(value)
+
+    def parse(self, value):
+        return Decimal(value)
+
+    # 内部运算；Decimal 不可变，已经是 Decimal 的值和整数 0 不必再创建新对象
+    def balance(self, value):
+        if type(value) is Decimal:
+            return value
+        if value == 0 and isinstance(value, (int, long)):
+            return self.zero
+        return Decimal(value)
+
+    def quantize(self, value):
+        return value.quantize(PRECISION_EXP, ROUND_HALF_EVEN, EXACT)
+
+    def round_down(self, value):
+        return value.quantize(PRECISION_EXP, ROUND_DOWN, EXACT)
+
+    def multiply(self, value, factor):
+        return EXACT.multiply(value, factor).quantize(PRECISION_EXP, ROUND_DOWN, EXACT)
+
+    def freeze(self, amount, price, fee_rate):
+        return EXACT.multiply(EXACT.multiply(amount, price), EXACT.add(1, fee_rate)).quantize(PRECISION_EXP, ROUND_HALF_EVEN, EXACT)
+
+    # 传出去的值
+    def to_decimal(self, value):
+        return value
+
+class IntegerAmounts(object):
+    name = 'integer'
+    zero = 0
+    interned = {}
+    scale = 10 ** PRECISION
+
+    # 价格和数量的转换与 DecimalAmounts 完全相同，包括 float 的二进制展开
+    def price(self, value):
+        return self._to_units(Decimal(value).quantize(PRECISION_EXP))
+
+    def amount(self, value):
+        return self._to_units(Decimal(value).quantize(PRECISION_EXP, ROUND_DOWN))
+
+    # 手续费率和充值提现金额在 Decimal 版里不做舍入，整数版里精度超出 PRECISION 位时直接拒绝
+    def rate(self, value):
+        return self.parse(value)
+
+    def parse(self, value):
+        value = _to_decimal(value)
+        if value != value.quantize(PRECISION_EXP):
+            raise ValidationError("%s has more than %d decimal places" % (value, PRECISION))
+        return self._to_units(value)
+
+    def balance(self, value):
+        return int(value)
+
+    def quantize(self, value):
+        return value
+
+    def round_down(self, value):
+        return value
+
+    def multiply(self, value, factor):
+        return _divide_down(value * factor, self.scale)
+
+    # amount * price * (1 + fee_rate) 的精确值按 ROUND_HALF_EVEN 舍入到 PRECISION 位，
+    # 与 Decimal 默认 context 的 quantize 相同
+    def freeze(self, amount, price, fee_rate):
+        divisor = self.scale * self.scale
+        quotient, remainder = divmod(amount * price * (self.scale + fee_rate), divisor)
+        if remainder * 2 > divisor or (remainder * 2 == divisor and quotient % 2 == 1):
+            quotient += 1
+        return quotient
+
+    def to_decimal(self, value):
+        return Decimal(value).scaleb(0 - PRECISION, EXACT)
+
+    def _to_units(self, value):
+        return int(value.scaleb(PRECISION, EXACT))
+
+# float 走 repr，拿到的是用户写下的那个十进制数，而不是二进制展开；
+# 否则 0.01 这样的手续费率永远不能精确表示
+def _to_decimal(value):
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return Decimal(value)
+
+# ROUND_DOWN 是向零取整，负数不能直接用 //
+def _divide_down(value, divisor):
+    if value < 0:
+        return 0 - ((0 - value) // divisor)
+    return value // divisor
+
+ENGINES = {
+    DecimalAmounts.name: DecimalAmounts(),
+    IntegerAmounts.name: IntegerAmounts(),
+}
+
+engine = ENGINES[DecimalAmounts.name]
+
+def use(name):
+    global engine
+    engine = ENGINES[name]
+    return engine
+
+INTERN_LIMIT = 100000
+
+# 挂单的价格和费率重复得很多，相同的值共用一个对象。
+# 按字符串查找，0.001 和 0.0010 这样数值相等但写法不同的 Decimal 不会混用。
+# 缓存按引擎分开，最多 INTERN_LIMIT 个，满了以后新的值不再缓存
+def intern(value):
+    interned = engine.interned
+    key = str(value)
+    shared = interned.get(key)
+    if shared is None:
+        if len(interned) >= INTERN_LIMIT:
+            return value
+        shared = interned[key] = value
+    return shared
+
+# JSON 里金额一律是十进制字符串
+def to_json(value):
+    return str(engine.to_decimal(value))
+
+def from_json(value):
+    return engine.parse(value)
@@ -0,0 +1,149 @@
+# coding: utf-8
+# 按列存放的余额。
+#
+# 每个账户分到一个 slot，每个币种一列，active 和 frozen 各是一个按 slot 下标的数组，
+# 不再给每个账户每个币种保存一个 BalanceRevision。BalanceRevision 只在 event 需要时临时生成。
+# touched 记录每个 slot 动过哪些币种（按位），用来区分“余额为 0”和“从来没有过这个币种”。
+#
+# 列的类型：
+#   有 numpy 时用 numpy 数组，整数引擎是 int64，Decimal 引擎是 object 数组
+#   没有 numpy 时整数引擎用 64 位的 array，Decimal 引擎用 list。Python 2 的 array 没有 'q'，
+#   'l' 在 Windows 上只有 32 位，这时整数引擎也用 list，范围检查照旧按 int64
+# totals() 和 holders() 这类整列运算在有 numpy 时是向量化的。
+#
+# 账户注销后 slot 不回收，同一个 id 再次开户时沿用原来的 slot 并清空。
+# 列按金额引擎建立，要在 amounts.use() 之后再创建 BalanceStore。
+from array import array
+from itertools import izip
+from . import amounts
+from .errors import BalanceError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+INT64_MAX = 2 ** 63 - 1
+
+INT64_TYPECODE = 'l' if array('l').itemsize >= 8 else None
+
+class BalanceStore(object):
+    def __init__(self, capacity=16):
+        self.integer = amounts.engine.name == amounts.IntegerAmounts.name
+        self.zero = amounts.engine.zero
+        self.capacity = capacity
+        self.slots = {}
+        self.account_ids = []
+        self.touched = []
+        self.coins = {}
+        self.coin_types = []
+        self.active = []
+        self.frozen = []
+
+    def __len__(self):
+        return len(self.account_ids)
+
+    # 给新开的账户分配 slot；这个 id 以前用过时沿用原来的 slot，余额清零
+    def allocate(self, account_id):
+        slot = self.slots.get(account_id)
+        if slot is not None:
+            for column, coin_type in enumerate(self.coin_types):
+                self.unset(slot, coin_type)
+        else:
+            slot = self.slots[account_id] = len(self.account_ids)
+            self.account_ids.append(account_id)
+            self.touched.append(0)
+            if slot >= self.capacity:
+                self._grow(self.capacity * 2)
+        return slot
+
+    # (active, frozen)，这个账户从没有过该币种时返回 None
+    def get(self, slot, coin_type):
+        column = self.coins.get(coin_type)
+        if column is None or not self.touched[slot] >> column & 1:
+            return None
+        active, frozen = self.active[column][slot], self.frozen[column][slot]
+        if self.integer:
+            return int(active), int(frozen)
+        return active, frozen
+
+    def set(self, slot, coin_type, active, frozen):
+        column = self.coins.get(coin_type)
+        if column is None:
+            column = self._add_coin(coin_type)
+        if self.integer and (abs(active) > INT64_MAX or abs(frozen) > INT64_MAX):
+            raise BalanceError("Balance of %s out of range: active %s frozen %s" % (coin_type, active, frozen))
+        self.active[column][slot] = active
+        self.frozen[column][slot] = frozen
+        self.touched[slot] |= 1 << column
+
+    # 恢复到从没有过该币种的状态，事务回滚用
+    def unset(self, slot, coin_type):
+        column = self.coins.get(coin_type)
+        if column is not None:
+            self.active[column][slot] = self.frozen[column][slot] = self.zero
+            self.touched[slot] &= ~(1 << column)
+
+    # [(coin_type, active, frozen)]，只包含动过的币种
+    def items(self, slot):
+        touched = self.touched[slot]
+        return [(coin_type,) + self.get(slot, coin_type) for column, coin_type in enumerate(self.coin_types) if touched >> column & 1]
+
+    def is_empty(self, slot):
+        for active, frozen in izip(self.active, self.frozen):
+            if active[slot] > 0 or frozen[slot] > 0:
+                return False
+        return True
+
+    # 每个币种所有账户的 (active 合计, frozen 合计)，也就是交易所对用户的负债
+    def totals(self):
+        result = {}
+        for column, coin_type in enumerate(self.coin_types):
+            active, frozen = self.active[column], self.frozen[column]
+            if numpy is not None:
+                totals = active.sum(), frozen.sum()
+            else:
+                totals = sum(active, self.zero), sum(frozen, self.zero)
+            result[coin_type] = tuple(int(total) for total in totals) if self.integer else totals
+        return result
+
+    # 持有某币种（active 或 frozen 大于 0）的账户 id
+    def holders(self, coin_type):
+        column = self.coins.get(coin_type)
+        if column is None:
+            return []
+        active, frozen = self.active[column], self.frozen[column]
+        if numpy is not None:
+            slots = numpy.flatnonzero((active > 0) | (frozen > 0))
+        else:
+            slots = [slot for slot, (a, f) in enumerate(izip(active, frozen)) if a > 0 or f > 0]
+        account_ids = self.account_ids
+        return [account_ids[slot] for slot in slots]
+
+    def _add_coin(self, coin_type):
+        column = self.coins[coin_type] = len(self.coin_types)
+        self.coin_types.append(coin_type)
+        self.active.append(self._column(self.capacity))
+        self.frozen.append(self._column(self.capacity))
+        return column
+
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        for columns in (self.active, self.frozen):
+            for i, column in enumerate(columns):
+                if numpy is not None:
+                    columns[i] = numpy.concatenate((column, self._column(extra)))
+                else:
+                    column.extend(self._column(extra))
+        self.capacity = capacity
+
+    def _column(self, size):
+        if numpy is not None:
+            if self.integer:
+                return numpy.zeros(size, dtype=numpy.int64)
+            column = numpy.empty(size, dtype=object)
+            column.fill(self.zero)
+            return column
+        if self.integer and INT64_TYPECODE:
+            return array(INT64_TYPECODE, [0]) * size
+        return [self.zero] * size
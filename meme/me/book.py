@@ -0,0 +1,237 @@
+# coding: utf-8
+from bisect import bisect_left
+from itertools import izip
+from bintrees import RBTree
+from . import amounts
+
+PREV, NEXT, ID, AMOUNT = 0, 1, 2, 3
+# 队尾的位置标记，和 None 区分开
+TAIL = object()
+
+# 同一价位上的订单队列，按时间先后排列。
+# 用双向链表加 order_id 到节点的索引实现，撤单时按 id 摘除节点是 O(1)，
+# 不必像 deque 那样线性查找。
+# 每个节点还记着该订单未成交的数量，amount 是整个价位的合计，随插入、摘除和成交更新。
+class OrderQueue(object):
+    def __init__(self, order_ids=None):
+        self._root = root = []
+        root[:] = [root, root, TAIL, None]
+        self._nodes = {}
+        self.amount = amounts.engine.zero
+        for item in order_ids or []:
+            if isinstance(item, tuple):
+                self.append(*item)
+            else:
+                self.append(item)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, order_id):
+        return order_id in self._nodes
+
+    def __iter__(self):
+        root = self._root
+        node = root[NEXT]
+        while node is not root:
+            yield node[ID]
+            node = node[NEXT]
+
+    def __eq__(self, other):
+        if isinstance(other, OrderQueue):
+            return self.items() == other.items()
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "OrderQueue(%r)" % list(self)
+
+    # 链表是环状的，pickle/deepcopy 时只保存 (id, 数量) 列表
+    def __getstate__(self):
+        return self.items()
+
+    def __setstate__(self, order_ids):
+        self.__init__(order_ids)
+
+    # 按队列顺序返回 (order_id, 未成交数量)
+    def items(self):
+        return [(order_id, self._nodes[order_id][AMOUNT]) for order_id in self]
+
+    def append(self, order_id, amount=None):
+        self.insert(order_id, amount=amount)
+
+    # 插入到 before 之前，before 为 TAIL 时插入到队尾
+    def insert(self, order_id, before=TAIL, amount=None):
+        if order_id in self._nodes:
+            raise ValueError("Order %s is already queued" % order_id)
+        if amount is None:
+            amount = amounts.engine.zero
+        next_node = self._root if before is TAIL else self._nodes[before]
+        prev_node = next_node[PREV]
+        node = [prev_node, next_node, order_id, amount]
+        prev_node[NEXT] = next_node[PREV] = node
+        self._nodes[order_id] = node
+        self.amount += amount
+
+    # 返回下一个订单的 id（队尾时为 TAIL），回滚时用它 insert 回原位
+    def remove(self, order_id):
+        node = self._nodes.pop(order_id)
+        prev_node, next_node = node[PREV], node[NEXT]
+        prev_node[NEXT] = next_node
+        next_node[PREV] = prev_node
+        self.amount -= node[AMOUNT]
+        return next_node[ID]
+
+    # 订单成交了 amount，回滚时传负数
+    def fill(self, order_id, amount):
+        self._nodes[order_id][AMOUNT] -= amount
+        self.amount -= amount
+
+    def first(self):
+        node = self._root[NEXT]
+        if node is self._root:
+            raise IndexError("first from an empty OrderQueue")
+        return node[ID]
+
+# 盘口一侧的价位表，价格到 OrderQueue，接口和 Exchange 用到的那部分 bintrees.RBTree 一致。
+# 价格和队列存在两个对齐的有序 list 里，排列方向让最优价总在末尾：买盘升序，卖盘降序。
+# 读最优价是 O(1)，在最优价附近增删价位只是 append/pop，或者只移动末尾几个元素。
+# 查找先比较末尾再二分，不用 dict：Python 2 的 Decimal 算 hash 比比较大小慢得多。
+class PriceLevels(object):
+    def __init__(self, levels=None, bids=False):
+        self._bids = bids
+        self._prices = []
+        self._queues = []
+        for price, queue in (levels or {}).items():
+            self[price] = queue
+
+    def __len__(self):
+        return len(self._prices)
+
+    def __contains__(self, price):
+        return self._find(price) is not None
+
+    def __iter__(self):
+        return (price for price, queue in self.iter_items())
+
+    def __getitem__(self, price):
+        index = self._find(price)
+        if index is None:
+            raise KeyError(price)
+        return self._queues[index]
+
+    def __setitem__(self, price, queue):
+        prices = self._prices
+        if not prices or (price > prices[-1] if self._bids else price < prices[-1]):
+            prices.append(price)
+            self._queues.append(queue)
+            return
+        index = self._index(price)
+        if index < len(prices) and prices[index] == price:
+            self._queues[index] = queue
+        else:
+            prices.insert(index, price)
+            self._queues.insert(index, queue)
+
+    def __delitem__(self, price):
+        index = self._find(price)
+        if index is None:
+            raise KeyError(price)
+        del self._prices[index]
+        del self._queues[index]
+
+    def __repr__(self):
+        return "PriceLevels(%r)" % self.items()
+
+    def get(self, price, default=None):
+        index = self._find(price)
+        return default if index is None else self._queues[index]
+
+    def is_empty(self):
+        return not self._prices
+
+    # 和 RBTree 一样，空的时候抛 ValueError
+    def min_key(self):
+        if not self._prices:
+            raise ValueError("min_key from empty PriceLevels")
+        return self._prices[0 if self._bids else -1]
+
+    def max_key(self):
+        if not self._prices:
+            raise ValueError("max_key from empty PriceLevels")
+        return self._prices[-1 if self._bids else 0]
+
+    def min_item(self):
+        if not self._prices:
+            raise ValueError("min_item from empty PriceLevels")
+        index = 0 if self._bids else -1
+        return self._prices[index], self._queues[index]
+
+    def max_item(self):
+        if not self._prices:
+            raise ValueError("max_item from empty PriceLevels")
+        index = -1 if self._bids else 0
+        return self._prices[index], self._queues[index]
+
+    # 按价格升序，reverse 时降序；遍历期间不能增删价位
+    def iter_items(self, reverse=False):
+        if self._bids != reverse:
+            return izip(self._prices, self._queues)
+        return izip(reversed(self._prices), reversed(self._queues))
+
+    def keys(self):
+        return [price for price, queue in self.iter_items()]
+
+    def values(self):
+        return [queue for price, queue in self.iter_items()]
+
+    def items(self):
+        return list(self.iter_items())
+
+    def _find(self, price):
+        prices = self._prices
+        if not prices:
+            return None
+        if prices[-1] == price:
+            return len(prices) - 1
+        index = self._index(price)
+        if index < len(prices) and prices[index] == price:
+            return index
+        return None
+
+    # price 在 _prices 里应该插入的位置；卖盘是降序的，bisect 不能直接用
+    def _index(self, price):
+        prices = self._prices
+        if self._bids:
+            return bisect_left(prices, price)
+        lo, hi = 0, len(prices)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if prices[mid] > price:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+def _rbtree_levels(levels=None, bids=False):
+    return RBTree(levels or {})
+
+# 盘口的实现，用 use() 切换，要在创建任何 Exchange 之前选好
+BOOKS = {
+    'ladder': PriceLevels,
+    'rbtree': _rbtree_levels,
+}
+
+book = 'ladder'
+
+def use(name):
+    global book
+    if name not in BOOKS:
+        raise ValueError("Unknown book %s" % name)
+    book = name
+    return BOOKS[name]
+
+def levels(items=None, bids=False):
+    return BOOKS[book](items, bids)
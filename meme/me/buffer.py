@@ -0,0 +1,86 @@
+# coding: utf-8
+# 最近提交的 event 的环形缓冲区，按 revision 定位。
+#
+# revision 是连续的，event 放在 revision % capacity 的槽里，按游标取 O(1) 定位。
+# 游标早于缓冲区时 since() 返回 None，调用方应该去读 journal。
+#
+# 提交线程只写槽位，再 set 一个只有通知线程在等的 Event，不管有多少订阅者都是 O(1)；
+# 唤醒所有等待者由通知线程完成。通知线程在第一次 wait() 时才启动。
+import time
+import threading
+
+_start_lock = threading.Lock()
+
+class EventsBuffer(object):
+    def __init__(self, capacity=10000, revision=0):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.revision = revision
+        self.count = 0
+        self._condition = None
+        self._pending = None
+
+    def append(self, event):
+        # 中间有 event 没经过缓冲区（比如直接改了 Repository#revision），之前的内容就不连续了
+        if event.revision != self.revision + 1:
+            self.count = 0
+        self.slots[event.revision % self.capacity] = event
+        self.revision = event.revision
+        if self.count < self.capacity:
+            self.count += 1
+        if self._pending is not None:
+            self._pending.set()
+
+    # revision 之后的 event，最多 limit 个；游标已经不在缓冲区里时返回 None
+    def since(self, revision, limit=None):
+        last = self.revision
+        if revision < last - self.count:
+            return None
+        if limit is not None:
+            last = min(last, revision + limit)
+        events = []
+        for r in xrange(revision + 1, last + 1):
+            event = self.slots[r % self.capacity]
+            # 读的同时被新的 event 覆盖了
+            if event is None or event.revision != r:
+                return None
+            events.append(event)
+        return events
+
+    # 等到有 revision 之后的 event 或者超时，返回是否有新 event
+    def wait(self, revision, timeout):
+        if self.revision > revision:
+            return True
+        if self._condition is None:
+            self._start()
+        deadline = time.time() + timeout
+        with self._condition:
+            while self.revision <= revision:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _start(self):
+        with _start_lock:
+            if self._condition is not None:
+                return
+            self._condition = threading.Condition()
+            self._pending = threading.Event()
+            thread = threading.Thread(target=self._notify, name='events-notifier')
+            thread.daemon = True
+            thread.start()
+
+    def _notify(self):
+        pending, condition = self._pending, self._condition
+        while True:
+            pending.wait()
+            pending.clear()
+            with condition:
+                condition.notify_all()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_condition'] = state['_pending'] = None
+        return state
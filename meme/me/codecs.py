@@ -0,0 +1,228 @@
+# coding: utf-8
+# Event 的编码方式，journal 和跨进程传输都用它们。
+#
+#   PickleCodec  cPickle，什么都能编，但又大又慢
+#   JsonCodec    Event#to_json，人能看懂，给 API 和外部系统用
+#   BinaryCodec  一个字节的类型标记 + revision + struct 打包的字段，热路径上用
+#
+# Writer/Reader 也被快照复用。金额按当前引擎编码：整数引擎是 int64，
+# Decimal 引擎是十进制字符串。
+import struct
+import cPickle as pickle
+from decimal import Decimal
+from . import amounts
+from .entities import BidOrder, AskOrder
+from .values import Deal, BalanceRevision
+from .errors import ValidationError
+
+U16 = struct.Struct('>H')
+U32 = struct.Struct('>I')
+U64 = struct.Struct('>Q')
+I64 = struct.Struct('>q')
+
+ORDER_KINDS = {'b': BidOrder, 'a': AskOrder}
+
+class Writer(object):
+    def __init__(self, engine):
+        self.chunks = []
+        self.size = 0
+        self.engine = engine
+        self.integer = engine.name == amounts.IntegerAmounts.name
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def u32(self, value):
+        self.write(U32.pack(value))
+
+    def u64(self, value):
+        self.write(U64.pack(value))
+
+    def i64(self, value):
+        self.write(I64.pack(value))
+
+    def string(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        self.write(U16.pack(len(value)) + value)
+
+    # id 可以是字符串或者整数
+    def id(self, value):
+        if isinstance(value, (int, long)):
+            self.write('i' + I64.pack(value))
+        else:
+            self.write('s')
+            self.string(value)
+
+    def amount(self, value):
+        if self.integer:
+            self.write(I64.pack(value))
+        else:
+            self.string(str(value))
+
+    def deal(self, deal):
+        self.id(deal.order_id)
+        self.id(deal.pair_id)
+        for value in deal[2:-1]:
+            self.amount(value)
+        self.i64(deal.timestamp)
+
+    def balance_revision(self, revision):
+        self.id(revision.account_id)
+        self.string(revision.coin_type)
+        for value in (revision.old_active, revision.old_frozen, revision.new_active, revision.new_frozen):
+            self.amount(value)
+
+    def order(self, order):
+        self.write('b' if type(order) is BidOrder else 'a')
+        self.id(order.id)
+        self.id(order.account_id)
+        self.string(order.coin_type)
+        self.string(order.price_type)
+        self.amount(order.price)
+        self.amount(order.amount)
+        self.amount(order.fee_rate)
+        self.i64(order.timestamp)
+        self.u32(len(order.deals))
+        for deal in order.deals:
+            self.deal(deal)
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+class Reader(object):
+    def __init__(self, buf, offset, engine):
+        self.buf = buf
+        self.offset = offset
+        self.engine = engine
+        self.integer = engine.name == amounts.IntegerAmounts.name
+
+    def read(self, size):
+        data = self.buf[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.buf, self.offset)
+        self.offset += fmt.size
+        return values[0] if len(values) == 1 else values
+
+    def u32(self):
+        return self.unpack(U32)
+
+    def u64(self):
+        return self.unpack(U64)
+
+    def i64(self):
+        return self.unpack(I64)
+
+    def string(self):
+        return self.read(self.unpack(U16))
+
+    def id(self):
+        if self.read(1) == 'i':
+            return self.i64()
+        return self.string()
+
+    def amount(self):
+        if self.integer:
+            return self.unpack(I64)
+        return Decimal(self.string())
+
+    def deal(self):
+        order_id, pair_id = self.id(), self.id()
+        values = [self.amount() for i in range(len(Deal._fields) - 3)]
+        return Deal(order_id, pair_id, *(values + [self.i64()]))
+
+    def balance_revision(self):
+        account_id, coin_type = self.id(), self.string()
+        return BalanceRevision(account_id, coin_type, *[self.amount() for i in range(4)])
+
+    # 只要路由用的字段时跳过金额，不构造 Decimal
+    def skip_amount(self):
+        if self.integer:
+            self.offset += I64.size
+        else:
+            self.offset += U16.size + U16.unpack_from(self.buf, self.offset)[0]
+
+    # 只读出 Deal 的 order_id
+    def deal_order_id(self):
+        order_id = self.id()
+        self.id()
+        for i in range(len(Deal._fields) - 3):
+            self.skip_amount()
+        self.offset += I64.size
+        return order_id
+
+    # 只读出订单的 id 和交易对
+    def order_route(self):
+        self.offset += 1
+        order_id = self.id()
+        self.id()
+        exchange_id = "%s-%s" % (self.string(), self.string())
+        for i in range(3):
+            self.skip_amount()
+        self.offset += I64.size
+        for i in xrange(self.u32()):
+            self.deal_order_id()
+        return order_id, exchange_id
+
+    # 不走 Order#__init__，金额已经是引擎内部的值，不需要再转换
+    def order(self):
+        klass = ORDER_KINDS[self.read(1)]
+        order = klass.__new__(klass)
+        order.id = self.id()
+        order.account_id = self.id()
+        order.coin_type = self.string()
+        order.price_type = self.string()
+        order.price = self.amount()
+        order.amount = self.amount()
+        order.fee_rate = self.amount()
+        order.timestamp = self.i64()
+        order.deals = ()
+        order.filled_amount = order.filled_outcome = self.engine.zero
+        for i in xrange(self.u32()):
+            order.append_deal(self.deal())
+        return order
+
+class PickleCodec(object):
+    def encode(self, event):
+        return pickle.dumps(event, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, payload):
+        return pickle.loads(payload)
+
+class JsonCodec(object):
+    def encode(self, event):
+        return event.to_json()
+
+    def decode(self, payload):
+        from .events import Event
+        return Event.build_by_json(payload)
+
+# 类型标记的最高位表示金额是整数引擎编码的，解码时引擎不符就拒绝
+INTEGER_FLAG = 0x80
+
+class BinaryCodec(object):
+    def encode(self, event):
+        from .events import EVENT_TAGS
+        engine = amounts.engine
+        writer = Writer(engine)
+        tag = EVENT_TAGS[type(event)] | (INTEGER_FLAG if writer.integer else 0)
+        writer.write(chr(tag) + U64.pack(event.revision))
+        event.pack(writer)
+        return writer.getvalue()
+
+    def decode(self, payload):
+        klass, revision, reader = self.open(payload)
+        return klass.unpack(revision, reader)
+
+    # 只解出类型和 revision，其余字段由调用方用返回的 Reader 按需读
+    def open(self, payload):
+        from .events import EVENT_TYPES
+        reader = Reader(payload, 1, amounts.engine)
+        tag = ord(payload[0])
+        if bool(tag & INTEGER_FLAG) != reader.integer:
+            raise ValidationError("Event was encoded by another amount engine")
+        return EVENT_TYPES[tag & ~INTEGER_FLAG], reader.u64(), reader
@@ -0,0 +1,185 @@
+# coding: utf-8
+# 去重用的 id 索引，替代 ScalableBloomFilter。
+#
+# bloom filter 有误判，会把从没用过的 id 当成重复拒掉，而且只增不减。这里分两层：
+#   recent    当前一代的 id，普通的 set
+#   segments  更早的几代，每代压成一个按 key 排序的段，带一个自己的 bloom filter。
+#             bloom filter 只用来快速排除，命中之后再到段里二分查找确认，所以不会误拒
+#
+# 代按 revision 划分：revision // generation 相同的 id 属于同一代，
+# 切代只取决于 revision，顺序重放和在线提交得到的分段完全一样。
+# 比当前 revision 早 window 个以上的代整段丢掉，内存和磁盘都有上限；这之后的 id 可以被重新使用。
+# 默认的 DEFAULT_WINDOW 是一千万个 revision，按每秒上千个 event 算也能覆盖几个小时的重试；
+# 显式传 window=None 时什么都不丢。
+# 给了 max_age（秒）时，切出去超过 max_age 的段也丢掉，在下一次切代时检查。event 里没有统一的时间，
+# 这里用的是本进程切代时的墙上时钟：重放出来的段都是新切的，只会比在线时多留，不会误放过重复的 id。
+# 给了 path 时段写在该目录下并 mmap 读取，否则段放在内存里；Repository 的 dedup_path 就是给这个用的。
+# 新建索引时目录里上次留下的段会被清掉，索引总是从 journal 或快照重建。
+import os
+import mmap
+import time
+import struct
+from bisect import bisect_right
+from pybloom import BloomFilter
+
+U16 = struct.Struct('>H')
+I64 = struct.Struct('>q')
+
+# 段内每 BLOCK 个 key 在内存里留一个稀疏索引
+BLOCK = 64
+
+DEFAULT_WINDOW = 10000000
+
+class DedupIndex(object):
+    def __init__(self, path=None, generation=100000, window=DEFAULT_WINDOW, max_age=None, error_rate=0.001):
+        self.path = path
+        self.generation = generation
+        self.window = window
+        self.max_age = max_age
+        self.error_rate = error_rate
+        self.clock = time.time
+        self.current = 0
+        self.recent = set()
+        self.segments = []
+        if path:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            for name in os.listdir(path):
+                if name.endswith('.seg'):
+                    os.remove(os.path.join(path, name))
+
+    def __contains__(self, id):
+        if id in self.recent:
+            return True
+        if not self.segments:
+            return False
+        key = _key(id)
+        for segment in reversed(self.segments):
+            if key in segment:
+                return True
+        return False
+
+    def __len__(self):
+        return len(self.recent) + sum(segment.count for segment in self.segments)
+
+    def add(self, id, revision):
+        generation = revision // self.generation
+        if generation != self.current:
+            self._seal(generation)
+        self.recent.add(id)
+
+    # 只有当前一代的 id 可以撤销，Transaction 回滚时用
+    def discard(self, id):
+        self.recent.discard(id)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+    def _seal(self, generation):
+        if self.recent:
+            keys = sorted(_key(id) for id in self.recent)
+            self.segments.append(Segment.build(self.current, keys, self.error_rate, self._segment_path(self.current), self.clock()))
+            self.recent = set()
+        self.current = generation
+        if self.window is not None:
+            oldest = (generation * self.generation - self.window) // self.generation
+            while self.segments and self.segments[0].generation < oldest:
+                self.segments.pop(0).drop()
+        if self.max_age is not None:
+            oldest = self.clock() - self.max_age
+            while self.segments and self.segments[0].sealed < oldest:
+                self.segments.pop(0).drop()
+
+    def _segment_path(self, generation):
+        if self.path:
+            return os.path.join(self.path, '%020d.seg' % generation)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['segments'] = [(segment.generation, segment.buf[:], segment.bloom, segment.sealed) for segment in self.segments]
+        return state
+
+    def __setstate__(self, state):
+        segments = state.pop('segments')
+        self.__dict__.update(state)
+        if self.path and not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.segments = [Segment.load(generation, buf, bloom, self._segment_path(generation), sealed) for generation, buf, bloom, sealed in segments]
+
+# 排好序的 key 连续存放，每个 key 前面是两个字节的长度；sealed 是切出这一段的时间
+class Segment(object):
+    def __init__(self, generation, buf, bloom, path=None, sealed=0):
+        self.generation = generation
+        self.buf = buf
+        self.bloom = bloom
+        self.path = path
+        self.sealed = sealed
+        self.index_keys = []
+        self.index_offsets = []
+        self.count = 0
+        offset = 0
+        while offset < len(buf):
+            size = U16.unpack_from(buf, offset)[0]
+            if self.count % BLOCK == 0:
+                self.index_keys.append(buf[offset + U16.size:offset + U16.size + size])
+                self.index_offsets.append(offset)
+            offset += U16.size + size
+            self.count += 1
+
+    @classmethod
+    def build(cls, generation, keys, error_rate, path=None, sealed=0):
+        bloom = BloomFilter(capacity=max(len(keys), 1), error_rate=error_rate)
+        for key in keys:
+            bloom.add(key)
+        return cls.load(generation, ''.join(U16.pack(len(key)) + key for key in keys), bloom, path, sealed)
+
+    @classmethod
+    def load(cls, generation, buf, bloom, path=None, sealed=0):
+        if path:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(buf)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, path)
+            with open(path, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(generation, buf, bloom, path, sealed)
+
+    def __contains__(self, key):
+        if key not in self.bloom:
+            return False
+        i = bisect_right(self.index_keys, key) - 1
+        if i < 0:
+            return False
+        buf, offset = self.buf, self.index_offsets[i]
+        for j in xrange(BLOCK):
+            if offset >= len(buf):
+                return False
+            size = U16.unpack_from(buf, offset)[0]
+            offset += U16.size
+            candidate = buf[offset:offset + size]
+            if candidate == key:
+                return True
+            if candidate > key:
+                return False
+            offset += size
+        return False
+
+    def close(self):
+        if self.path:
+            self.buf.close()
+
+    def drop(self):
+        self.close()
+        if self.path:
+            os.remove(self.path)
+
+# 整数和字符串 id 编码成不会相互冲突的 key
+def _key(id):
+    if isinstance(id, (int, long)):
+        return 'i' + I64.pack(id)
+    if isinstance(id, unicode):
+        id = id.encode('utf-8')
+    return 's' + id
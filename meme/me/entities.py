@@ -1,38 +1,162 @@
 # coding: utf-8
+import os
 import time
-import collections
-from decimal import Decimal, ROUND_DOWN
-from bintrees import RBTree
-from pybloom import ScalableBloomFilter
+import copy
+from contextlib import contextmanager
+from itertools import islice
 from .errors import NotFoundError, BalanceError, DealError
 from .values import Deal, BalanceRevision
-from .consts import PRECISION_EXP
+from . import amounts
+from .transaction import Transaction
+from . import book
+from .dedup import DedupIndex
+from .buffer import EventsBuffer
+from .balances import BalanceStore
+from .utils import intern_string
 
 class Repository(object):
-    def __init__(self, revision=0, accounts=None, orders=None, exchanges=None, debits_bloom=None, credits_bloom=None, orders_bloom=None):
+    # 没传入的去重索引按 dedup_path 和 dedup_max_age 新建：给了 dedup_path 时段写在它下面各自的子目录里，
+    # 给了 dedup_max_age（秒）时太旧的段也会丢掉，见 DedupIndex
+    def __init__(self, revision=0, accounts=None, orders=None, exchanges=None, debits_index=None, credits_index=None, orders_index=None, journal=None, events=None, balances=None,
+            dedup_path=None, dedup_max_age=None):
         self.revision = revision
-        self.accounts = EntitiesSet(accounts)
-        self.orders = EntitiesSet(orders)
-        self.exchanges = EntitiesSet(exchanges)
-        # self.events = events or EventsBuffer()
-        self.debits_bloom = debits_bloom or ScalableBloomFilter(mode=ScalableBloomFilter.SMALL_SET_GROWTH)
-        self.credits_bloom = credits_bloom or ScalableBloomFilter(mode=ScalableBloomFilter.SMALL_SET_GROWTH)
-        self.orders_bloom = orders_bloom or ScalableBloomFilter(mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        # 新开的账户都放在这里；传入的 accounts 应该是用同一个 store 建的
+        self.balances = BalanceStore() if balances is None else balances
+        self.accounts = EntitiesSet('Account', accounts)
+        self.orders = OrdersSet(orders)
+        self.exchanges = EntitiesSet('Exchange', exchanges)
+        self.events = EventsBuffer(revision=revision) if events is None else events
+        self.debits_index = _dedup_index(dedup_path, 'debits', dedup_max_age) if debits_index is None else debits_index
+        self.credits_index = _dedup_index(dedup_path, 'credits', dedup_max_age) if credits_index is None else credits_index
+        self.orders_index = _dedup_index(dedup_path, 'orders', dedup_max_age) if orders_index is None else orders_index
+        self.transaction = None
+        # 每撤销一次加一，别的线程据此知道读的过程中可能看到了被撤销的修改
+        self.rollbacks = 0
+        self.journal = journal
+        self.subscribers = []
+        self._batch = None
 
-    @classmethod
-    def load_snapshot(self, snapshot):
-        pass
+    def __eq__(self, other):
+        return self.revision == other.revision and \
+                self.accounts == other.accounts and \
+                self.orders == other.orders and \
+                self.exchanges == other.exchanges
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
+    # 加载快照后再从 journal 补上快照之后的 event
+    @classmethod
+    def load_snapshot(cls, snapshot, journal=None):
+        from . import snapshot as snapshots
+        repo = snapshots.load(snapshot, journal=journal)
+        repo.sync()
+        return repo
+
+    def save_snapshot(self, snapshot):
+        from . import snapshot as snapshots
+        self.flush()
+        snapshots.dump(self, snapshot)
+
+    # 从日志中补上本 Repository 还没有的 event
     def sync(self):
-        pass
+        if self.journal:
+            self.replay(self.journal.read(self.revision))
+
+    # 应用已经写进日志的 event，不再重复写日志
+    def replay(self, events):
+        for event in events:
+            self._apply(event)
 
     def commit(self, event):
+        self._apply(event)
+        if self.journal and self._batch is None:
+            self.journal.append(event)
+
+    # 一批 event 原子地提交：块内的 commit 立即生效，revision 连续递增，后面的 build 能看到前面的结果；
+    # 块正常结束时整批一次写进 journal 再通知订阅者，块内抛出异常或者写 journal 失败时整批回滚。
+    # 块内自己捕获了某个 event 的异常时只撤销这一个 event。嵌套的 batch 并入外层，
+    # 从嵌套的块里抛出异常时只撤销这个块里提交的 event。
+    # flush 为真时整批在块结束时就落盘，落盘失败也整批回滚。
+    #   with repo.batch() as events:
+    #       repo.commit(OrderCanceled.build(repo, 'bid1'))
+    #       repo.commit(OrderCreated.build(repo, 'bid2', ...))
+    @contextmanager
+    def batch(self, flush=False):
+        if self._batch is not None:
+            events, revision = self._batch, self.revision
+            count, mark = len(events), len(self.transaction.undo_log)
+            try:
+                yield events
+            except:
+                self._rollback(mark)
+                del events[count:]
+                self.revision = revision
+                raise
+            return
+        revision = self.revision
+        events = self._batch = []
+        self.transaction = Transaction()
+        try:
+            yield events
+            if self.journal and events:
+                self.journal.extend(events, flush)
+        except:
+            self._rollback()
+            self.revision = revision
+            raise
+        finally:
+            self.transaction = None
+            self._batch = None
+        for event in events:
+            self._publish(event)
+
+    # fn(event) 在每个 event apply 成功之后调用，commit 和 replay 都会通知
+    def subscribe(self, fn):
+        self.subscribers.append(fn)
+
+    def flush(self):
+        if self.journal:
+            self.journal.flush()
+
+    def _apply(self, event):
         if event.revision != self.revision + 1:
             raise ValueError("Invalid revision")
-        event.apply(self)
+        batch = self._batch
+        if batch is None:
+            self.transaction = Transaction()
+            try:
+                event.apply(self)
+            except:
+                self._rollback()
+                raise
+            finally:
+                self.transaction = None
+        else:
+            # batch 里共用一个事务，失败时只撤到这个 event 之前
+            mark = len(self.transaction.undo_log)
+            try:
+                event.apply(self)
+            except:
+                self._rollback(mark)
+                raise
+        self.revision = event.revision
+        if batch is None:
+            self._publish(event)
+        else:
+            batch.append(event)
 
-    def flush(self):
-        pass
+    def _rollback(self, mark=0):
+        self.rollbacks += 1
+        self.transaction.rollback(mark)
+
+    def _publish(self, event):
+        self.events.append(event)
+        for subscriber in self.subscribers:
+            subscriber(event)
+
+def _dedup_index(path, name, max_age):
+    return DedupIndex(path and os.path.join(path, name), max_age=max_age)
 
 class EntitiesSet(object):
     def __init__(self, name, entities=None):
@@ -40,7 +164,10 @@ class EntitiesSet(object):
         self.name = name
 
     def __eq__(self, other):
-        return self.entities.__eq__(other.entities)
+        return self.entities == other.entities
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
     def add(self, entity):
         assert hasattr(entity, 'id')
@@ -52,66 +179,133 @@ class EntitiesSet(object):
     def find(self, id):
         entity = self.entities.get(id)
         if not entity:
-            raise NotFoundError("%s#%d not found" % (self.name, id))
+            raise NotFoundError("%s#%s not found" % (self.name, id))
         return entity
 
     def get(self, id, default=None):
         return self.entities.get(id, default)
 
+# 挂单另外按账户索引 order_id，查找或撤销一个账户的全部挂单时不必扫描所有订单。
+# 索引在第一次用到时才建立，快照里延迟解码的订单不必在加载时全部解码。
+class OrdersSet(EntitiesSet):
+    def __init__(self, entities=None):
+        EntitiesSet.__init__(self, 'Order', entities)
+        self._accounts = None
+
+    def add(self, entity):
+        EntitiesSet.add(self, entity)
+        if self._accounts is not None:
+            self._accounts.setdefault(entity.account_id, set()).add(entity.id)
+
+    def remove(self, id):
+        entity = self.entities.pop(id, None)
+        if entity is not None and self._accounts is not None:
+            ids = self._accounts[entity.account_id]
+            ids.discard(id)
+            if not ids:
+                del self._accounts[entity.account_id]
+
+    # 账户的挂单 id，按 id 排序
+    def ids_by_account(self, account_id):
+        if self._accounts is None:
+            self._accounts = {}
+            for order in self.entities.values():
+                self._accounts.setdefault(order.account_id, set()).add(order.id)
+        return sorted(self._accounts.get(account_id, ()))
+
+# 实体用 __slots__，几百万挂单时省掉每个对象的 __dict__；FIELDS 是参与比较的字段
 class Entity(object):
+    __slots__ = ()
+    FIELDS = ()
+
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        fields = self.FIELDS
+        if fields != getattr(other, 'FIELDS', None):
+            return False
+        for name in fields:
+            if getattr(self, name) != getattr(other, name):
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
+# 余额在 BalanceStore 里按列存放，Account 只记住自己的 slot；
+# 不传 store 时用一个只属于自己的 BalanceStore，Repository 里的账户共用 Repository#balances
 class Account(Entity):
-    def __init__(self, id, balances=None):
+    __slots__ = ('id', 'store', 'slot')
+    FIELDS = ('id', 'balances')
+
+    def __init__(self, id, balances=None, store=None):
         self.id = id
-        self.balances = balances or {}
+        self.store = BalanceStore() if store is None else store
+        self.slot = self.store.allocate(id)
+        for revision in (balances or {}).values():
+            self.overwrite(revision)
 
     @classmethod
     def build(cls, id, balances_map=None):
         account = cls(id)
         for coin_type, balance_tuple in balances_map.items():
-            active, frozen = balance_tuple
+            active, frozen = map(amounts.engine.parse, balance_tuple)
             balance = account.find_balance(coin_type)
             revision = balance.build_next(active, frozen)
             account.adjust(revision)
         return account
 
+    # coin_type -> BalanceRevision，每次调用都重新生成
+    @property
+    def balances(self):
+        return dict((coin_type, BalanceRevision(self.id, coin_type, active, frozen, active, frozen))
+                for coin_type, active, frozen in self.store.items(self.slot))
+
     def find_balance(self, coin_type):
-        zero_balance = BalanceRevision.build(self.id, coin_type)
-        return self.balances.get(coin_type, zero_balance)
+        balance = self.store.get(self.slot, coin_type)
+        if balance is None:
+            return BalanceRevision.build(self.id, coin_type)
+        active, frozen = balance
+        return BalanceRevision(self.id, coin_type, active, frozen, active, frozen)
 
     def find_balances(self, coin_types):
         return [self.find_balance(coin_type) for coin_type in coin_types]
 
     def adjust(self, revision):
         coin_type = revision.coin_type
-        balance = self.find_balance(coin_type)
-        if balance.active != revision.old_active:
-            raise BalanceError("BalanceRevision old_active mismatch, expected %s, but got %s" % (balance.active, revision.old_active))
-        if balance.frozen != revision.old_frozen:
-            raise BalanceError("BalanceRevision old_frozen mismatch: expected %s, but got %s" % (balance.frozen, revision.old_frozen))
+        active, frozen = self.store.get(self.slot, coin_type) or (0, 0)
+        if active != revision.old_active:
+            raise BalanceError("BalanceRevision old_active mismatch, expected %s, but got %s" % (active, revision.old_active))
+        if frozen != revision.old_frozen:
+            raise BalanceError("BalanceRevision old_frozen mismatch: expected %s, but got %s" % (frozen, revision.old_frozen))
         if revision.active < 0 or revision.frozen < 0:
-            raise BalanceError("invalid BalanceRevision %s" % balance_revision)
-        self.balances[coin_type] = revision
+            raise BalanceError("invalid BalanceRevision %s" % revision)
+        self.store.set(self.slot, coin_type, revision.active, revision.frozen)
+
+    # 不做校验，直接写成 revision 之后的余额；重放和加载快照用
+    def overwrite(self, revision):
+        self.store.set(self.slot, revision.coin_type, revision.active, revision.frozen)
 
     def is_empty(self):
-        for b in self.balances.values():
-            if b.active > 0 or b.frozen > 0:
-                return False
-        return True
+        return self.store.is_empty(self.slot)
 
 class Order(Entity):
+    __slots__ = FIELDS = ('id', 'account_id', 'coin_type', 'price_type', 'price', 'amount', 'fee_rate', 'deals', 'timestamp', 'filled_amount', 'filled_outcome')
+
+    # 币种、账户、价格和费率在挂单之间大量重复，都共用同一个对象；
+    # deals 在第一次成交前是共用的空 tuple，之后是 list，追加一次成交不必复制整个历史
     def __init__(self, id, account_id, coin_type, price_type, price, amount, fee_rate=0.001, timestamp=None, deals=None):
         self.id = id
-        self.account_id = account_id
-        self.coin_type = coin_type
-        self.price_type = price_type
-        self.price = Decimal(price).quantize(PRECISION_EXP)
-        self.amount = Decimal(amount).quantize(PRECISION_EXP, ROUND_DOWN)
-        self.fee_rate = Decimal(fee_rate)
-        self.deals = deals or []
+        self.account_id = intern_string(account_id)
+        self.coin_type = intern_string(coin_type)
+        self.price_type = intern_string(price_type)
+        engine = amounts.engine
+        self.price = amounts.intern(engine.price(price))
+        self.amount = engine.amount(amount)
+        self.fee_rate = amounts.intern(engine.rate(fee_rate))
+        self.deals = list(deals) if deals else ()
         self.timestamp = timestamp or int(time.time())
+        # 成交累计值，随 append_deal 更新，免得每次都去遍历 deals
+        self.filled_amount = sum([d.amount for d in self.deals], engine.zero)
+        self.filled_outcome = sum([d.outcome for d in self.deals], engine.zero)
 
     @property
     def exchange_id(self):
@@ -119,23 +313,58 @@ class Order(Entity):
 
     @property
     def rest_amount(self):
-        return (self.amount - sum([d.amount for d in self.deals])).quantize(PRECISION_EXP)
+        return amounts.engine.quantize(self.amount - self.filled_amount)
 
     @property
     def rest_freeze_amount(self):
-        return (self.freeze_amount - sum([d.outcome for d in self.deals])).quantize(PRECISION_EXP)
+        return amounts.engine.quantize(self.freeze_amount - self.filled_outcome)
 
     def is_completed(self):
         return self.rest_amount == 0
 
+    def clone(self):
+        order = copy.copy(self)
+        if self.deals:
+            order.deals = list(self.deals)
+        return order
+
+    def as_json(self):
+        return {
+            'side': self.side,
+            'id': self.id,
+            'account_id': self.account_id,
+            'coin_type': self.coin_type,
+            'price_type': self.price_type,
+            'price': amounts.to_json(self.price),
+            'amount': amounts.to_json(self.amount),
+            'fee_rate': amounts.to_json(self.fee_rate),
+            'timestamp': self.timestamp,
+            'deals': [deal.as_json() for deal in self.deals],
+        }
+
+    @classmethod
+    def build_by_json(cls, json):
+        klass = BidOrder if json['side'] == BidOrder.side else AskOrder
+        deals = [Deal.build_by_json(deal) for deal in json['deals']]
+        return klass(json['id'], json['account_id'], json['coin_type'], json['price_type'],
+                json['price'], json['amount'], json['fee_rate'], json['timestamp'], deals)
+
     def append_deal(self, deal):
         if self.rest_amount != deal.rest_amount + deal.amount:
             raise DealError("Deal rest_amount %s mismatch" % (deal, ))
         if self.rest_freeze_amount != deal.rest_freeze_amount + deal.outcome:
             raise DealError("Deal rest_freeze_amount %s mismatch" % (deal, ))
-        self.deals.append(deal)
+        if self.deals:
+            self.deals.append(deal)
+        else:
+            self.deals = [deal]
+        self.filled_amount += deal.amount
+        self.filled_outcome += deal.outcome
 
 class BidOrder(Order):
+    __slots__ = ()
+    side = 'bid'
+
     @property
     def income_type(self):
         return self.coin_type
@@ -146,10 +375,12 @@ class BidOrder(Order):
 
     @property
     def freeze_amount(self):
-        net_total = ((self.amount * self.price) * (1 + self.fee_rate)).quantize(PRECISION_EXP)
-        return net_total
+        return amounts.engine.freeze(self.amount, self.price, self.fee_rate)
 
 class AskOrder(Order):
+    __slots__ = ()
+    side = 'ask'
+
     @property
     def income_type(self):
         return self.price_type
@@ -163,30 +394,61 @@ class AskOrder(Order):
         return self.amount
 
 class Exchange(Entity):
-    def __init__(self, coin_type, price_type, bids=None, asks=None):
-        self.coin_type = coin_type
-        self.price_type = price_type
-        self.bids = RBTree(bids or {})
-        self.asks = RBTree(asks or {})
+    __slots__ = FIELDS = ('coin_type', 'price_type', 'bids', 'asks', 'auction')
+
+    # auction 为 True 时处于集合竞价，订单只进盘口不撮合，等 AuctionCleared 一次成交
+    def __init__(self, coin_type, price_type, bids=None, asks=None, auction=False):
+        self.coin_type = intern_string(coin_type)
+        self.price_type = intern_string(price_type)
+        self.bids = book.levels(bids, bids=True)
+        self.asks = book.levels(asks)
+        self.auction = auction
 
     def __eq__(self, other):
         return self.coin_type == other.coin_type and \
                 self.price_type == other.price_type and \
-                list(self.bids) == list(self.asks)
+                self.auction == other.auction and \
+                list(self.bids.items()) == list(other.bids.items()) and \
+                list(self.asks.items()) == list(other.asks.items())
 
     @property
     def id(self):
         return "%s-%s" % (self.coin_type, self.price_type)
 
     def enqueue(self, order):
-        rbtree = self._find_rbtree(order)
-        queue = rbtree.setdefault(order.price, collections.deque())
-        queue.append(order.id)
-        rbtree[order.price] = queue
+        levels = self._find_levels(order)
+        self._find_queue(levels, order.price).append(order.id, order.rest_amount)
 
+    # 返回订单在队列中的位置，供事务回滚时 restore；订单不在队列中时返回 None
     def dequeue(self, order):
-        rbtree = self._find_rbtree(order)
-        self._discard(rbtree, order.price, order.id)
+        levels = self._find_levels(order)
+        return self._discard(levels, order.price, order.id)
+
+    # position 为 dequeue 时排在该订单之后的 order_id
+    def restore(self, order, position):
+        levels = self._find_levels(order)
+        self._find_queue(levels, order.price).insert(order.id, position, order.rest_amount)
+
+    # 挂着的订单成交了 amount，从所在价位的合计里扣掉；回滚时传负数
+    def fill(self, order, amount):
+        queue = self._find_levels(order).get(order.price)
+        if queue is not None and order.id in queue:
+            queue.fill(order.id, amount)
+
+    # 买卖各 n 档，每档是 (价格, 数量合计, 订单数)，买盘从高到低，卖盘从低到高
+    def depth(self, n):
+        return (self._levels(self.bids.iter_items(reverse=True), n),
+                self._levels(self.asks.iter_items(), n))
+
+    def best_bid(self):
+        if self.bids.is_empty():
+            return None
+        return self._level(*self.bids.max_item())
+
+    def best_ask(self):
+        if self.asks.is_empty():
+            return None
+        return self._level(*self.asks.min_item())
 
     def dequeue_if_completed(self, order):
         if order.is_completed():
@@ -197,6 +459,8 @@ class Exchange(Entity):
 
     # 最高买价大于等于最低卖价
     def match(self, pop=False):
+        if self.auction:
+            return (None, None)
         bid_price, ask_price = None, None
         try:
             bid_price = self.bids.max_key()
@@ -206,16 +470,17 @@ class Exchange(Entity):
         if bid_price >= ask_price:
             bids_queue = self.bids[bid_price]
             asks_queue = self.asks[ask_price]
-            bid_id = bids_queue[0]
-            ask_id = asks_queue[0]
+            bid_id = bids_queue.first()
+            ask_id = asks_queue.first()
             if pop:
                 self._discard(self.bids, bid_price, bid_id)
                 self._discard(self.asks, ask_price, ask_id)
             return (bid_id, ask_id)
         return (None, None)
 
+    # deal_price 不给时按挂单时间决定成交价；吃单事件总是按挂单方的价格成交
     @classmethod
-    def compute_deals(cls, bid, ask):
+    def compute_deals(cls, bid, ask, deal_price=None):
         assert type(bid) is BidOrder
         assert type(ask) is AskOrder
         assert bid.price >= ask.price
@@ -224,18 +489,17 @@ class Exchange(Entity):
         timestamp = int(time.time())
         # 卖出申报价格低于即时揭示的最高买入申报价格时，以即时揭示的最高买入申报价格为成交价。
         # 买入申报价格高于即时揭示的最低卖出申报价格时，以即时揭示的最低卖出申报价格为成交价。
-        if bid.timestamp > ask.timestamp:
-            deal_price = ask.price
-        else:
-            deal_price = bid.price
+        if deal_price is None:
+            deal_price = ask.price if bid.timestamp > ask.timestamp else bid.price
+        engine = amounts.engine
         # 这里需要 round(:down)，不然会导致成交额大于委托额
-        deal_amount = min(bid.rest_amount, ask.rest_amount).quantize(PRECISION_EXP, ROUND_DOWN)
+        deal_amount = engine.round_down(min(bid.rest_amount, ask.rest_amount))
         ask_outcome = deal_amount
-        bid_outcome_origin = (ask_outcome * deal_price).quantize(PRECISION_EXP, ROUND_DOWN)
+        bid_outcome_origin = engine.multiply(ask_outcome, deal_price)
         # 买单手续费 = 买单支出部分 * 买单手续费率，加在买单支出上
         # 卖单手续费 = 卖单收入部分 * 卖单手续费率，扣在卖单收入里
-        bid_fee = (bid_outcome_origin * bid.fee_rate).quantize(PRECISION_EXP, ROUND_DOWN)
-        ask_fee = (bid_outcome_origin * ask.fee_rate).quantize(PRECISION_EXP, ROUND_DOWN)
+        bid_fee = engine.multiply(bid_outcome_origin, bid.fee_rate)
+        ask_fee = engine.multiply(bid_outcome_origin, ask.fee_rate)
         bid_outcome = bid_outcome_origin + bid_fee
         # 买单收入 = 卖单支出
         # 卖单收入 = 买单支出 - 卖单手续费
@@ -258,7 +522,85 @@ class Exchange(Entity):
         ask = repo.orders.find(ask_id)
         return Exchange.compute_deals(bid, ask)
 
-    def _find_rbtree(self, order):
+    # 一直撮合到买一价低于卖一价为止，逐笔提交 OrderDealt 并返回它们。
+    # 两边的最优价位队列和队首订单在成交之间缓存，价位吃完才回盘口取下一档。
+    def match_all(self, repo):
+        from .events import OrderDealt
+        events = []
+        bids_queue, asks_queue = None, None
+        bid, ask = None, None
+        while not self.auction:
+            if not bids_queue:
+                if self.bids.is_empty():
+                    break
+                bid_price, bids_queue = self.bids.max_item()
+            if not asks_queue:
+                if self.asks.is_empty():
+                    break
+                ask_price, asks_queue = self.asks.min_item()
+            if bid_price < ask_price:
+                break
+            bid_id, ask_id = bids_queue.first(), asks_queue.first()
+            if bid is None or bid.id != bid_id:
+                bid = repo.orders.find(bid_id)
+            if ask is None or ask.id != ask_id:
+                ask = repo.orders.find(ask_id)
+            bid_deal, ask_deal = Exchange.compute_deals(bid, ask)
+            event = OrderDealt.build_by_orders(repo, bid, ask, bid_deal, ask_deal)
+            repo.commit(event)
+            events.append(event)
+        return events
+
+    # 按价格优先、时间优先给出 side 一方的吃单可以成交的挂单 (价格, order_id, 未成交数量)，
+    # price 为 None 时不限价
+    def makers(self, side, price=None):
+        if side == BidOrder.side:
+            levels = self.asks.iter_items()
+            crosses = lambda level_price: price is None or level_price <= price
+        else:
+            levels = self.bids.iter_items(reverse=True)
+            crosses = lambda level_price: price is None or level_price >= price
+        for level_price, queue in levels:
+            if not crosses(level_price):
+                return
+            for order_id, amount in queue.items():
+                yield level_price, order_id, amount
+
+    # 集合竞价的成交价：按价格升序一次扫过两边合并的价位，边走边累计
+    # 卖盘不高于该价的数量和买盘不低于该价的数量，取成交量最大的价格。
+    # 成交量相同时取买卖差额最小的；仍有多个时买方剩余取最高价，卖方剩余取最低价，否则取中间那个。
+    # 返回 (价格, 成交量)，两边不交叉时返回 (None, 0)
+    def clearing_price(self):
+        zero = amounts.engine.zero
+        if self.bids.is_empty() or self.asks.is_empty() or self.bids.max_key() < self.asks.min_key():
+            return None, zero
+        demand = sum((queue.amount for queue in self.bids.values()), zero)
+        supply = zero
+        bids, asks = self.bids.iter_items(), self.asks.iter_items()
+        bid, ask = next(bids, None), next(asks, None)
+        best_volume, best_imbalance, tied = zero, None, []
+        # 卖盘扫完以后高于它的买价还可能同量而差额更小，买盘扫完以后就没有成交量了
+        while bid is not None and (ask is not None or supply > 0):
+            price = bid[0] if ask is None or bid[0] < ask[0] else ask[0]
+            while ask is not None and ask[0] == price:
+                supply += ask[1].amount
+                ask = next(asks, None)
+            volume = min(demand, supply)
+            imbalance = demand - supply
+            if volume > best_volume or volume == best_volume and volume > 0 and abs(imbalance) < abs(best_imbalance):
+                best_volume, best_imbalance, tied = volume, imbalance, [(price, imbalance)]
+            elif volume == best_volume and volume > 0 and abs(imbalance) == abs(best_imbalance):
+                tied.append((price, imbalance))
+            while bid is not None and bid[0] == price:
+                demand -= bid[1].amount
+                bid = next(bids, None)
+        if all(imbalance > 0 for price, imbalance in tied):
+            return tied[-1][0], best_volume
+        if all(imbalance < 0 for price, imbalance in tied):
+            return tied[0][0], best_volume
+        return tied[len(tied) // 2][0], best_volume
+
+    def _find_levels(self, order):
         if order.exchange_id != self.id:
             raise ValueError("Order#exchange_id<%s> mismatch with Exchange<%s>" % (order.exchange_id, self.id))
         if type(order) is BidOrder:
@@ -268,11 +610,26 @@ class Exchange(Entity):
         else:
             raise ValueError("argument is not an Order")
 
-    # 当同价格的队列为空时，删除红黑树中的键
-    def _discard(self, rbtree, price, order_id):
-        queue = rbtree.get(price)
+    @classmethod
+    def _levels(cls, items, n):
+        return [cls._level(price, queue) for price, queue in islice(items, n)]
+
+    @staticmethod
+    def _level(price, queue):
+        return (price, queue.amount, len(queue))
+
+    def _find_queue(self, levels, price):
+        queue = levels.get(price)
+        if queue is None:
+            queue = levels[price] = book.OrderQueue()
+        return queue
+
+    # 当同价格的队列为空时，删除这个价位
+    def _discard(self, levels, price, order_id):
+        queue = levels.get(price)
         if not queue or not order_id in queue:
-            return
-        queue.remove(order_id)
-        if queue == collections.deque():
-            del rbtree[price]
+            return None
+        position = queue.remove(order_id)
+        if not queue:
+            del levels[price]
+        return position
@@ -18,3 +18,15 @@ class DealError(MemeError):
 
 class ValidationError(MemeError):
     pass
+
+class JournalError(MemeError):
+    pass
+
+class SnapshotError(MemeError):
+    pass
+
+class ReplayError(MemeError):
+    pass
+
+class ShardError(MemeError):
+    pass
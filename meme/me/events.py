@@ -1,10 +1,19 @@
 # coding: utf-8
-from copy import deepcopy
-from .entities import Account, Exchange
+from json import dumps, loads
+from collections import OrderedDict
+from .entities import Account, Exchange, Order, BidOrder, AskOrder
+from .values import Deal, BalanceRevision
+from . import amounts
 from .utils import validate_id
-from .errors import CancelError, ConflictedError
+from .errors import CancelError, ConflictedError, DealError, ValidationError
 
 class Event(object):
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
     # 实施修改，修改前务必做完所有的检查
     def apply(self, repo):
         raise NotImplementedError
@@ -13,10 +22,20 @@ class Event(object):
         raise NotImplementedError
 
     def to_json(self):
-        raise NotImplementedError
+        return dumps(self.as_json())
 
+    # json 可以是 to_json 的字符串或者 as_json 的 dict；在 Event 上调用时按 type 分派
     @classmethod
     def build_by_json(cls, json):
+        json = load_json(json)
+        return EVENT_NAMES[json['type']].build_by_json(json)
+
+    # BinaryCodec 用的紧凑编码，类型标记和 revision 由 codec 负责
+    def pack(self, writer):
+        raise NotImplementedError
+
+    @classmethod
+    def unpack(cls, revision, reader):
         raise NotImplementedError
 
 class AccountCreated(Event):
@@ -28,11 +47,26 @@ class AccountCreated(Event):
     def build(cls, repo, account_id):
         return cls(repo.revision + 1, account_id)
 
+    def as_json(self):
+        return {'type': self.__class__.__name__, 'revision': self.revision, 'account_id': self.account_id}
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'], json['account_id'])
+
+    def pack(self, writer):
+        writer.id(self.account_id)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        return cls(revision, reader.id())
+
     def apply(self, repo):
         if repo.accounts.get(self.account_id):
             return
-        account = Account(self.account_id)
-        repo.accounts.add(account)
+        account = Account(self.account_id, store=repo.balances)
+        repo.transaction.add(repo.accounts, account)
 
 class AccountCanceled(Event):
     def __init__(self, revision, account_id):
@@ -43,11 +77,26 @@ class AccountCanceled(Event):
     def build(cls, repo, account_id):
         return cls(repo.revision + 1, account_id)
 
+    def as_json(self):
+        return {'type': self.__class__.__name__, 'revision': self.revision, 'account_id': self.account_id}
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'], json['account_id'])
+
+    def pack(self, writer):
+        writer.id(self.account_id)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        return cls(revision, reader.id())
+
     def apply(self, repo):
         account = repo.accounts.get(self.account_id)
         if account and not account.is_empty():
             raise CancelError("Account #%s is not empty, can not cancel" % self.account_id)
-        repo.accounts.remove(self.account_id)
+        repo.transaction.remove(repo.accounts, self.account_id)
 
 class AccountCredited(Event):
     def __init__(self, revision, id, account_id, coin_type, balance_revision):
@@ -61,17 +110,43 @@ class AccountCredited(Event):
     def build(cls, repo, id, account_id, coin_type, amount):
         account = repo.accounts.find(account_id)
         balance = account.find_balance(coin_type)
-        balance_revision = balance.build_next(active_diff=amount)
+        balance_revision = balance.build_next(active_diff=amounts.engine.parse(amount))
         return cls(repo.revision + 1, id, account_id, coin_type, balance_revision)
 
+    def as_json(self):
+        return {
+            'type': self.__class__.__name__,
+            'revision': self.revision,
+            'id': self.id,
+            'account_id': self.account_id,
+            'coin_type': self.coin_type,
+            'balance_revision': self.balance_revision.as_json(),
+        }
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'], json['id'], json['account_id'], json['coin_type'], BalanceRevision.build_by_json(json['balance_revision']))
+
+    def pack(self, writer):
+        writer.id(self.id)
+        writer.id(self.account_id)
+        writer.string(self.coin_type)
+        writer.balance_revision(self.balance_revision)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        return cls(revision, reader.id(), reader.id(), reader.string(), reader.balance_revision())
+
     def apply(self, repo):
         if not validate_id(self.id):
             raise ValidationError("Invalid credit id format %s" % self.id)
-        if self.id in repo.credits_bloom:
+        if self.id in repo.credits_index:
             raise ConflictedError("Credit id %s is already occupied" % self.id)
         account = repo.accounts.find(self.account_id)
-        account.adjust(self.balance_revision)
-        repo.credits_bloom.add(self.id)
+        tx = repo.transaction
+        tx.adjust(account, self.balance_revision)
+        tx.add_id(repo.credits_index, self.id, self.revision)
 
 class AccountDebited(Event):
     def __init__(self, revision, id, account_id, coin_type, balance_revision):
@@ -85,21 +160,46 @@ class AccountDebited(Event):
     def build(cls, repo, id, account_id, coin_type, amount):
         account = repo.accounts.find(account_id)
         balance = account.find_balance(coin_type)
-        balance_revision = balance.build_next(active_diff=0-amount)
+        balance_revision = balance.build_next(active_diff=0-amounts.engine.parse(amount))
         return cls(repo.revision + 1, id, account_id, coin_type, balance_revision)
 
+    def as_json(self):
+        return {
+            'type': self.__class__.__name__,
+            'revision': self.revision,
+            'id': self.id,
+            'account_id': self.account_id,
+            'coin_type': self.coin_type,
+            'balance_revision': self.balance_revision.as_json(),
+        }
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'], json['id'], json['account_id'], json['coin_type'], BalanceRevision.build_by_json(json['balance_revision']))
+
+    def pack(self, writer):
+        writer.id(self.id)
+        writer.id(self.account_id)
+        writer.string(self.coin_type)
+        writer.balance_revision(self.balance_revision)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        return cls(revision, reader.id(), reader.id(), reader.string(), reader.balance_revision())
+
     def apply(self, repo):
         if not validate_id(self.id):
             raise ValidationError("Invalid debit id format %s" % self.id)
-        if self.id in repo.debits_bloom:
+        if self.id in repo.debits_index:
             raise ConflictedError("Debit id %s is already occupied" % self.id)
         account = repo.accounts.find(self.account_id)
-        account.adjust(self.balance_revision)
-        repo.debits_bloom.add(self.id)
+        tx = repo.transaction
+        tx.adjust(account, self.balance_revision)
+        tx.add_id(repo.debits_index, self.id, self.revision)
 
 class ExchangeCreated(Event):
     def __init__(self, revision, coin_type, price_type):
-        self.id = id
         self.revision = revision
         self.coin_type = coin_type
         self.price_type = price_type
@@ -108,15 +208,31 @@ class ExchangeCreated(Event):
     def build(cls, repo, coin_type, price_type):
         return cls(repo.revision + 1, coin_type, price_type)
 
+    def as_json(self):
+        return {'type': self.__class__.__name__, 'revision': self.revision, 'coin_type': self.coin_type, 'price_type': self.price_type}
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'], json['coin_type'], json['price_type'])
+
+    def pack(self, writer):
+        writer.string(self.coin_type)
+        writer.string(self.price_type)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        return cls(revision, reader.string(), reader.string())
+
     def apply(self, repo):
         exchange = Exchange(self.coin_type, self.price_type)
         if not repo.exchanges.get(exchange.id):
-            repo.exchanges.add(exchange)
+            repo.transaction.add(repo.exchanges, exchange)
 
 class OrderCreated(Event):
     def __init__(self, revision, order, balance_revision):
         self.revision = revision
-        self.order = deepcopy(order)
+        self.order = order
         self.balance_revision = balance_revision
 
     @classmethod
@@ -134,16 +250,40 @@ class OrderCreated(Event):
                 active_diff = 0 - freeze_amount,
                 frozen_diff = freeze_amount)
 
+    def as_json(self):
+        return {
+            'type': self.__class__.__name__,
+            'revision': self.revision,
+            'order': self.order.as_json(),
+            'balance_revision': self.balance_revision.as_json(),
+        }
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'], Order.build_by_json(json['order']), BalanceRevision.build_by_json(json['balance_revision']))
+
+    def pack(self, writer):
+        writer.order(self.order)
+        writer.balance_revision(self.balance_revision)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        return cls(revision, reader.order(), reader.balance_revision())
+
     def apply(self, repo):
         account = repo.accounts.find(self.order.account_id)
         exchange = repo.exchanges.find(self.order.exchange_id)
-        if self.order.id in repo.orders_bloom:
+        # 超出去重窗口的 id 可以重用，但不能和还在挂着的订单冲突
+        if self.order.id in repo.orders_index or self.order.id in repo.orders.entities:
             raise ConflictedError("Order %s already created" % self.order.id)
-        order = deepcopy(self.order)
-        account.adjust(self.balance_revision)
-        repo.orders_bloom.add(order.id)
-        repo.orders.add(order)
-        exchange.enqueue(order)
+        # 复制一份，以免之后的成交改动 event 里的 order
+        order = self.order.clone()
+        tx = repo.transaction
+        tx.adjust(account, self.balance_revision)
+        tx.add(repo.orders, order)
+        tx.enqueue(exchange, order)
+        tx.add_id(repo.orders_index, order.id, self.revision)
 
 class OrderCanceled(Event):
     def __init__(self, revision, order_id, balance_revision):
@@ -166,13 +306,107 @@ class OrderCanceled(Event):
                 active_diff = rest_freeze_amount,
                 frozen_diff = 0 - rest_freeze_amount)
 
+    def as_json(self):
+        return {
+            'type': self.__class__.__name__,
+            'revision': self.revision,
+            'order_id': self.order_id,
+            'balance_revision': self.balance_revision.as_json(),
+        }
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'], json['order_id'], BalanceRevision.build_by_json(json['balance_revision']))
+
+    def pack(self, writer):
+        writer.id(self.order_id)
+        writer.balance_revision(self.balance_revision)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        return cls(revision, reader.id(), reader.balance_revision())
+
     def apply(self, repo):
         order = repo.orders.find(self.order_id)
         exchange = repo.exchanges.find(order.exchange_id)
         account = repo.accounts.find(order.account_id)
-        account.adjust(self.balance_revision)
-        repo.orders.remove(order.id)
-        exchange.dequeue(order)
+        tx = repo.transaction
+        tx.adjust(account, self.balance_revision)
+        tx.remove(repo.orders, order.id)
+        tx.dequeue(exchange, order)
+
+# 撤销一个账户的全部挂单，可以只撤某个交易对或某一边的。
+# 释放的冻结按币种合并，每个币种一个 BalanceRevision。
+class OrdersMassCanceled(Event):
+    def __init__(self, revision, account_id, order_ids, balance_revisions):
+        self.revision = revision
+        self.account_id = account_id
+        self.order_ids = order_ids
+        self.balance_revisions = balance_revisions
+
+    @classmethod
+    def build(cls, repo, account_id, exchange_id=None, side=None):
+        if side not in (None, BidOrder.side, AskOrder.side):
+            raise ValidationError("Unknown order side %s" % side)
+        account = repo.accounts.find(account_id)
+        orders = []
+        for order_id in repo.orders.ids_by_account(account_id):
+            order = repo.orders.find(order_id)
+            if (exchange_id is None or order.exchange_id == exchange_id) and (side is None or order.side == side):
+                orders.append(order)
+        changes = BalanceChanges()
+        for order in orders:
+            rest_freeze_amount = order.rest_freeze_amount
+            changes.update(changes.current(account, order.outcome_type).build_next(
+                    active_diff = rest_freeze_amount,
+                    frozen_diff = 0 - rest_freeze_amount))
+        return cls(repo.revision + 1, account_id, tuple(order.id for order in orders), changes.revisions())
+
+    def as_json(self):
+        return {
+            'type': self.__class__.__name__,
+            'revision': self.revision,
+            'account_id': self.account_id,
+            'order_ids': list(self.order_ids),
+            'balance_revisions': [revision.as_json() for revision in self.balance_revisions],
+        }
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'], json['account_id'], tuple(json['order_ids']),
+                tuple(BalanceRevision.build_by_json(revision) for revision in json['balance_revisions']))
+
+    def pack(self, writer):
+        writer.id(self.account_id)
+        writer.u32(len(self.order_ids))
+        for order_id in self.order_ids:
+            writer.id(order_id)
+        writer.u32(len(self.balance_revisions))
+        for revision in self.balance_revisions:
+            writer.balance_revision(revision)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        account_id = reader.id()
+        order_ids = tuple(reader.id() for i in xrange(reader.u32()))
+        balance_revisions = tuple(reader.balance_revision() for i in xrange(reader.u32()))
+        return cls(revision, account_id, order_ids, balance_revisions)
+
+    def apply(self, repo):
+        account = repo.accounts.find(self.account_id)
+        tx = repo.transaction
+        for order_id in self.order_ids:
+            order = repo.orders.find(order_id)
+            if order.account_id != account.id:
+                raise CancelError("Order %s does not belong to Account %s" % (order_id, account.id))
+            tx.remove(repo.orders, order_id)
+            tx.dequeue(repo.exchanges.find(order.exchange_id), order)
+        for revision in self.balance_revisions:
+            if revision.account_id != account.id:
+                raise CancelError("BalanceRevision for Account %s in a mass cancel of Account %s" % (revision.account_id, account.id))
+            tx.adjust(account, revision)
 
 class OrderDealt(Event):
     def __init__(self, revision, bid_deal, ask_deal, bid_balance_revisions, ask_balance_revisions):
@@ -196,6 +430,10 @@ class OrderDealt(Event):
     def build(cls, repo, bid_deal, ask_deal):
         bid_order = repo.orders.find(bid_deal.order_id)
         ask_order = repo.orders.find(ask_deal.order_id)
+        return cls.build_by_orders(repo, bid_order, ask_order, bid_deal, ask_deal)
+
+    @classmethod
+    def build_by_orders(cls, repo, bid_order, ask_order, bid_deal, ask_deal):
         bid_account = repo.accounts.find(bid_order.account_id)
         ask_account = repo.accounts.find(ask_order.account_id)
         bid_income_balance = bid_account.find_balance(bid_order.income_type)
@@ -209,24 +447,365 @@ class OrderDealt(Event):
             ask_income_revision, ask_outcome_revision = cls.build_balance_revisions(ask_income_balance, ask_outcome_balance, ask_deal)
         return cls(repo.revision + 1, bid_deal, ask_deal, (bid_income_revision, bid_outcome_revision), (ask_income_revision, ask_outcome_revision))
 
+    def as_json(self):
+        return {
+            'type': self.__class__.__name__,
+            'revision': self.revision,
+            'bid_deal': self.bid_deal.as_json(),
+            'ask_deal': self.ask_deal.as_json(),
+            'bid_balance_revisions': [revision.as_json() for revision in self.bid_balance_revisions],
+            'ask_balance_revisions': [revision.as_json() for revision in self.ask_balance_revisions],
+        }
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'],
+                Deal.build_by_json(json['bid_deal']),
+                Deal.build_by_json(json['ask_deal']),
+                tuple(BalanceRevision.build_by_json(revision) for revision in json['bid_balance_revisions']),
+                tuple(BalanceRevision.build_by_json(revision) for revision in json['ask_balance_revisions']))
+
+    def pack(self, writer):
+        writer.deal(self.bid_deal)
+        writer.deal(self.ask_deal)
+        for revision in self.bid_balance_revisions + self.ask_balance_revisions:
+            writer.balance_revision(revision)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        bid_deal, ask_deal = reader.deal(), reader.deal()
+        revisions = [reader.balance_revision() for i in range(4)]
+        return cls(revision, bid_deal, ask_deal, tuple(revisions[:2]), tuple(revisions[2:]))
+
+    # 直接原地修改，检查失败时由 Repository#commit 的事务回滚
     def apply(self, repo):
-        # 打 cProfile 显示这里的 deepcopy 挺慢的...
-        bid_order = deepcopy(repo.orders.find(self.bid_deal.order_id))
-        ask_order = deepcopy(repo.orders.find(self.ask_deal.order_id))
-        bid_account = deepcopy(repo.accounts.find(bid_order.account_id))
-        if ask_order.account_id != bid_order.account_id:
-            ask_account = deepcopy(repo.accounts.find(ask_order.account_id))
-        else:
-            ask_account = bid_account
+        bid_order = repo.orders.find(self.bid_deal.order_id)
+        ask_order = repo.orders.find(self.ask_deal.order_id)
+        bid_account = repo.accounts.find(bid_order.account_id)
+        ask_account = repo.accounts.find(ask_order.account_id)
         exchange = repo.exchanges.find(bid_order.exchange_id)
-        bid_order.append_deal(self.bid_deal)
-        ask_order.append_deal(self.ask_deal)
-        [bid_account.adjust(revision) for revision in self.bid_balance_revisions]
-        [ask_account.adjust(revision) for revision in self.ask_balance_revisions]
-        [repo.accounts.add(account) for account in [bid_account, ask_account]]
+        tx = repo.transaction
+        tx.append_deal(bid_order, self.bid_deal)
+        tx.append_deal(ask_order, self.ask_deal)
+        tx.fill(exchange, bid_order, self.bid_deal.amount)
+        tx.fill(exchange, ask_order, self.ask_deal.amount)
+        [tx.adjust(bid_account, revision) for revision in self.bid_balance_revisions]
+        [tx.adjust(ask_account, revision) for revision in self.ask_balance_revisions]
         for order in (bid_order, ask_order):
-            exchange.dequeue_if_completed(order)
             if order.is_completed():
-                repo.orders.remove(order.id)
+                tx.dequeue(exchange, order)
+                tx.remove(repo.orders, order.id)
+
+# 一个 event 里同一 (账户, 币种) 的多次余额变动合并成一个 BalanceRevision，
+# current 取链上最新的余额，update 接上新的 BalanceRevision
+class BalanceChanges(object):
+    def __init__(self):
+        # (账户, 币种) -> [开始时的余额, 最新的 BalanceRevision]
+        self.balances = OrderedDict()
+
+    def current(self, account, coin_type):
+        key = (account.id, coin_type)
+        if key not in self.balances:
+            self.balances[key] = [account.find_balance(coin_type)] * 2
+        return self.balances[key][1]
+
+    def update(self, *revisions):
+        for revision in revisions:
+            self.balances[(revision.account_id, revision.coin_type)][1] = revision
+
+    def revisions(self):
+        return tuple(BalanceRevision(last.account_id, last.coin_type, first.active, first.frozen, last.active, last.frozen)
+                for first, last in self.balances.values())
+
+# 市价单、IOC 和 FOK：吃单一次扫过对手盘，所有成交和剩余冻结的释放合成一个 event。
+#   market  不限价，有多少吃多少
+#   ioc     限价，能成交的部分成交，剩下的撤掉
+#   fok     限价，能全部成交才成交，否则整单撤掉，event 里没有成交
+# 吃单不会挂到盘口上，总是按挂单的价格成交。余额变动按 (账户, 币种) 合并成一个 BalanceRevision，
+# 吃 50 个挂单也只是一个 event、一次写日志。
+class OrderTaken(Event):
+    MARKET = 'market'
+    IOC = 'ioc'
+    FOK = 'fok'
+    KINDS = (MARKET, IOC, FOK)
+
+    def __init__(self, revision, kind, order, deals, balance_revisions):
+        self.revision = revision
+        self.kind = kind
+        self.order = order
+        self.deals = deals
+        self.balance_revisions = balance_revisions
+
+    # deals 是 (吃单的 Deal, 挂单的 Deal) 的 tuple。
+    # 市价单不给 price，order.price 记为扫到的最差价位，冻结额按它计算；没有成交时为 0
+    @classmethod
+    def build(cls, repo, id, klass, account_id, coin_type, price_type, amount, fee_rate, kind, price=None, timestamp=None):
+        if kind not in cls.KINDS:
+            raise ValidationError("Unknown order kind %s" % kind)
+        if (kind == cls.MARKET) != (price is None):
+            raise ValidationError("Only market orders are placed without a price")
+        account = repo.accounts.find(account_id)
+        exchange = repo.exchanges.find("%s-%s" % (coin_type, price_type))
+        if exchange.auction:
+            raise ValidationError("Exchange %s is in auction" % exchange.id)
+        engine = amounts.engine
+        limit = None if price is None else engine.price(price)
+        rest = engine.amount(amount)
+        # 挂单靠冻结检查挡住这些，吃单可能一笔都不成交，要在这里拦下
+        if rest <= 0:
+            raise ValidationError("Order amount %s must be positive" % amount)
+        if limit is not None and limit <= 0:
+            raise ValidationError("Order price %s must be positive" % price)
+        makers = []
+        worst = engine.zero
+        for level_price, order_id, maker_amount in exchange.makers(klass.side, limit):
+            if rest <= 0:
+                break
+            makers.append(repo.orders.find(order_id))
+            rest -= min(rest, maker_amount)
+            worst = level_price
+        if kind == cls.FOK and rest > 0:
+            makers = []
+        order = klass(id, account_id, coin_type, price_type, engine.to_decimal(worst) if limit is None else price, amount, fee_rate, timestamp)
+        if not makers:
+            return cls(repo.revision + 1, kind, order, (), ())
+
+        changes = BalanceChanges()
+        current, update = changes.current, changes.update
+        taker = order.clone()
+        freeze_amount = taker.freeze_amount
+        update(current(account, taker.outcome_type).build_next(active_diff=0 - freeze_amount, frozen_diff=freeze_amount))
+        deals = []
+        for maker in makers:
+            maker_account = repo.accounts.find(maker.account_id)
+            if klass is BidOrder:
+                taker_deal, maker_deal = Exchange.compute_deals(taker, maker, maker.price)
             else:
-                repo.orders.add(order)
+                maker_deal, taker_deal = Exchange.compute_deals(maker, taker, maker.price)
+            taker.append_deal(taker_deal)
+            for trader, trader_account, deal in ((taker, account, taker_deal), (maker, maker_account, maker_deal)):
+                update(*OrderDealt.build_balance_revisions(
+                    current(trader_account, trader.income_type), current(trader_account, trader.outcome_type), deal))
+            deals.append((taker_deal, maker_deal))
+        # 没成交的部分释放冻结
+        if not taker.is_completed():
+            rest_freeze_amount = taker.rest_freeze_amount
+            update(current(account, taker.outcome_type).build_next(active_diff=rest_freeze_amount, frozen_diff=0 - rest_freeze_amount))
+        return cls(repo.revision + 1, kind, order, tuple(deals), changes.revisions())
+
+    def as_json(self):
+        return {
+            'type': self.__class__.__name__,
+            'revision': self.revision,
+            'kind': self.kind,
+            'order': self.order.as_json(),
+            'deals': [[taker_deal.as_json(), maker_deal.as_json()] for taker_deal, maker_deal in self.deals],
+            'balance_revisions': [revision.as_json() for revision in self.balance_revisions],
+        }
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'], json['kind'], Order.build_by_json(json['order']),
+                tuple((Deal.build_by_json(taker_deal), Deal.build_by_json(maker_deal)) for taker_deal, maker_deal in json['deals']),
+                tuple(BalanceRevision.build_by_json(revision) for revision in json['balance_revisions']))
+
+    def pack(self, writer):
+        writer.string(self.kind)
+        writer.order(self.order)
+        writer.u32(len(self.deals))
+        for taker_deal, maker_deal in self.deals:
+            writer.deal(taker_deal)
+            writer.deal(maker_deal)
+        writer.u32(len(self.balance_revisions))
+        for revision in self.balance_revisions:
+            writer.balance_revision(revision)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        kind, order = reader.string(), reader.order()
+        deals = tuple((reader.deal(), reader.deal()) for i in xrange(reader.u32()))
+        balance_revisions = tuple(reader.balance_revision() for i in xrange(reader.u32()))
+        return cls(revision, kind, order, deals, balance_revisions)
+
+    def apply(self, repo):
+        order = self.order
+        if order.id in repo.orders_index or order.id in repo.orders.entities:
+            raise ConflictedError("Order %s already created" % order.id)
+        exchange = repo.exchanges.find(order.exchange_id)
+        if exchange.auction and self.deals:
+            raise ValidationError("Exchange %s is in auction" % exchange.id)
+        # 吃单的成交在副本上核对一遍，不一致时 append_deal 会抛 DealError
+        taker = order.clone()
+        tx = repo.transaction
+        for taker_deal, maker_deal in self.deals:
+            taker.append_deal(taker_deal)
+            maker = repo.orders.find(maker_deal.order_id)
+            tx.append_deal(maker, maker_deal)
+            tx.fill(exchange, maker, maker_deal.amount)
+            if maker.is_completed():
+                tx.dequeue(exchange, maker)
+                tx.remove(repo.orders, maker.id)
+        for revision in self.balance_revisions:
+            tx.adjust(repo.accounts.find(revision.account_id), revision)
+        tx.add_id(repo.orders_index, order.id, self.revision)
+
+# 开始集合竞价：之后的订单只挂到盘口上，不再连续撮合，直到 AuctionCleared
+class AuctionStarted(Event):
+    def __init__(self, revision, exchange_id):
+        self.revision = revision
+        self.exchange_id = exchange_id
+
+    @classmethod
+    def build(cls, repo, exchange_id):
+        if repo.exchanges.find(exchange_id).auction:
+            raise ValidationError("Exchange %s is already in auction" % exchange_id)
+        return cls(repo.revision + 1, exchange_id)
+
+    def as_json(self):
+        return {'type': self.__class__.__name__, 'revision': self.revision, 'exchange_id': self.exchange_id}
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        return cls(json['revision'], json['exchange_id'])
+
+    def pack(self, writer):
+        writer.string(self.exchange_id)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        return cls(revision, reader.string())
+
+    def apply(self, repo):
+        exchange = repo.exchanges.find(self.exchange_id)
+        if exchange.auction:
+            raise ValidationError("Exchange %s is already in auction" % self.exchange_id)
+        repo.transaction.set(exchange, 'auction', True)
+
+# 集合竞价撮合并恢复连续撮合：所有交叉的订单按同一个成交价一次成交，合成一个 event。
+# 成交价由 Exchange#clearing_price 算出，订单按价格优先、时间优先依次配对，
+# deals 是 (买单 Deal, 卖单 Deal) 的 tuple，余额变动按 (账户, 币种) 合并。
+# 两边不交叉时 price 为 None，没有成交，只是恢复连续撮合。
+class AuctionCleared(Event):
+    def __init__(self, revision, exchange_id, price, deals, balance_revisions):
+        self.revision = revision
+        self.exchange_id = exchange_id
+        self.price = price
+        self.deals = deals
+        self.balance_revisions = balance_revisions
+
+    @classmethod
+    def build(cls, repo, exchange_id):
+        exchange = repo.exchanges.find(exchange_id)
+        if not exchange.auction:
+            raise ValidationError("Exchange %s is not in auction" % exchange_id)
+        price, volume = exchange.clearing_price()
+        if price is None:
+            return cls(repo.revision + 1, exchange_id, None, (), ())
+        changes = BalanceChanges()
+        deals = []
+        # 订单在副本上累计成交，盘口本身在 apply 之前不动
+        bids, asks = exchange.makers(AskOrder.side, price), exchange.makers(BidOrder.side, price)
+        bid, ask = None, None
+        while True:
+            if bid is None or bid.is_completed():
+                level = next(bids, None)
+                if level is None:
+                    break
+                bid = repo.orders.find(level[1]).clone()
+            if ask is None or ask.is_completed():
+                level = next(asks, None)
+                if level is None:
+                    break
+                ask = repo.orders.find(level[1]).clone()
+            bid_deal, ask_deal = Exchange.compute_deals(bid, ask, price)
+            for order, deal in ((bid, bid_deal), (ask, ask_deal)):
+                order.append_deal(deal)
+                account = repo.accounts.find(order.account_id)
+                changes.update(*OrderDealt.build_balance_revisions(
+                    changes.current(account, order.income_type), changes.current(account, order.outcome_type), deal))
+            deals.append((bid_deal, ask_deal))
+        return cls(repo.revision + 1, exchange_id, price, tuple(deals), changes.revisions())
+
+    def as_json(self):
+        return {
+            'type': self.__class__.__name__,
+            'revision': self.revision,
+            'exchange_id': self.exchange_id,
+            'price': None if self.price is None else amounts.to_json(self.price),
+            'deals': [[bid_deal.as_json(), ask_deal.as_json()] for bid_deal, ask_deal in self.deals],
+            'balance_revisions': [revision.as_json() for revision in self.balance_revisions],
+        }
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = load_json(json)
+        price = None if json['price'] is None else amounts.from_json(json['price'])
+        return cls(json['revision'], json['exchange_id'], price,
+                tuple((Deal.build_by_json(bid_deal), Deal.build_by_json(ask_deal)) for bid_deal, ask_deal in json['deals']),
+                tuple(BalanceRevision.build_by_json(revision) for revision in json['balance_revisions']))
+
+    # 没有成交时不写价格
+    def pack(self, writer):
+        writer.string(self.exchange_id)
+        writer.u32(len(self.deals))
+        if self.deals:
+            writer.amount(self.price)
+        for bid_deal, ask_deal in self.deals:
+            writer.deal(bid_deal)
+            writer.deal(ask_deal)
+        writer.u32(len(self.balance_revisions))
+        for revision in self.balance_revisions:
+            writer.balance_revision(revision)
+
+    @classmethod
+    def unpack(cls, revision, reader):
+        exchange_id, count = reader.string(), reader.u32()
+        price = reader.amount() if count else None
+        deals = tuple((reader.deal(), reader.deal()) for i in xrange(count))
+        balance_revisions = tuple(reader.balance_revision() for i in xrange(reader.u32()))
+        return cls(revision, exchange_id, price, deals, balance_revisions)
+
+    def apply(self, repo):
+        exchange = repo.exchanges.find(self.exchange_id)
+        if not exchange.auction:
+            raise ValidationError("Exchange %s is not in auction" % self.exchange_id)
+        tx = repo.transaction
+        for deals in self.deals:
+            for deal in deals:
+                if deal.price != self.price:
+                    raise DealError("Deal price %s differs from clearing price %s" % (deal.price, self.price))
+                order = repo.orders.find(deal.order_id)
+                tx.append_deal(order, deal)
+                tx.fill(exchange, order, deal.amount)
+                if order.is_completed():
+                    tx.dequeue(exchange, order)
+                    tx.remove(repo.orders, order.id)
+        for revision in self.balance_revisions:
+            tx.adjust(repo.accounts.find(revision.account_id), revision)
+        tx.set(exchange, 'auction', False)
+
+def load_json(json):
+    if isinstance(json, basestring):
+        return loads(json)
+    return json
+
+# BinaryCodec 的类型标记，只能在末尾追加
+EVENT_TYPES = dict(enumerate([
+    AccountCreated,
+    AccountCanceled,
+    AccountCredited,
+    AccountDebited,
+    ExchangeCreated,
+    OrderCreated,
+    OrderCanceled,
+    OrderDealt,
+    OrderTaken,
+    AuctionStarted,
+    AuctionCleared,
+    OrdersMassCanceled,
+], 1))
+EVENT_TAGS = dict((klass, tag) for tag, klass in EVENT_TYPES.items())
+EVENT_NAMES = dict((klass.__name__, klass) for klass in EVENT_TAGS)
@@ -0,0 +1,185 @@
+# coding: utf-8
+# 只追加的事件日志。
+#
+# 每条记录是 HEADER(payload 长度, revision, crc32) 加上编码后的 event（默认用 BinaryCodec），
+# revision 严格递增。打开已有的日志时会校验所有记录，
+# 写了一半的尾部记录（进程在写入时崩溃）会被截掉。
+#
+# 落盘策略：
+#   SYNC_ALWAYS  每个 event 都 write + fsync
+#   SYNC_GROUP   攒够 group_size 个 event，或距上次落盘超过 group_interval 毫秒时一起 fsync
+#   SYNC_ASYNC   commit 从不等待磁盘，后台线程每 group_interval 毫秒落盘一次，group_interval 必须大于 0
+# 任何模式下 flush() 都会立即把积攒的 event 写盘。后台线程写盘失败时记下异常接着重试，
+# 下一次 append 或 flush 把这个异常抛给调用方。
+#
+# 每 INDEX_INTERVAL 条记录在内存里记一个 (revision, 位置)，read(since_revision) 从最近的索引点开始读，
+# 不用每次都从文件头扫起。
+import os
+import struct
+import zlib
+import threading
+from bisect import bisect_right
+from .codecs import BinaryCodec
+from .errors import JournalError
+
+SYNC_ALWAYS = 'always'
+SYNC_GROUP = 'group'
+SYNC_ASYNC = 'async'
+
+HEADER = struct.Struct('>IQI')
+
+INDEX_INTERVAL = 1024
+
+class Journal(object):
+    def __init__(self, path, sync=SYNC_GROUP, group_size=128, group_interval=10, codec=None):
+        if sync not in (SYNC_ALWAYS, SYNC_GROUP, SYNC_ASYNC):
+            raise ValueError("Unknown sync mode %s" % sync)
+        if sync == SYNC_ASYNC and not group_interval > 0:
+            raise ValueError("Sync mode %s needs a positive group_interval" % sync)
+        self.path = path
+        self.sync = sync
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.codec = codec or BinaryCodec()
+        # 稀疏索引，先追加位置再追加 revision，读的线程不加锁也不会看到没有位置的 revision
+        self.index_offsets = []
+        self.index_revisions = []
+        self.indexed = 0
+        self.revision = self._recover()
+        self.flushed_revision = self.revision
+        self.pending = []
+        self.lock = threading.Lock()
+        self.file = open(path, 'ab')
+        self.closed = False
+        # 后台线程写盘失败的异常，留给下一次 append 或 flush
+        self.error = None
+        self.stopped = threading.Event()
+        self.flusher = None
+        if sync != SYNC_ALWAYS and group_interval:
+            self.flusher = threading.Thread(target=self._flush_periodically, name='journal-flusher')
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def append(self, event):
+        self.extend([event])
+
+    # 一批 revision 连续的 event 一起追加，SYNC_ALWAYS 下也只 fsync 一次；flush 为真时不管哪种模式都立即落盘
+    def extend(self, events, flush=False):
+        records = []
+        for event in events:
+            payload = self.codec.encode(event)
+            records.append(HEADER.pack(len(payload), event.revision, zlib.crc32(payload) & 0xffffffff) + payload)
+        with self.lock:
+            self._raise_error()
+            if events[0].revision <= self.revision:
+                raise JournalError("Event revision %s is not after journal revision %s" % (events[0].revision, self.revision))
+            revision, count = self.revision, len(self.pending)
+            self.pending.extend(records)
+            self.revision = events[-1].revision
+            if flush or self.sync == SYNC_ALWAYS or (self.sync == SYNC_GROUP and len(self.pending) >= self.group_size):
+                # 写失败时这一批不算追加过，调用方会回滚内存里的状态
+                try:
+                    self._flush()
+                except:
+                    del self.pending[count:]
+                    self.revision = revision
+                    raise
+
+    def flush(self):
+        with self.lock:
+            self._raise_error()
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.closed = True
+            self.file.close()
+        self.stopped.set()
+        if self.flusher:
+            self.flusher.join()
+
+    # 按 revision 顺序读出 since_revision 之后的 event，只包含已经落盘的部分
+    def read(self, since_revision=0):
+        for payload in self.read_payloads(since_revision):
+            yield self.codec.decode(payload)
+
+    def read_payloads(self, since_revision=0):
+        i = bisect_right(self.index_revisions, since_revision)
+        start = self.index_offsets[i - 1] if i else 0
+        for revision, payload, offset in self._records(start):
+            if revision > since_revision:
+                yield payload
+
+    def _flush(self):
+        if not self.pending or self.closed:
+            return
+        self.file.seek(0, os.SEEK_END)
+        offset = start = self.file.tell()
+        try:
+            self.file.write(''.join(self.pending))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except:
+            # 尽量不留下写了一半的记录
+            try:
+                self.file.truncate(offset)
+            except (IOError, OSError):
+                pass
+            raise
+        for record in self.pending:
+            self._index(HEADER.unpack_from(record)[1], start)
+            start += len(record)
+        del self.pending[:]
+        self.flushed_revision = self.revision
+
+    def _flush_periodically(self):
+        while not self.closed:
+            self.stopped.wait(self.group_interval / 1000.0)
+            with self.lock:
+                try:
+                    self._flush()
+                except Exception as e:
+                    self.error = e
+
+    def _raise_error(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def _recover(self):
+        if not os.path.exists(self.path):
+            return 0
+        revision, valid_size = 0, 0
+        for revision, payload, end in self._records():
+            self._index(revision, valid_size)
+            valid_size = end
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+        return revision
+
+    def _index(self, revision, offset):
+        if self.indexed % INDEX_INTERVAL == 0:
+            self.index_offsets.append(offset)
+            self.index_revisions.append(revision)
+        self.indexed += 1
+
+    # 从 offset 处的记录开始，依次返回 (revision, payload, 该记录结束的位置)，遇到不完整或校验失败的记录就停下
+    def _records(self, offset=0):
+        last_revision = 0
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                length, revision, checksum = HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) & 0xffffffff != checksum:
+                    return
+                if revision <= last_revision:
+                    raise JournalError("Journal %s revision %s is out of order at offset %s" % (self.path, revision, offset))
+                offset += HEADER.size + length
+                last_revision = revision
+                yield revision, payload, offset
@@ -0,0 +1,220 @@
+# coding: utf-8
+# 按 event 类型统计 build 和 commit 的次数与耗时，外加盘口、挂单和去重索引的大小。
+#
+#   metrics.enable()       给 Repository.commit 和各个 Event 的 build 装上计时
+#   metrics.disable()      换回原来的方法，关掉以后没有任何额外开销
+#   metrics.collect(repo)  拉取当前的统计，返回 dict
+#   metrics.render(repo)   Prometheus 文本格式
+#
+# 耗时按微秒记在 HDR 风格的直方图里：每个 2 的幂区间再等分 SUB_BUCKETS 份，
+# 相对误差不超过 1/SUB_BUCKETS，记录一次只是几次整数运算和一次列表下标。
+# 盘口等大小只在拉取时计算，不在提交路径上。
+from timeit import default_timer
+from .entities import Repository
+from .events import EVENT_TYPES, OrderDealt
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+# Prometheus 直方图的边界，单位秒
+PROMETHEUS_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        if value < 2 * SUB_BUCKETS:
+            index = value
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS - 1
+            index = (shift << SUB_BUCKET_BITS) + (value >> shift)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    # 下标对应的区间上界
+    @staticmethod
+    def upper(index):
+        if index < 2 * SUB_BUCKETS:
+            return index
+        shift = (index >> SUB_BUCKET_BITS) - 1
+        return ((index - (shift << SUB_BUCKET_BITS) + 1) << shift) - 1
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = max(1, int(round(self.count * p)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.upper(index), self.max)
+        return self.max
+
+    # 不超过 value 的记录数，value 落在区间中间时按区间上界算
+    def count_below(self, value):
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if self.upper(index) > value:
+                break
+            seen += count
+        return seen
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'p999': self.percentile(0.999),
+        }
+
+class EventStats(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.build = Histogram()
+        self.apply = Histogram()
+
+stats = {}
+enabled = False
+_originals = []
+
+def reset():
+    stats.clear()
+    for klass in EVENT_TYPES.values():
+        stats[klass.__name__] = EventStats()
+
+def enable():
+    global enabled
+    if enabled:
+        return
+    reset()
+    _install(Repository, 'commit', _timed_commit)
+    for klass in EVENT_TYPES.values():
+        # OrderDealt.build 也是调用 build_by_orders，只包一层免得重复计数
+        name = 'build_by_orders' if klass is OrderDealt else 'build'
+        _install(klass, name, _timed_build)
+    enabled = True
+
+def disable():
+    global enabled
+    while _originals:
+        klass, name, original = _originals.pop()
+        setattr(klass, name, original)
+    enabled = False
+
+def _install(klass, name, wrap):
+    original = klass.__dict__[name]
+    _originals.append((klass, name, original))
+    if isinstance(original, classmethod):
+        setattr(klass, name, classmethod(wrap(original.__func__)))
+    else:
+        setattr(klass, name, wrap(original))
+
+def _timed_commit(commit):
+    def wrapper(self, event):
+        start = default_timer()
+        try:
+            commit(self, event)
+        except:
+            stats[type(event).__name__].errors += 1
+            raise
+        event_stats = stats[type(event).__name__]
+        event_stats.count += 1
+        event_stats.apply.record(int((default_timer() - start) * 1000000))
+    return wrapper
+
+def _timed_build(build):
+    def wrapper(cls, *args, **kwargs):
+        start = default_timer()
+        event = build(cls, *args, **kwargs)
+        stats[cls.__name__].build.record(int((default_timer() - start) * 1000000))
+        return event
+    return wrapper
+
+def collect(repo=None):
+    result = {'enabled': enabled, 'events': {}}
+    for name, event_stats in stats.items():
+        result['events'][name] = {
+            'count': event_stats.count,
+            'errors': event_stats.errors,
+            'build_us': event_stats.build.summary(),
+            'apply_us': event_stats.apply.summary(),
+        }
+    if repo is not None:
+        exchanges = {}
+        for exchange in repo.exchanges.entities.values():
+            exchanges[exchange.id] = {
+                'bid_levels': len(exchange.bids),
+                'ask_levels': len(exchange.asks),
+                'bid_orders': sum(len(queue) for queue in exchange.bids.values()),
+                'ask_orders': sum(len(queue) for queue in exchange.asks.values()),
+            }
+        result['repo'] = {
+            'revision': repo.revision,
+            'accounts': len(repo.accounts.entities),
+            'orders': len(repo.orders.entities),
+            'exchanges': exchanges,
+            'dedup': {
+                'orders': len(repo.orders_index),
+                'credits': len(repo.credits_index),
+                'debits': len(repo.debits_index),
+            },
+        }
+    return result
+
+def render(repo=None):
+    lines = []
+    def metric(name, kind, help, samples):
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            lines.append('%s%s %s' % (name, _labels(labels), value))
+    items = sorted(stats.items())
+    metric('meme_events_total', 'counter', 'Committed events by type',
+            [({'type': name}, s.count) for name, s in items])
+    metric('meme_event_errors_total', 'counter', 'Rejected commits by event type',
+            [({'type': name}, s.errors) for name, s in items])
+    for phase, help in (('build', 'Time spent building events'), ('apply', 'Time spent committing events')):
+        samples = []
+        for name, s in items:
+            histogram = getattr(s, phase)
+            for bound in PROMETHEUS_BUCKETS:
+                samples.append(({'type': name, 'le': repr(bound)}, histogram.count_below(int(bound * 1000000))))
+            samples.append(({'type': name, 'le': '+Inf'}, histogram.count))
+        name = 'meme_event_%s_seconds' % phase
+        metric(name, 'histogram', help, [])
+        lines.extend('%s_bucket%s %s' % (name, _labels(labels), value) for labels, value in samples)
+        lines.extend('%s_sum%s %s' % (name, _labels({'type': n}), repr(getattr(s, phase).total / 1000000.0)) for n, s in items)
+        lines.extend('%s_count%s %s' % (name, _labels({'type': n}), getattr(s, phase).count) for n, s in items)
+    if repo is not None:
+        state = collect(repo)['repo']
+        metric('meme_revision', 'gauge', 'Last committed revision', [({}, state['revision'])])
+        metric('meme_accounts', 'gauge', 'Number of accounts', [({}, state['accounts'])])
+        metric('meme_orders', 'gauge', 'Number of pending orders', [({}, state['orders'])])
+        exchanges = sorted(state['exchanges'].items())
+        metric('meme_book_levels', 'gauge', 'Price levels in the book',
+                [({'exchange': id, 'side': side}, book[side + '_levels']) for id, book in exchanges for side in ('bid', 'ask')])
+        metric('meme_book_orders', 'gauge', 'Orders in the book',
+                [({'exchange': id, 'side': side}, book[side + '_orders']) for id, book in exchanges for side in ('bid', 'ask')])
+        metric('meme_dedup_entries', 'gauge', 'Ids held by the dedup indexes',
+                [({'index': name}, size) for name, size in sorted(state['dedup'].items())])
+    return '\n'.join(lines) + '\n'
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, labels[key]) for key in sorted(labels))
+
+reset()
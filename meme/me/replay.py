@@ -0,0 +1,280 @@
+# coding: utf-8
+# 并行重放事件日志，重建 Repository。
+#
+# 不同交易对的盘口和挂单互不相关，而余额是共享的。所以先顺序扫一遍日志：
+#   - 每个账户每个币种的余额就是最后写入的那个 BalanceRevision，直接取最后一个
+#   - 去重用的 id 和账户的创建、注销也在这一遍里处理
+#   - 挂单相关的 event 按交易对分组，只留原始的 payload
+# 这一遍只解出路由用的 id 和 BalanceRevision，订单和成交的完整解码连同盘口重建
+# 都在进程池里按交易对各自进行，最后合并。
+# verify=True 时再顺序重放一遍，结果不一致就抛 ReplayError。
+#
+#   python -m meme.me.replay events.log [--processes N] [--verify] [--snapshot repo.snapshot]
+import sys
+import argparse
+import multiprocessing
+from . import amounts, book
+from .entities import Repository, Account, Exchange
+from .events import AccountCreated, AccountCanceled, AccountCredited, AccountDebited, ExchangeCreated, OrderCreated, OrderCanceled, OrderDealt, OrderTaken, AuctionStarted, AuctionCleared, OrdersMassCanceled
+from .codecs import BinaryCodec
+from .journal import Journal
+from .errors import ReplayError
+
+def replay_events(events, processes=None, verify=False):
+    events = list(events)
+    codec = BinaryCodec()
+    repo = _replay((codec.encode(event) for event in events), codec, processes)
+    if verify:
+        _verify(repo, events)
+    return repo
+
+# 顺序扫描时边读边处理，不把整个日志留在内存里；verify 时再从 journal 读一遍
+def replay_journal(journal, processes=None, verify=False):
+    repo = _replay(journal.read_payloads(), journal.codec, processes)
+    if verify:
+        _verify(repo, journal.read())
+    return repo
+
+def _replay(payloads, codec, processes):
+    repo = Repository()
+    accounts = repo.accounts.entities
+    exchanges = {}
+    orders_exchange = {}
+    scan = _scan_binary if isinstance(codec, BinaryCodec) else _scan_event
+    for payload in payloads:
+        klass, revision, key, revisions = scan(codec, payload)
+        repo.revision = revision
+        for balance_revision in revisions:
+            _adjust(accounts, balance_revision)
+        if klass is AccountCreated:
+            if key not in accounts:
+                accounts[key] = Account(key, store=repo.balances)
+        elif klass is AccountCanceled:
+            accounts.pop(key, None)
+        elif klass is AccountCredited:
+            repo.credits_index.add(key, revision)
+        elif klass is AccountDebited:
+            repo.debits_index.add(key, revision)
+        elif klass is ExchangeCreated:
+            coin_type, price_type = key
+            exchanges.setdefault("%s-%s" % key, (coin_type, price_type, []))
+        elif klass is OrderCreated:
+            order_id, exchange_id = key
+            orders_exchange[order_id] = exchange_id
+            exchanges[exchange_id][2].append(payload)
+            repo.orders_index.add(order_id, revision)
+        elif klass is OrderCanceled or klass is OrderDealt:
+            exchanges[orders_exchange[key]][2].append(payload)
+        elif klass is OrderTaken:
+            order_id, exchange_id, dealt = key
+            if dealt:
+                exchanges[exchange_id][2].append(payload)
+            repo.orders_index.add(order_id, revision)
+        elif klass is OrdersMassCanceled:
+            # 每个涉及的交易对各收到一份，重建时只撤自己盘口上的
+            for exchange_id in set(orders_exchange[order_id] for order_id in key):
+                exchanges[exchange_id][2].append(payload)
+        elif klass is AuctionStarted or klass is AuctionCleared:
+            exchanges[key][2].append(payload)
+        else:
+            raise ReplayError("Can not replay %s in parallel" % klass.__name__)
+
+    tasks = [(coin_type, price_type, payloads, codec, amounts.engine.name, book.book) for coin_type, price_type, payloads in exchanges.values()]
+    if processes == 1 or len(tasks) < 2:
+        results = map(_rebuild_exchange, tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_rebuild_exchange, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    for exchange, orders in results:
+        repo.exchanges.add(exchange)
+        for order in orders.values():
+            repo.orders.add(order)
+
+    return repo
+
+# 顺序扫描只需要 (类型, revision, 路由用的 key, 要归并的 BalanceRevision)，key 按类型是：
+#   账户 id、充值提现 id、(coin_type, price_type)、(order_id, exchange_id)、order_id、
+#   (order_id, exchange_id, 有没有成交)、order_id 的 tuple 或者 exchange_id
+# 二进制编码直接从 payload 里读这些字段，订单和成交的其余部分跳过，留给进程池去完整解码
+def _scan_binary(codec, payload):
+    klass, revision, reader = codec.open(payload)
+    key, revisions = SCANNERS[klass](reader)
+    return klass, revision, key, revisions
+
+def _scan_account(reader):
+    return reader.id(), ()
+
+def _scan_transfer(reader):
+    id = reader.id()
+    reader.id()
+    reader.string()
+    return id, (reader.balance_revision(),)
+
+def _scan_exchange(reader):
+    return (reader.string(), reader.string()), ()
+
+def _scan_order_created(reader):
+    return reader.order_route(), (reader.balance_revision(),)
+
+def _scan_order_canceled(reader):
+    return reader.id(), (reader.balance_revision(),)
+
+def _scan_mass_canceled(reader):
+    reader.id()
+    order_ids = tuple(reader.id() for i in xrange(reader.u32()))
+    return order_ids, _read_revisions(reader, reader.u32())
+
+def _scan_order_dealt(reader):
+    order_id = reader.deal_order_id()
+    reader.deal_order_id()
+    return order_id, _read_revisions(reader, 4)
+
+def _scan_order_taken(reader):
+    reader.string()
+    order_id, exchange_id = reader.order_route()
+    count = reader.u32()
+    for i in xrange(count * 2):
+        reader.deal_order_id()
+    return (order_id, exchange_id, count > 0), _read_revisions(reader, reader.u32())
+
+def _scan_auction_started(reader):
+    return reader.string(), ()
+
+def _scan_auction_cleared(reader):
+    exchange_id, count = reader.string(), reader.u32()
+    if count:
+        reader.skip_amount()
+    for i in xrange(count * 2):
+        reader.deal_order_id()
+    return exchange_id, _read_revisions(reader, reader.u32())
+
+def _read_revisions(reader, count):
+    return tuple(reader.balance_revision() for i in xrange(count))
+
+SCANNERS = {
+    AccountCreated: _scan_account,
+    AccountCanceled: _scan_account,
+    AccountCredited: _scan_transfer,
+    AccountDebited: _scan_transfer,
+    ExchangeCreated: _scan_exchange,
+    OrderCreated: _scan_order_created,
+    OrderCanceled: _scan_order_canceled,
+    OrdersMassCanceled: _scan_mass_canceled,
+    OrderDealt: _scan_order_dealt,
+    OrderTaken: _scan_order_taken,
+    AuctionStarted: _scan_auction_started,
+    AuctionCleared: _scan_auction_cleared,
+}
+
+# 其他编码只能完整解码，再取出同样的字段
+def _scan_event(codec, payload):
+    event = codec.decode(payload)
+    klass = type(event)
+    if klass is AccountCreated or klass is AccountCanceled:
+        key, revisions = event.account_id, ()
+    elif klass is AccountCredited or klass is AccountDebited:
+        key, revisions = event.id, (event.balance_revision,)
+    elif klass is ExchangeCreated:
+        key, revisions = (event.coin_type, event.price_type), ()
+    elif klass is OrderCreated:
+        key, revisions = (event.order.id, event.order.exchange_id), (event.balance_revision,)
+    elif klass is OrderCanceled:
+        key, revisions = event.order_id, (event.balance_revision,)
+    elif klass is OrdersMassCanceled:
+        key, revisions = event.order_ids, event.balance_revisions
+    elif klass is OrderDealt:
+        key, revisions = event.bid_deal.order_id, event.bid_balance_revisions + event.ask_balance_revisions
+    elif klass is OrderTaken:
+        key, revisions = (event.order.id, event.order.exchange_id, bool(event.deals)), event.balance_revisions
+    elif klass is AuctionStarted:
+        key, revisions = event.exchange_id, ()
+    elif klass is AuctionCleared:
+        key, revisions = event.exchange_id, event.balance_revisions
+    else:
+        raise ReplayError("Can not replay %s in parallel" % klass.__name__)
+    return klass, event.revision, key, revisions
+
+# 日志里的 BalanceRevision 都是 apply 成功的，账户一定存在
+def _adjust(accounts, revision):
+    account = accounts.get(revision.account_id)
+    if account is not None:
+        account.overwrite(revision)
+
+def _rebuild_exchange(task):
+    coin_type, price_type, payloads, codec, engine_name, book_name = task
+    amounts.use(engine_name)
+    book.use(book_name)
+    exchange = Exchange(coin_type, price_type)
+    orders = {}
+    for payload in payloads:
+        event = codec.decode(payload)
+        klass = type(event)
+        if klass is OrderCreated:
+            order = orders[event.order.id] = event.order.clone()
+            exchange.enqueue(order)
+        elif klass is OrderCanceled:
+            exchange.dequeue(orders.pop(event.order_id))
+        elif klass is OrdersMassCanceled:
+            for order_id in event.order_ids:
+                if order_id in orders:
+                    exchange.dequeue(orders.pop(order_id))
+        elif klass is AuctionStarted:
+            exchange.auction = True
+        else:
+            if klass is OrderDealt:
+                deals = (event.bid_deal, event.ask_deal)
+            elif klass is OrderTaken:
+                deals = [maker_deal for taker_deal, maker_deal in event.deals]
+            else:
+                deals = [deal for pair in event.deals for deal in pair]
+                exchange.auction = False
+            for deal in deals:
+                order = orders[deal.order_id]
+                order.append_deal(deal)
+                exchange.fill(order, deal.amount)
+                if order.is_completed():
+                    exchange.dequeue(order)
+                    del orders[order.id]
+    return exchange, orders
+
+# events 只遍历一遍，可以是 journal.read() 这样的生成器
+def _verify(repo, events):
+    expected = Repository()
+    for event in events:
+        expected.replay([event])
+        if type(event) in (OrderCreated, OrderTaken) and event.order.id not in repo.orders_index:
+            raise ReplayError("Order %s missing from orders_index" % event.order.id)
+        if type(event) is AccountCredited and event.id not in repo.credits_index:
+            raise ReplayError("Credit %s missing from credits_index" % event.id)
+        if type(event) is AccountDebited and event.id not in repo.debits_index:
+            raise ReplayError("Debit %s missing from debits_index" % event.id)
+    if expected != repo:
+        raise ReplayError("Parallel replay does not match sequential replay at revision %s" % expected.revision)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild a Repository from an event journal')
+    parser.add_argument('journal')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--verify', action='store_true')
+    parser.add_argument('--snapshot', help='write the rebuilt Repository to this snapshot file')
+    parser.add_argument('--engine', default=amounts.engine.name, choices=sorted(amounts.ENGINES))
+    parser.add_argument('--book', default=book.book, choices=sorted(book.BOOKS))
+    args = parser.parse_args(argv)
+    amounts.use(args.engine)
+    book.use(args.book)
+    journal = Journal(args.journal, group_interval=0)
+    try:
+        repo = replay_journal(journal, args.processes, args.verify)
+    finally:
+        journal.close()
+    if args.snapshot:
+        repo.save_snapshot(args.snapshot)
+    print "replayed %d accounts, %d exchanges, %d resting orders up to revision %d" % (
+            len(repo.accounts.entities), len(repo.exchanges.entities), len(repo.orders.entities), repo.revision)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,319 @@
+# coding: utf-8
+# 多进程分片部署：一个余额账本进程，加上若干撮合进程，每个撮合进程负责一组交易对。
+#
+# 每个进程都有自己的 Repository 和 journal，进程之间只传普通的 event 参数。
+# 撮合进程里的账户只持有预留给本分片的资金：
+#   冻结  撮合进程先请账本 AccountDebited('reserve-<order_id>')，
+#         成功后在本地 AccountCredited 同一笔钱，再照常提交 OrderCreated 冻结它
+#   结算  OrderDealt、OrderCanceled 之后，本地账户 active 里的钱（成交收入、解冻的余额）
+#         都在本地 AccountDebited，再由账本 AccountCredited 收回
+# 所以任何时刻 账本余额 + 各分片余额 = 总额，各分片的 active 在一批请求处理完后总是 0。
+# 预留的 id 由 order_id 决定，同一个订单重试也不会冻结两次。
+import os
+import select
+import multiprocessing
+from . import amounts, book
+from .entities import Repository, BidOrder, AskOrder
+from .events import AccountCreated, AccountCredited, AccountDebited, ExchangeCreated, OrderCreated, OrderCanceled
+from .journal import Journal, SYNC_GROUP
+from .errors import MemeError, ShardError
+
+ORDER_SIDES = {BidOrder.side: BidOrder, AskOrder.side: AskOrder}
+
+class Ledger(object):
+    def __init__(self, repo):
+        self.repo = repo
+
+    def create_account(self, account_id):
+        if not self.repo.accounts.get(account_id):
+            self.repo.commit(AccountCreated.build(self.repo, account_id))
+
+    def credit(self, id, account_id, coin_type, amount):
+        self.repo.commit(AccountCredited.build(self.repo, id, account_id, coin_type, amount))
+
+    def debit(self, id, account_id, coin_type, amount):
+        self.repo.commit(AccountDebited.build(self.repo, id, account_id, coin_type, amount))
+
+    # 每一项单独提交，返回每一项的错误，没有错误的是 None
+    def reserve(self, reservations):
+        return [_try(self.debit, *reservation) for reservation in reservations]
+
+    def settle(self, settlements):
+        for settlement in settlements:
+            self.credit(*settlement)
+
+    def balances(self, account_id):
+        account = self.repo.accounts.find(account_id)
+        return dict((coin_type, (balance.active, balance.frozen)) for coin_type, balance in account.balances.items())
+
+    def close(self):
+        self.repo.flush()
+
+class Matcher(object):
+    def __init__(self, name, repo, ledger, pairs):
+        self.name = name
+        self.repo = repo
+        self.ledger = ledger
+        for coin_type, price_type in pairs:
+            if not repo.exchanges.get("%s-%s" % (coin_type, price_type)):
+                repo.commit(ExchangeCreated.build(repo, coin_type, price_type))
+
+    # orders 是 dict 的列表，字段和 Order#as_json 相同（不含 deals），返回每个订单的错误
+    def submit(self, orders):
+        repo = self.repo
+        engine = amounts.engine
+        results = [None] * len(orders)
+        built = []
+        for i, json in enumerate(orders):
+            try:
+                klass = ORDER_SIDES[json['side']]
+                built.append((i, klass(json['id'], json['account_id'], json['coin_type'], json['price_type'],
+                        json['price'], json['amount'], json['fee_rate'], json.get('timestamp'))))
+            except (KeyError, ValueError, ArithmeticError, MemeError) as e:
+                results[i] = e
+        reservations = [(_reserve_id(order), order.account_id, order.outcome_type, engine.to_decimal(order.freeze_amount)) for i, order in built]
+        touched = set()
+        for (i, order), reservation, error in zip(built, reservations, self.ledger.reserve(reservations)):
+            if error is not None:
+                results[i] = error
+                continue
+            touched.add(order.account_id)
+            if not repo.accounts.get(order.account_id):
+                repo.commit(AccountCreated.build(repo, order.account_id))
+            repo.commit(AccountCredited.build(repo, *reservation))
+            account = repo.accounts.find(order.account_id)
+            try:
+                repo.commit(OrderCreated(repo.revision + 1, order, OrderCreated.build_balance_revision(account, order)))
+            except MemeError as e:
+                # 预留的钱在下面的结算里退回账本
+                results[i] = e
+                continue
+            for event in repo.exchanges.find(order.exchange_id).match_all(repo):
+                touched.update(revision.account_id for revision in event.bid_balance_revisions + event.ask_balance_revisions)
+        self._settle(touched)
+        return results
+
+    def cancel(self, order_ids):
+        repo = self.repo
+        results = []
+        touched = set()
+        for order_id in order_ids:
+            try:
+                order = repo.orders.find(order_id)
+                repo.commit(OrderCanceled.build(repo, order_id))
+                touched.add(order.account_id)
+                results.append(None)
+            except MemeError as e:
+                results.append(e)
+        self._settle(touched)
+        return results
+
+    def balances(self, account_id):
+        account = self.repo.accounts.get(account_id)
+        if not account:
+            return {}
+        return dict((coin_type, (balance.active, balance.frozen)) for coin_type, balance in account.balances.items())
+
+    def close(self):
+        self.repo.flush()
+
+    # 把本地 active 里的钱全部交还账本
+    def _settle(self, account_ids):
+        repo = self.repo
+        settlements = []
+        for account_id in sorted(account_ids):
+            account = repo.accounts.find(account_id)
+            for coin_type, balance in sorted(account.balances.items()):
+                if balance.active > 0:
+                    settlement = ('settle-%s-%s' % (self.name, repo.revision + 1), account_id, coin_type, amounts.engine.to_decimal(balance.active))
+                    repo.commit(AccountDebited.build(repo, *settlement))
+                    settlements.append(settlement)
+        if settlements:
+            self.ledger.settle(settlements)
+
+# 通过 Pipe 调用另一个进程里的 Ledger 或 Matcher
+class Client(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    # 对面的进程退出以后 send 会 EPIPE，recv 会 EOFError
+    def send(self, method, *args):
+        try:
+            self.conn.send((method, args))
+        except IOError as e:
+            raise ShardError("Shard is gone: %s" % e)
+
+    def receive(self):
+        try:
+            error, result = self.conn.recv()
+        except (EOFError, IOError) as e:
+            raise ShardError("Shard is gone: %s" % (e or 'EOF'))
+        if error is not None:
+            raise error
+        return result
+
+    def call(self, method, *args):
+        self.send(method, *args)
+        return self.receive()
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *args: self.call(method, *args)
+
+def serve(target, conns):
+    conns = list(conns)
+    while conns:
+        for conn in select.select(conns, [], [])[0]:
+            try:
+                method, args = conn.recv()
+            except EOFError:
+                conns.remove(conn)
+                continue
+            if method == 'stop':
+                target.close()
+                conn.send((None, None))
+                return
+            # 任何异常都交回调用方，不能让进程退出、调用方一直等着
+            try:
+                result = getattr(target, method)(*args)
+            except Exception as e:
+                _send_error(conn, e)
+            else:
+                conn.send((None, result))
+
+# 异常不能 pickle 时换成 MemeError
+def _send_error(conn, error):
+    try:
+        conn.send((error, None))
+    except Exception:
+        conn.send((MemeError("%s: %s" % (type(error).__name__, error)), None))
+
+class ShardedEngine(object):
+    # shards 是交易对分组的列表，比如 [[('ltc', 'btc')], [('eth', 'btc'), ('doge', 'btc')]]
+    def __init__(self, shards, path=None, sync=SYNC_GROUP):
+        self.shards = [list(pairs) for pairs in shards]
+        self.routes = {}
+        for i, pairs in enumerate(self.shards):
+            for coin_type, price_type in pairs:
+                self.routes["%s-%s" % (coin_type, price_type)] = i
+        self.path = path
+        self.sync = sync
+        self.processes = []
+        self.ledger = None
+        self.matchers = []
+
+    # 每个进程只留下自己那一端，其余的都关掉，一个进程退出时对端才能读到 EOF
+    def start(self):
+        engine_name, book_name = amounts.engine.name, book.book
+        client_conn, ledger_conn = multiprocessing.Pipe()
+        matcher_pipes = [multiprocessing.Pipe() for pairs in self.shards]
+        ledger_pipes = [multiprocessing.Pipe() for pairs in self.shards]
+        parent_conns = [client_conn] + [client for client, conn in matcher_pipes]
+        child_conns = [ledger_conn] + [conn for client, conn in matcher_pipes] + [conn for pipe in ledger_pipes for conn in pipe]
+        ledger_conns = [ledger_conn] + [conn for client, conn in ledger_pipes]
+        for i, pairs in enumerate(self.shards):
+            matcher_conn, ledger_client = matcher_pipes[i][1], ledger_pipes[i][0]
+            self._spawn(_run_matcher, [matcher_conn, ledger_client], parent_conns + child_conns,
+                    'shard%d' % i, pairs, matcher_conn, ledger_client, self._journal_path('shard%d' % i), self.sync, engine_name, book_name)
+            self.matchers.append(Client(matcher_pipes[i][0]))
+        self._spawn(_run_ledger, ledger_conns, parent_conns + child_conns, ledger_conns, self._journal_path('ledger'), self.sync, engine_name)
+        self.ledger = Client(client_conn)
+        for conn in child_conns:
+            conn.close()
+
+    # 已经退出的进程跳过
+    def stop(self):
+        for client in self.matchers + [self.ledger]:
+            try:
+                client.call('stop')
+            except ShardError:
+                pass
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        self.matchers = []
+        self.ledger = None
+
+    def create_account(self, account_id):
+        self.ledger.create_account(account_id)
+
+    def credit(self, id, account_id, coin_type, amount):
+        self.ledger.credit(id, account_id, coin_type, amount)
+
+    def debit(self, id, account_id, coin_type, amount):
+        self.ledger.debit(id, account_id, coin_type, amount)
+
+    # 各分片并行处理，按原来的顺序返回每个订单的错误
+    def submit(self, orders):
+        groups = {}
+        for i, order in enumerate(orders):
+            shard = self.routes["%s-%s" % (order['coin_type'], order['price_type'])]
+            groups.setdefault(shard, []).append(i)
+        for shard, indexes in groups.items():
+            self.matchers[shard].send('submit', [orders[i] for i in indexes])
+        results = [None] * len(orders)
+        for shard, indexes in groups.items():
+            for i, result in zip(indexes, self.matchers[shard].receive()):
+                results[i] = result
+        return results
+
+    def cancel(self, exchange_id, order_ids):
+        return self.matchers[self.routes[exchange_id]].cancel(order_ids)
+
+    # 账本和各分片里的余额合计，(active, frozen)
+    def balances(self, account_id):
+        totals = self.ledger.balances(account_id)
+        for matcher in self.matchers:
+            for coin_type, (active, frozen) in matcher.balances(account_id).items():
+                total_active, total_frozen = totals.get(coin_type, (0, 0))
+                totals[coin_type] = (total_active + active, total_frozen + frozen)
+        return totals
+
+    def _journal_path(self, name):
+        if self.path:
+            return os.path.join(self.path, '%s.log' % name)
+
+    def _spawn(self, target, keep, conns, *args):
+        process = multiprocessing.Process(target=_run_child, args=(target, keep, conns) + args)
+        process.daemon = True
+        process.start()
+        self.processes.append(process)
+
+def _try(fn, *args):
+    try:
+        fn(*args)
+    except MemeError as e:
+        return e
+
+def _reserve_id(order):
+    return 'reserve-%s' % (order.id, )
+
+def _open_repo(journal_path, sync):
+    if not journal_path:
+        return Repository()
+    repo = Repository(journal=Journal(journal_path, sync=sync), dedup_path=journal_path + '.dedup')
+    repo.sync()
+    return repo
+
+# fork 出来的子进程继承了父进程所有的 Pipe，不是自己的先关掉
+def _run_child(target, keep, conns, *args):
+    for conn in conns:
+        if not any(conn is own for own in keep):
+            conn.close()
+    target(*args)
+
+def _run_ledger(conns, journal_path, sync, engine_name):
+    amounts.use(engine_name)
+    repo = _open_repo(journal_path, sync)
+    serve(Ledger(repo), conns)
+    if repo.journal:
+        repo.journal.close()
+
+def _run_matcher(name, pairs, conn, ledger_conn, journal_path, sync, engine_name, book_name):
+    amounts.use(engine_name)
+    book.use(book_name)
+    repo = _open_repo(journal_path, sync)
+    serve(Matcher(name, repo, Client(ledger_conn), pairs), [conn])
+    if repo.journal:
+        repo.journal.close()
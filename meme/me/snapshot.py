@@ -0,0 +1,189 @@
+# coding: utf-8
+# Repository 的二进制快照。
+#
+# 文件结构（整数都是大端）：
+#   MAGIC | 金额引擎名 | revision | 各段的起始位置
+#   accounts   所有账户及其 BalanceRevision
+#   orders     挂单记录，包括已有的成交
+#   index      order_id 到订单记录位置的索引
+#   exchanges  每个交易对是否在集合竞价，以及买卖盘，按价位和队列顺序保存 order_id 及其未成交数量
+#   filters    去重用的 DedupIndex
+#
+# 加载时整个文件 mmap 进来，账户和盘口直接解码；订单只读索引，
+# 第一次被访问时才解码，几百万挂单的重启不必把它们全部变成 Python 对象。
+import os
+import mmap
+import struct
+import cPickle as pickle
+from . import amounts
+from .entities import Repository, Account, Exchange
+from .book import OrderQueue
+from .balances import BalanceStore
+from .codecs import Writer, Reader
+from .errors import SnapshotError
+
+MAGIC = 'MEMESNP4'
+
+SECTIONS = struct.Struct('>QQQQQ')
+
+# 像 dict 一样使用；快照里的实体在第一次 get 时才解码
+class LazyEntities(object):
+    def __init__(self, decode, offsets):
+        self._decode = decode
+        self._offsets = offsets
+        self._entities = {}
+
+    def get(self, id, default=None):
+        entity = self._entities.get(id)
+        if entity is None:
+            offset = self._offsets.pop(id, None)
+            if offset is None:
+                return default
+            entity = self._entities[id] = self._decode(offset)
+        return entity
+
+    def __getitem__(self, id):
+        entity = self.get(id)
+        if entity is None:
+            raise KeyError(id)
+        return entity
+
+    def __setitem__(self, id, entity):
+        self._offsets.pop(id, None)
+        self._entities[id] = entity
+
+    def pop(self, id, *default):
+        entity = self.get(id)
+        if entity is None:
+            if default:
+                return default[0]
+            raise KeyError(id)
+        del self._entities[id]
+        return entity
+
+    def __contains__(self, id):
+        return id in self._entities or id in self._offsets
+
+    def __len__(self):
+        return len(self._entities) + len(self._offsets)
+
+    def __iter__(self):
+        for id in self._entities.keys() + self._offsets.keys():
+            yield id
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[id] for id in self.keys()]
+
+    def items(self):
+        return [(id, self[id]) for id in self.keys()]
+
+    def __eq__(self, other):
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+def dump(repo, path):
+    engine = amounts.engine
+    accounts = Writer(engine)
+    accounts.u32(len(repo.accounts.entities))
+    for account in repo.accounts.entities.values():
+        _write_account(accounts, account)
+    orders = Writer(engine)
+    index = Writer(engine)
+    index.u32(len(repo.orders.entities))
+    for order in repo.orders.entities.values():
+        index.id(order.id)
+        index.u64(orders.size)
+        orders.order(order)
+    exchanges = Writer(engine)
+    exchanges.u32(len(repo.exchanges.entities))
+    for exchange in repo.exchanges.entities.values():
+        _write_exchange(exchanges, exchange)
+    filters = pickle.dumps((repo.debits_index, repo.credits_index, repo.orders_index), pickle.HIGHEST_PROTOCOL)
+
+    header = Writer(engine)
+    header.write(MAGIC)
+    header.string(engine.name)
+    header.u64(repo.revision)
+    offset = header.size + SECTIONS.size
+    sections = []
+    for section in (accounts, orders, index, exchanges):
+        sections.append(offset)
+        offset += section.size
+    sections.append(offset)
+    header.write(SECTIONS.pack(*sections))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for section in (header, accounts, orders, index, exchanges):
+            f.write(section.getvalue())
+        f.write(filters)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+def load(path, journal=None):
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buf[:len(MAGIC)] != MAGIC:
+        raise SnapshotError("%s is not a snapshot" % path)
+    engine = amounts.engine
+    header = Reader(buf, len(MAGIC), engine)
+    engine_name = header.string()
+    if engine_name != engine.name:
+        raise SnapshotError("Snapshot %s was written by the %s amount engine, current engine is %s" % (path, engine_name, engine.name))
+    revision = header.u64()
+    accounts_offset, orders_offset, index_offset, exchanges_offset, filters_offset = header.unpack(SECTIONS)
+
+    reader = Reader(buf, accounts_offset, engine)
+    balances = BalanceStore()
+    accounts = dict((account.id, account) for account in [_read_account(reader, balances) for i in xrange(reader.u32())])
+    reader = Reader(buf, index_offset, engine)
+    offsets = {}
+    for i in xrange(reader.u32()):
+        order_id = reader.id()
+        offsets[order_id] = orders_offset + reader.u64()
+    orders = LazyEntities(lambda offset: Reader(buf, offset, engine).order(), offsets)
+    reader = Reader(buf, exchanges_offset, engine)
+    exchanges = dict((exchange.id, exchange) for exchange in [_read_exchange(reader) for i in xrange(reader.u32())])
+    debits_index, credits_index, orders_index = pickle.loads(buf[filters_offset:])
+    return Repository(revision, accounts, orders, exchanges, debits_index, credits_index, orders_index, journal=journal, balances=balances)
+
+def _write_account(writer, account):
+    writer.id(account.id)
+    writer.u32(len(account.balances))
+    for revision in account.balances.values():
+        writer.balance_revision(revision)
+
+def _read_account(reader, store):
+    account_id = reader.id()
+    balances = {}
+    for i in xrange(reader.u32()):
+        revision = reader.balance_revision()
+        balances[revision.coin_type] = revision
+    return Account(account_id, balances, store)
+
+def _write_exchange(writer, exchange):
+    writer.string(exchange.coin_type)
+    writer.string(exchange.price_type)
+    writer.u32(exchange.auction)
+    for levels in (exchange.bids, exchange.asks):
+        writer.u32(len(levels))
+        for price, queue in levels.items():
+            writer.amount(price)
+            writer.u32(len(queue))
+            for order_id, amount in queue.items():
+                writer.id(order_id)
+                writer.amount(amount)
+
+def _read_exchange(reader):
+    exchange = Exchange(reader.string(), reader.string())
+    exchange.auction = bool(reader.u32())
+    for levels in (exchange.bids, exchange.asks):
+        for i in xrange(reader.u32()):
+            price = reader.amount()
+            levels[price] = OrderQueue([(reader.id(), reader.amount()) for j in xrange(reader.u32())])
+    return exchange
@@ -0,0 +1,79 @@
+# coding: utf-8
+
+# 事务内的每次修改都记下修改前的值，出错时按相反顺序恢复，
+# 这样 Event#apply 可以直接原地修改实体，不必再 deepcopy
+class Transaction(object):
+    def __init__(self):
+        self.undo_log = []
+
+    def record(self, fn, *args):
+        self.undo_log.append((fn, args))
+
+    # 撤销到 undo_log 只剩 mark 条为止
+    def rollback(self, mark=0):
+        undo_log = self.undo_log
+        while len(undo_log) > mark:
+            fn, args = undo_log.pop()
+            fn(*args)
+
+    def adjust(self, account, revision):
+        old_balance = account.store.get(account.slot, revision.coin_type)
+        account.adjust(revision)
+        self.record(_restore_balance, account, revision.coin_type, old_balance)
+
+    def set(self, entity, name, value):
+        self.record(setattr, entity, name, getattr(entity, name))
+        setattr(entity, name, value)
+
+    def add(self, entities_set, entity):
+        old_entity = entities_set.get(entity.id)
+        entities_set.add(entity)
+        self.record(_restore_entity, entities_set, entity.id, old_entity)
+
+    def remove(self, entities_set, id):
+        old_entity = entities_set.get(id)
+        entities_set.remove(id)
+        self.record(_restore_entity, entities_set, id, old_entity)
+
+    def append_deal(self, order, deal):
+        filled = (len(order.deals), order.filled_amount, order.filled_outcome)
+        order.append_deal(deal)
+        self.record(_restore_fills, order, *filled)
+
+    def add_id(self, index, id, revision):
+        index.add(id, revision)
+        self.record(index.discard, id)
+
+    def enqueue(self, exchange, order):
+        exchange.enqueue(order)
+        self.record(exchange.dequeue, order)
+
+    def fill(self, exchange, order, amount):
+        exchange.fill(order, amount)
+        self.record(exchange.fill, order, 0 - amount)
+
+    def dequeue(self, exchange, order):
+        position = exchange.dequeue(order)
+        if position is not None:
+            self.record(exchange.restore, order, position)
+
+# 经过 EntitiesSet 的 add/remove 恢复，OrdersSet 的账户索引也跟着恢复
+def _restore_entity(entities_set, id, entity):
+    if entity is None:
+        entities_set.remove(id)
+    else:
+        entities_set.add(entity)
+
+def _restore_balance(account, coin_type, balance):
+    if balance is None:
+        account.store.unset(account.slot, coin_type)
+    else:
+        account.store.set(account.slot, coin_type, *balance)
+
+def _restore_fills(order, deals_count, filled_amount, filled_outcome):
+    if deals_count:
+        del order.deals[deals_count:]
+    else:
+        order.deals = ()
+    order.filled_amount = filled_amount
+    order.filled_outcome = filled_outcome
@@ -1,5 +1,10 @@
+# coding: utf-8
 def validate_id(id):
     id = str(id)
     if len(id) > 128 or len(id) < 1:
         return False
     return True
+
+# 币种、账户 id 这类大量重复的字符串共用一个对象；不是 str 的原样返回
+def intern_string(value):
+    return intern(value) if type(value) is str else value
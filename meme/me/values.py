@@ -1,9 +1,10 @@
 from collections import namedtuple
-from decimal import Decimal
 from operator import attrgetter
 from .errors import BalanceError
+from . import amounts
+from .utils import intern_string
 
-Deal = namedtuple('Deal', [
+class Deal(namedtuple('Deal', [
     'order_id',
     'pair_id',
     'price',
@@ -14,9 +15,26 @@ Deal = namedtuple('Deal', [
     'outcome',
     'fee',
     'timestamp'
-])
+])):
+    __slots__ = ()
+    AMOUNT_FIELDS = ('price', 'amount', 'rest_amount', 'rest_freeze_amount', 'income', 'outcome', 'fee')
+
+    def as_json(self):
+        json = self._asdict()
+        for field in self.AMOUNT_FIELDS:
+            json[field] = amounts.to_json(json[field])
+        return json
+
+    @classmethod
+    def build_by_json(cls, json):
+        json = dict(json)
+        for field in cls.AMOUNT_FIELDS:
+            json[field] = amounts.from_json(json[field])
+        return cls(**json)
 
 class BalanceRevision(object):
+    __slots__ = ('_account_id', '_coin_type', '_old_active', '_old_frozen', '_new_active', '_new_frozen')
+
     account_id = property(attrgetter("_account_id"))
     coin_type = property(attrgetter("_coin_type"))
     old_active = property(attrgetter("_old_active"))
@@ -27,19 +45,44 @@ class BalanceRevision(object):
     frozen = property(attrgetter("_new_frozen"))
 
     def __init__(self, account_id, coin_type, old_active, old_frozen, new_active, new_frozen):
-        self._account_id = account_id
-        self._coin_type = coin_type
-        self._old_active = Decimal(old_active)
-        self._old_frozen = Decimal(old_frozen)
-        self._new_active = Decimal(new_active)
-        self._new_frozen = Decimal(new_frozen)
+        balance = amounts.engine.balance
+        self._account_id = intern_string(account_id)
+        self._coin_type = intern_string(coin_type)
+        self._old_active = balance(old_active)
+        self._old_frozen = balance(old_frozen)
+        self._new_active = balance(new_active)
+        self._new_frozen = balance(new_frozen)
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        return type(other) is BalanceRevision and \
+                self._account_id == other._account_id and \
+                self._coin_type == other._coin_type and \
+                self._old_active == other._old_active and \
+                self._old_frozen == other._old_frozen and \
+                self._new_active == other._new_active and \
+                self._new_frozen == other._new_frozen
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
     def __repr__(self):
         return "BalanceRevision(account_id=%s, coin_type=%s, old_active=%s, old_frozen=%s, new_active=%s, new_frozen=%s)" % (self.account_id, self.coin_type, self.old_active, self.old_frozen, self.new_active, self.new_frozen)
 
+    def as_json(self):
+        return {
+            'account_id': self.account_id,
+            'coin_type': self.coin_type,
+            'old_active': amounts.to_json(self.old_active),
+            'old_frozen': amounts.to_json(self.old_frozen),
+            'new_active': amounts.to_json(self.new_active),
+            'new_frozen': amounts.to_json(self.new_frozen),
+        }
+
+    @classmethod
+    def build_by_json(cls, json):
+        return cls(json['account_id'], json['coin_type'],
+                *[amounts.from_json(json[key]) for key in ('old_active', 'old_frozen', 'new_active', 'new_frozen')])
+
     @property
     def active_diff(self):
         return self.new_active - self.old_active
@@ -0,0 +1,114 @@
+import unittest
+import random
+from decimal import Decimal, ROUND_DOWN
+from meme.me import amounts
+from meme.me.consts import PRECISION_EXP
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated, OrderCanceled
+from meme.me.errors import BalanceError, ValidationError
+
+def random_decimal(rand, upper):
+    return (Decimal(rand.randint(1, upper * 10 ** 8)) / 10 ** 8).quantize(PRECISION_EXP)
+
+# large scales prices and amounts so amount * price * (1 + fee_rate) exceeds the 28 digits of the default Decimal context
+def run_flow(engine_name, seed, steps=300, large=False):
+    engine = amounts.use(engine_name)
+    try:
+        canonical = lambda value: str(engine.to_decimal(value).quantize(PRECISION_EXP))
+        rand = random.Random(seed)
+        repo = Repository()
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        accounts = ['account%d' % i for i in range(4)]
+        credit = '50000000000' if large else '1000'
+        for account_id in accounts:
+            repo.commit(AccountCreated.build(repo, account_id))
+            repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', credit))
+            repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', credit))
+        exchange = repo.exchanges.find('ltc-btc')
+        results = []
+        order_ids = []
+        for i in range(steps):
+            if order_ids and rand.random() < 0.2:
+                order_id = order_ids.pop(rand.randrange(len(order_ids)))
+                if repo.orders.get(order_id):
+                    repo.commit(OrderCanceled.build(repo, order_id))
+                    results.append(('canceled', order_id))
+                continue
+            order_id = 'order%d' % i
+            klass = rand.choice([BidOrder, AskOrder])
+            price = Decimal('0.9') + Decimal(rand.randint(0, 20)) / 100 + random_decimal(rand, 1) / 10000
+            amount = random_decimal(rand, 50)
+            if large:
+                price, amount = price * 10 ** 4 + random_decimal(rand, 1), amount * 10 ** 4 + random_decimal(rand, 1)
+            fee_rate = rand.choice(['0', '0.001', '0.0025', '0.00000003'])
+            try:
+                repo.commit(OrderCreated.build(repo, order_id, klass, rand.choice(accounts), 'ltc', 'btc', price, amount, fee_rate, timestamp=i + 1))
+            except BalanceError:
+                results.append(('rejected', order_id))
+                continue
+            order_ids.append(order_id)
+            for event in exchange.match_all(repo):
+                for deal in (event.bid_deal, event.ask_deal):
+                    results.append((deal.order_id, deal.pair_id) + tuple(map(canonical, deal[2:-1])))
+        for account_id in accounts:
+            for balance in repo.accounts.find(account_id).find_balances(['btc', 'ltc']):
+                results.append((account_id, balance.coin_type, canonical(balance.active), canonical(balance.frozen)))
+        return results
+    finally:
+        amounts.use('decimal')
+
+class TestIntegerAmounts(unittest.TestCase):
+    def setUp(self):
+        self.engine = amounts.IntegerAmounts()
+        self.rand = random.Random(42)
+
+    def test_parse(self):
+        self.assertEqual(self.engine.parse('1.5'), 150000000)
+        self.assertEqual(self.engine.parse(0.01), 1000000)
+        self.assertEqual(self.engine.amount('0.123456789'), 12345678)
+        self.assertEqual(self.engine.price('0.123456785'), 12345678)
+        self.assertEqual(self.engine.to_decimal(150000000), Decimal('1.5'))
+        with self.assertRaises(ValidationError):
+            self.engine.parse('0.000000001')
+
+    def test_same_rounding_as_decimal(self):
+        decimal = amounts.DecimalAmounts()
+        for i in range(4000):
+            # the second half has products far beyond the 28 digits of the default context
+            scale = 1 if i < 2000 else 10 ** 9
+            amount = random_decimal(self.rand, 1000) * scale + random_decimal(self.rand, 1)
+            price = random_decimal(self.rand, 10) * scale + random_decimal(self.rand, 1)
+            fee_rate = random_decimal(self.rand, 1) / 100
+            fee_rate = fee_rate.quantize(PRECISION_EXP, ROUND_DOWN)
+            a, p, f = [self.engine.parse(v) for v in (amount, price, fee_rate)]
+            self.assertEqual(self.engine.to_decimal(self.engine.multiply(a, p)), decimal.multiply(amount, price))
+            self.assertEqual(self.engine.to_decimal(self.engine.freeze(a, p, f)), decimal.freeze(amount, price, fee_rate))
+            if i < 2000:
+                self.assertEqual(decimal.freeze(amount, price, fee_rate), (amount * price * (1 + fee_rate)).quantize(PRECISION_EXP))
+        # exactly 1000000000000.0000000149999999, rounding the product to 28 digits first made it a tie
+        amount, price = Decimal('33333333333333333333.83333333'), Decimal('0.00000003')
+        self.assertEqual(decimal.freeze(amount, price, 0), Decimal('1000000000000.00000001'))
+        self.assertEqual(self.engine.freeze(self.engine.parse(amount), 3, 0), 100000000000000000001)
+
+    def test_freeze_rounds_half_even(self):
+        # 0.00000001 * 0.5 = 0.000000005 -> 0.00000000, 0.00000003 * 0.5 -> 0.00000002
+        self.assertEqual(self.engine.freeze(1, 50000000, 0), 0)
+        self.assertEqual(self.engine.freeze(3, 50000000, 0), 2)
+        self.assertEqual(self.engine.multiply(-3, 50000000), -1)
+
+class TestDifferential(unittest.TestCase):
+    def test_randomized_flows(self):
+        for seed in range(5):
+            decimal_results = run_flow('decimal', seed)
+            integer_results = run_flow('integer', seed)
+            self.assertTrue(len(decimal_results) > 100)
+            self.assertEqual(decimal_results, integer_results)
+
+    def test_large_values(self):
+        for seed in range(3):
+            decimal_results = run_flow('decimal', seed, 200, large=True)
+            self.assertTrue(len(decimal_results) > 50)
+            self.assertEqual(decimal_results, run_flow('integer', seed, 200, large=True))
+
+if __name__ == '__main__':
+    unittest.main()
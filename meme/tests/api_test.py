@@ -0,0 +1,229 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+from json import loads
+from meme.me.buffer import EventsBuffer
+from meme.me.journal import Journal, SYNC_ALWAYS
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountDebited, AccountCreated, ExchangeCreated, OrderCreated, OrderCanceled
+from meme.api import me
+
+class TestApi(unittest.TestCase):
+    def setUp(self):
+        self.repo = repo = Repository()
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        for account_id in ['account1', 'account2']:
+            repo.commit(AccountCreated.build(repo, account_id))
+            repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 100))
+            repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 100))
+        self.read_model = me.attach(repo)
+        self.client = me.app.test_client()
+
+    def get(self, url, etag=None):
+        headers = {'If-None-Match': '"%s"' % etag} if etag else {}
+        response = self.client.get(url, headers=headers)
+        return response, loads(response.data) if response.status_code == 200 else None
+
+    def test_exchange(self):
+        repo = self.repo
+        response, json = self.get('/exchanges/ltc-btc')
+        self.assertEqual(json['bids'], [])
+        etag = response.headers['ETag']
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '0.1', 1, '0.01'))
+        repo.commit(OrderCreated.build(repo, 'bid2', BidOrder, 'account1', 'ltc', 'btc', '0.1', 2, '0.01'))
+        repo.commit(OrderCreated.build(repo, 'ask1', AskOrder, 'account2', 'ltc', 'btc', '0.2', 1, '0.01'))
+        response, json = self.get('/exchanges/ltc-btc')
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(json['bids'], [['0.10000000', '3.00000000', 2]])
+        self.assertEqual(json['asks'], [['0.20000000', '1.00000000', 1]])
+        etag = response.headers['ETag'].strip('"')
+        self.assertEqual(self.get('/exchanges/ltc-btc', etag)[0].status_code, 304)
+        repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 1))
+        self.assertEqual(self.get('/exchanges/ltc-btc', etag)[0].status_code, 304)
+        repo.commit(OrderCanceled.build(repo, 'bid1'))
+        response, json = self.get('/exchanges/ltc-btc', etag)
+        self.assertEqual(json['bids'], [['0.10000000', '2.00000000', 1]])
+        self.assertEqual(self.get('/exchanges/eth-btc')[0].status_code, 404)
+
+    def test_pending_order(self):
+        repo = self.repo
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '0.1', 2, '0.01'))
+        response, json = self.get('/exchanges/ltc-btc/pending_orders/bid1')
+        self.assertEqual(json['id'], 'bid1')
+        self.assertEqual(json['deals'], [])
+        repo.commit(OrderCreated.build(repo, 'ask1', AskOrder, 'account2', 'ltc', 'btc', '0.1', 1, '0.01'))
+        repo.exchanges.find('ltc-btc').match_all(repo)
+        response, json = self.get('/exchanges/ltc-btc/pending_orders/bid1')
+        self.assertEqual(len(json['deals']), 1)
+        self.assertEqual(self.get('/exchanges/ltc-btc/pending_orders/ask1')[0].status_code, 404)
+        self.assertEqual(self.get('/exchanges/eth-btc/pending_orders/bid1')[0].status_code, 404)
+
+    def test_candles(self):
+        repo = self.repo
+        response, json = self.get('/exchanges/ltc-btc/candles/1m')
+        self.assertEqual(json, [])
+        self.assertEqual(self.get('/exchanges/ltc-btc')[1]['ticker'], None)
+        etag = response.headers['ETag'].strip('"')
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '0.1', 2, '0.01'))
+        self.assertEqual(self.get('/exchanges/ltc-btc/candles/1m', etag)[0].status_code, 304)
+        repo.commit(OrderCreated.build(repo, 'ask1', AskOrder, 'account2', 'ltc', 'btc', '0.1', 1, '0.01'))
+        repo.commit(OrderCreated.build(repo, 'ask2', AskOrder, 'account2', 'ltc', 'btc', '0.1', 1, '0.01'))
+        repo.exchanges.find('ltc-btc').match_all(repo)
+        response, json = self.get('/exchanges/ltc-btc/candles/1d', etag)
+        self.assertEqual(len(json), 1)
+        self.assertEqual(json[0][1:], ['0.10000000', '0.10000000', '0.10000000', '0.10000000', '2.00000000', '0.20000000', 2])
+        ticker = self.get('/exchanges/ltc-btc')[1]['ticker']
+        self.assertEqual((ticker['last'], ticker['volume'], ticker['count']), ('0.10000000', '2.00000000', 2))
+        response = self.get('/exchanges/ltc-btc')[0]
+        etag = response.headers['ETag'].strip('"')
+        now = time.time() + 2 * 86400
+        self.read_model.clock = lambda: now
+        response, json = self.get('/exchanges/ltc-btc', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json['ticker'], None)
+        self.assertEqual(self.get('/exchanges/ltc-btc/candles/2m')[0].status_code, 404)
+        self.assertEqual(self.get('/exchanges/eth-btc/candles/1m')[0].status_code, 404)
+
+    def test_credits_debits_and_assets(self):
+        repo = self.repo
+        response, json = self.get('/assets')
+        self.assertEqual(json['balances']['btc'], {'active': '200', 'frozen': '0'})
+        repo.commit(AccountDebited.build(repo, 'debit1', 'account1', 'btc', 30))
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 10, 0))
+        response, json = self.get('/assets')
+        self.assertEqual(json['balances']['btc'], {'active': '160.00000000', 'frozen': '10.00000000'})
+        response, json = self.get('/assets?account_id=account1')
+        self.assertEqual(json['balances']['btc'], {'active': '60.00000000', 'frozen': '10.00000000'})
+        self.assertEqual(self.get('/assets?account_id=account3')[0].status_code, 404)
+        response, json = self.get('/debits/debit1')
+        self.assertEqual(json['account_id'], 'account1')
+        self.assertEqual(self.get('/credits/debit1')[0].status_code, 404)
+        self.assertEqual(self.get('/credits/missing')[0].status_code, 404)
+
+    def test_commit_while_building(self):
+        repo = self.repo
+        build = self.read_model._build_assets
+        def racing(account_id):
+            json = build(account_id)
+            repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 1))
+            return json
+        self.read_model._build_assets = racing
+        self.assertEqual(self.get('/assets?account_id=account1')[1]['balances']['btc']['active'], '100')
+        del self.read_model._build_assets
+        self.assertEqual(self.get('/assets?account_id=account1')[1]['balances']['btc']['active'], '101')
+
+    def test_rollback_while_building(self):
+        repo = self.repo
+        build = self.read_model._build_assets
+        def racing(account_id):
+            try:
+                with repo.batch():
+                    repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 1))
+                    json = build(account_id)
+                    raise IOError("disk full")
+            except IOError:
+                return json
+        self.read_model._build_assets = racing
+        response, json = self.get('/assets?account_id=account1')
+        self.assertEqual(json['balances']['btc']['active'], '101')
+        self.assertFalse('ETag' in response.headers)
+        del self.read_model._build_assets
+        self.assertEqual(self.get('/assets?account_id=account1')[1]['balances']['btc']['active'], '100')
+
+    def test_build_outside_lock(self):
+        build = self.read_model._build_assets
+        acquired = []
+        def acquire():
+            lock = self.read_model.lock
+            if lock.acquire(False):
+                acquired.append(True)
+                lock.release()
+        def building(account_id):
+            thread = threading.Thread(target=acquire)
+            thread.start()
+            thread.join()
+            return build(account_id)
+        self.read_model._build_assets = building
+        self.assertEqual(self.get('/assets')[0].status_code, 200)
+        self.assertEqual(acquired, [True])
+
+    def test_records_bound(self):
+        repo = self.repo
+        me.attach(repo, records=2)
+        for i in range(3):
+            repo.commit(AccountCredited.build(repo, 'credit%d' % i, 'account1', 'btc', 1))
+        self.assertEqual(self.get('/credits/credit0')[0].status_code, 404)
+        self.assertEqual(self.get('/credits/credit2')[1]['id'], 'credit2')
+
+    def test_events(self):
+        repo = self.repo
+        repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 1))
+        response, json = self.get('/events?since_revision=%d' % (repo.revision - 1))
+        self.assertEqual([event['type'] for event in json], ['AccountCredited'])
+        response, json = self.get('/events?since_revision=0&limit=3')
+        self.assertEqual([event['revision'] for event in json], [1, 2, 3])
+        self.assertEqual(self.get('/events?since_revision=%d' % repo.revision)[1], [])
+
+    def test_long_poll(self):
+        repo = self.repo
+        timer = threading.Timer(0.1, lambda: repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 1)))
+        timer.start()
+        response, json = self.get('/events?since_revision=%d&timeout=5' % repo.revision)
+        timer.join()
+        self.assertEqual([event['id'] for event in json], ['credit1'])
+        self.assertEqual(self.get('/events?since_revision=%d&timeout=0.05' % repo.revision)[1], [])
+
+    def test_server_sent_events(self):
+        repo = self.repo
+        response = self.client.get('/events?since_revision=3', headers={'Accept': 'text/event-stream'})
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        stream = response.response
+        chunks = [next(stream) for i in range(repo.revision - 3)]
+        self.assertTrue(chunks[0].startswith('id: 4\ndata: {'))
+        timer = threading.Timer(0.1, lambda: repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 1)))
+        timer.start()
+        chunk = next(stream)
+        timer.join()
+        self.assertTrue(chunk.startswith('id: %d\n' % repo.revision))
+        self.assertTrue('"credit1"' in chunk)
+        response.close()
+        response = self.client.get('/events', headers={'Accept': 'text/event-stream', 'Last-Event-ID': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_metrics(self):
+        repo = self.repo
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '0.1', 1, '0.01'))
+        response = self.client.get('/metrics')
+        self.assertEqual(response.mimetype, 'text/plain')
+        self.assertTrue('meme_revision %d\n' % repo.revision in response.data)
+        self.assertTrue('meme_book_orders{exchange="ltc-btc",side="bid"} 1\n' in response.data)
+
+class TestEventsFallback(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.journal = Journal(os.path.join(self.dir, 'events.log'), sync=SYNC_ALWAYS)
+        self.repo = repo = Repository(journal=self.journal, events=EventsBuffer(capacity=4))
+        repo.commit(AccountCreated.build(repo, 'account1'))
+        for i in range(10):
+            repo.commit(AccountCredited.build(repo, 'credit%d' % i, 'account1', 'btc', 1))
+        me.attach(repo)
+        self.client = me.app.test_client()
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.dir)
+
+    def test_journal_fallback(self):
+        json = loads(self.client.get('/events?since_revision=0').data)
+        self.assertEqual([event['revision'] for event in json], range(1, 12))
+        json = loads(self.client.get('/events?since_revision=8').data)
+        self.assertEqual([event['revision'] for event in json], [9, 10, 11])
+        self.repo.journal = None
+        self.assertEqual(self.client.get('/events?since_revision=0').status_code, 410)
+        self.repo.journal = self.journal
+
+if __name__ == '__main__':
+    unittest.main()
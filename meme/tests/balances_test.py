@@ -0,0 +1,135 @@
+import unittest
+from decimal import Decimal
+from meme.me import amounts, balances
+from meme.me.balances import BalanceStore, INT64_MAX
+from meme.me.entities import Repository, Account, BidOrder
+from meme.me.events import AccountCreated, AccountCanceled, AccountCredited, AccountDebited, ExchangeCreated, OrderCreated
+from meme.me.errors import BalanceError
+from meme.me.transaction import Transaction
+from meme.me.values import BalanceRevision
+
+class TestBalanceStore(unittest.TestCase):
+    def test_get_and_set(self):
+        store = BalanceStore(capacity=2)
+        slots = [store.allocate('account%d' % i) for i in range(10)]
+        self.assertEqual(slots, range(10))
+        self.assertEqual(store.allocate('account3'), 3)
+        self.assertEqual(store.get(3, 'btc'), None)
+        store.set(3, 'btc', Decimal('1.5'), Decimal('0.5'))
+        store.set(9, 'ltc', Decimal('2'), Decimal('0'))
+        self.assertEqual(store.get(3, 'btc'), (Decimal('1.5'), Decimal('0.5')))
+        self.assertEqual(store.get(3, 'ltc'), None)
+        self.assertEqual(store.get(9, 'btc'), None)
+        self.assertEqual(store.items(3), [('btc', Decimal('1.5'), Decimal('0.5'))])
+        self.assertFalse(store.is_empty(3))
+        self.assertTrue(store.is_empty(4))
+        store.unset(3, 'btc')
+        self.assertEqual(store.get(3, 'btc'), None)
+        self.assertTrue(store.is_empty(3))
+        self.assertEqual(len(store), 10)
+
+    def test_reallocate_clears(self):
+        store = BalanceStore()
+        slot = store.allocate('account1')
+        store.set(slot, 'btc', 0, 0)
+        self.assertEqual(store.allocate('account1'), slot)
+        self.assertEqual(store.items(slot), [])
+
+    def test_totals_and_holders(self):
+        store = BalanceStore(capacity=4)
+        for i in range(20):
+            slot = store.allocate('account%d' % i)
+            store.set(slot, 'btc', Decimal(i), Decimal(i % 3 == 0))
+            if i % 5 == 0:
+                store.set(slot, 'ltc', Decimal(0), Decimal(1))
+        self.assertEqual(store.totals(), {'btc': (Decimal(190), Decimal(7)), 'ltc': (Decimal(0), Decimal(4))})
+        self.assertEqual(store.holders('btc'), ['account%d' % i for i in range(20)])
+        self.assertEqual(store.holders('ltc'), ['account0', 'account5', 'account10', 'account15'])
+        self.assertEqual(store.holders('eth'), [])
+
+    def test_integer_engine(self):
+        amounts.use('integer')
+        try:
+            store = BalanceStore()
+            slot = store.allocate('account1')
+            store.set(slot, 'btc', 10 ** 17, 1)
+            self.assertEqual(store.get(slot, 'btc'), (10 ** 17, 1))
+            self.assertEqual(store.totals(), {'btc': (10 ** 17, 1)})
+            with self.assertRaises(BalanceError):
+                store.set(slot, 'btc', 2 ** 63, 0)
+        finally:
+            amounts.use('decimal')
+
+    # the numpy columns when numpy is installed, otherwise the array and list fallback
+    def check_backend(self):
+        for name in ('decimal', 'integer'):
+            engine = amounts.use(name)
+            try:
+                store = BalanceStore(capacity=2)
+                for i in range(5):
+                    store.set(store.allocate('account%d' % i), 'btc', engine.parse(i), engine.zero)
+                store.set(4, 'ltc', engine.zero, engine.parse(3))
+                self.assertEqual(store.totals(), {'btc': (engine.parse(10), 0), 'ltc': (0, engine.parse(3))})
+                self.assertEqual(store.holders('btc'), ['account%d' % i for i in range(1, 5)])
+                self.assertEqual(store.holders('ltc'), ['account4'])
+                if name == 'integer':
+                    store.set(0, 'btc', INT64_MAX, 0 - INT64_MAX)
+                    self.assertEqual(store.get(0, 'btc'), (INT64_MAX, 0 - INT64_MAX))
+                    self.assertTrue(isinstance(store.get(0, 'btc')[0], (int, long)))
+            finally:
+                amounts.use('decimal')
+
+    def test_fallback_backend(self):
+        numpy, typecode = balances.numpy, balances.INT64_TYPECODE
+        balances.numpy = None
+        try:
+            # None is the list used where array has no 64-bit typecode
+            for balances.INT64_TYPECODE in (typecode, None):
+                self.check_backend()
+        finally:
+            balances.numpy, balances.INT64_TYPECODE = numpy, typecode
+
+    def test_available_backend(self):
+        self.check_backend()
+
+class TestRepositoryBalances(unittest.TestCase):
+    def setUp(self):
+        self.repo = repo = Repository()
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        for account_id in ['account1', 'account2']:
+            repo.commit(AccountCreated.build(repo, account_id))
+            repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 10))
+
+    def test_shared_store(self):
+        repo = self.repo
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '1', '1', '0'))
+        self.assertIs(repo.accounts.find('account1').store, repo.balances)
+        self.assertEqual(repo.balances.totals(), {'btc': (Decimal(19), Decimal(1))})
+        self.assertEqual(repo.balances.holders('btc'), ['account1', 'account2'])
+
+    def test_rollback(self):
+        account = self.repo.accounts.find('account1')
+        tx = Transaction()
+        tx.adjust(account, account.find_balance('btc').build_next(-1, 1))
+        tx.adjust(account, account.find_balance('eth').build_next(5))
+        self.assertEqual(sorted(account.balances), ['btc', 'eth'])
+        tx.rollback()
+        self.assertEqual(account.balances, {'btc': BalanceRevision('account1', 'btc', 10, 0, 10, 0)})
+
+    def test_cancel_and_reopen(self):
+        repo = self.repo
+        repo.commit(AccountCreated.build(repo, 'account3'))
+        repo.commit(AccountCredited.build(repo, 'btc-account3', 'account3', 'btc', 1))
+        repo.commit(AccountDebited.build(repo, 'debit1', 'account3', 'btc', 1))
+        repo.commit(AccountCanceled.build(repo, 'account3'))
+        repo.commit(AccountCreated.build(repo, 'account3'))
+        self.assertEqual(repo.accounts.find('account3').balances, {})
+
+    def test_standalone_account(self):
+        account = Account('account1')
+        self.assertEqual(account.find_balance('btc').active, 0)
+        self.assertEqual(account, Account('account1'))
+        self.assertNotEqual(account, Account.build('account1', {'btc': (1, 0)}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import random
+from decimal import Decimal
+from bintrees import RBTree
+from meme.me import book
+from meme.me.book import PriceLevels
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated, OrderCanceled
+
+class TestPriceLevels(unittest.TestCase):
+    def check_same(self, levels, rbtree):
+        self.assertEqual(len(levels), len(rbtree))
+        self.assertEqual(levels.items(), list(rbtree.items()))
+        self.assertEqual(list(levels.iter_items(reverse=True)), list(rbtree.iter_items(reverse=True)))
+        self.assertEqual(levels.is_empty(), rbtree.is_empty())
+        if not rbtree.is_empty():
+            self.assertEqual(levels.min_item(), rbtree.min_item())
+            self.assertEqual(levels.max_item(), rbtree.max_item())
+
+    def test_against_rbtree(self):
+        rand = random.Random(5)
+        for bids in (True, False):
+            levels, rbtree = PriceLevels(bids=bids), RBTree()
+            for i in range(2000):
+                price = Decimal(rand.randint(1, 60)) / 100
+                if price in rbtree and rand.random() < 0.6:
+                    del levels[price]
+                    del rbtree[price]
+                else:
+                    levels[price] = rbtree[price] = i
+                self.assertEqual(levels.get(price), rbtree.get(price))
+                self.assertEqual(price in levels, price in rbtree)
+                if i % 50 == 0:
+                    self.check_same(levels, rbtree)
+            self.check_same(levels, rbtree)
+
+    def test_empty(self):
+        levels = PriceLevels(bids=True)
+        self.assertRaises(ValueError, levels.min_key)
+        self.assertRaises(ValueError, levels.max_item)
+        self.assertRaises(KeyError, levels.__getitem__, 1)
+        self.assertRaises(KeyError, levels.__delitem__, 1)
+        self.assertEqual(levels.get(1), None)
+        self.assertEqual(PriceLevels({2: 'b', 1: 'a'}).keys(), [1, 2])
+        self.assertEqual(PriceLevels({2: 'b', 1: 'a'}, bids=True).values(), ['a', 'b'])
+
+class TestBooks(unittest.TestCase):
+    def tearDown(self):
+        book.use('ladder')
+
+    def trade(self):
+        repo = Repository()
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        for account_id in ['account1', 'account2']:
+            repo.commit(AccountCreated.build(repo, account_id))
+            repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 1000))
+            repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 1000))
+        exchange = repo.exchanges.find('ltc-btc')
+        rand = random.Random(3)
+        for i in range(300):
+            klass = rand.choice([BidOrder, AskOrder])
+            price = Decimal(rand.randint(90, 110)) / 100
+            repo.commit(OrderCreated.build(repo, 'order%d' % i, klass, rand.choice(['account1', 'account2']), 'ltc', 'btc', price, Decimal(rand.randint(1, 300)) / 100, '0.001', timestamp=i + 1))
+            exchange.match_all(repo)
+            if i % 5 == 0 and repo.orders.get('order%d' % (i // 2)):
+                repo.commit(OrderCanceled.build(repo, 'order%d' % (i // 2)))
+        return repo
+
+    def test_backends_agree(self):
+        book.use('rbtree')
+        expected = self.trade()
+        self.assertIsInstance(expected.exchanges.find('ltc-btc').bids, RBTree)
+        book.use('ladder')
+        repo = self.trade()
+        self.assertIsInstance(repo.exchanges.find('ltc-btc').bids, PriceLevels)
+        # deals carry wall clock timestamps, so compare the orders by what is left of them
+        self.assertEqual(repo.accounts, expected.accounts)
+        self.assertEqual(repo.exchanges, expected.exchanges)
+        self.assertEqual(sorted((order.id, order.rest_amount) for order in repo.orders.entities.values()),
+                sorted((order.id, order.rest_amount) for order in expected.orders.entities.values()))
+        self.assertEqual(repo.exchanges.find('ltc-btc').depth(10), expected.exchanges.find('ltc-btc').depth(10))
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, book.use, 'skiplist')
+
+if __name__ == '__main__':
+    unittest.main()
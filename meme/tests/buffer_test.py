@@ -0,0 +1,32 @@
+import unittest
+import threading
+from meme.me.buffer import EventsBuffer
+from meme.me.events import AccountCreated
+
+class TestEventsBuffer(unittest.TestCase):
+    def test_ring(self):
+        buffer = EventsBuffer(capacity=4)
+        self.assertEqual(buffer.since(0), [])
+        for revision in range(1, 7):
+            buffer.append(AccountCreated(revision, 'account%d' % revision))
+        self.assertEqual([event.revision for event in buffer.since(2)], [3, 4, 5, 6])
+        self.assertEqual([event.revision for event in buffer.since(3, limit=2)], [4, 5])
+        self.assertEqual(buffer.since(6), [])
+        self.assertEqual(buffer.since(1), None)
+        buffer.append(AccountCreated(10, 'account10'))
+        self.assertEqual(buffer.since(9), [AccountCreated(10, 'account10')])
+        self.assertEqual(buffer.since(6), None)
+
+    def test_wait(self):
+        buffer = EventsBuffer(revision=5)
+        self.assertFalse(buffer.wait(5, 0.01))
+        self.assertTrue(buffer.wait(4, 0))
+        results = []
+        waiters = [threading.Thread(target=lambda: results.append(buffer.wait(5, 5))) for i in range(50)]
+        [waiter.start() for waiter in waiters]
+        buffer.append(AccountCreated(6, 'account6'))
+        [waiter.join() for waiter in waiters]
+        self.assertEqual(results, [True] * 50)
+
+if __name__ == '__main__':
+    unittest.main()
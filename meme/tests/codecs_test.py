@@ -0,0 +1,83 @@
+import unittest
+import random
+from decimal import Decimal
+from meme.me import amounts
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import Event, AccountCredited, AccountDebited, AccountCreated, AccountCanceled, ExchangeCreated, OrderCreated, OrderCanceled, OrderDealt, OrderTaken, AuctionStarted, AuctionCleared, OrdersMassCanceled
+from meme.me.codecs import PickleCodec, JsonCodec, BinaryCodec
+from meme.me.errors import ValidationError
+
+def build_events():
+    repo = Repository()
+    events = []
+    def commit(event):
+        repo.commit(event)
+        events.append(event)
+    commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+    for account_id in ['account1', 'account2', 3]:
+        commit(AccountCreated.build(repo, account_id))
+        commit(AccountCredited.build(repo, 'btc-%s' % account_id, account_id, 'btc', 100))
+        commit(AccountCredited.build(repo, 'ltc-%s' % account_id, account_id, 'ltc', '100.5'))
+    commit(AccountDebited.build(repo, 'debit1', 3, 'btc', 100))
+    commit(AccountDebited.build(repo, 'debit2', 3, 'ltc', '100.5'))
+    commit(AccountCanceled.build(repo, 3))
+    rand = random.Random(3)
+    exchange = repo.exchanges.find('ltc-btc')
+    for i in range(60):
+        klass = rand.choice([BidOrder, AskOrder])
+        price = Decimal(rand.randint(90, 110)) / 100
+        commit(OrderCreated.build(repo, 'order%d' % i, klass, rand.choice(['account1', 'account2']), 'ltc', 'btc', price, Decimal(rand.randint(1, 300)) / 100, '0.001', timestamp=i + 1))
+        events.extend(exchange.match_all(repo))
+        if i % 7 == 0 and repo.orders.get('order%d' % i):
+            commit(OrderCanceled.build(repo, 'order%d' % i))
+    commit(OrderTaken.build(repo, 'market1', BidOrder, 'account1', 'ltc', 'btc', '2.5', '0.001', OrderTaken.MARKET, timestamp=61))
+    commit(OrderTaken.build(repo, 'ioc1', AskOrder, 'account2', 'ltc', 'btc', '1.5', '0.001', OrderTaken.IOC, '0.9', timestamp=62))
+    commit(OrderTaken.build(repo, 'fok1', AskOrder, 'account2', 'ltc', 'btc', '1000', '0.001', OrderTaken.FOK, '0.9', timestamp=63))
+    commit(AuctionStarted.build(repo, 'ltc-btc'))
+    commit(OrderCreated.build(repo, 'auction1', BidOrder, 'account1', 'ltc', 'btc', '1.2', '3', '0.001', timestamp=64))
+    commit(AuctionCleared.build(repo, 'ltc-btc'))
+    commit(AuctionStarted.build(repo, 'ltc-btc'))
+    commit(AuctionCleared.build(repo, 'ltc-btc'))
+    commit(OrdersMassCanceled.build(repo, 'account2', side='ask'))
+    return repo, events
+
+class TestCodecs(unittest.TestCase):
+    def tearDown(self):
+        amounts.use('decimal')
+
+    def check_round_trip(self):
+        repo, events = build_events()
+        self.assertEqual(set(type(event) for event in events), set([AccountCredited, AccountDebited, AccountCreated, AccountCanceled, ExchangeCreated, OrderCreated, OrderCanceled, OrderDealt, OrderTaken, AuctionStarted, AuctionCleared, OrdersMassCanceled]))
+        for codec in (PickleCodec(), JsonCodec(), BinaryCodec()):
+            decoded = [codec.decode(codec.encode(event)) for event in events]
+            self.assertEqual(decoded, events)
+            replayed = Repository()
+            replayed.replay(decoded)
+            self.assertEqual(replayed, repo)
+
+    def test_decimal_round_trip(self):
+        self.check_round_trip()
+
+    def test_integer_round_trip(self):
+        amounts.use('integer')
+        self.check_round_trip()
+
+    def test_json(self):
+        repo = Repository()
+        repo.commit(AccountCreated.build(repo, 'account1'))
+        event = AccountCredited.build(repo, 'credit1', 'account1', 'btc', '1.5')
+        json = event.as_json()
+        self.assertEqual(json['type'], 'AccountCredited')
+        self.assertEqual(json['balance_revision']['new_active'], '1.5')
+        self.assertEqual(Event.build_by_json(event.to_json()), event)
+        self.assertEqual(AccountCredited.build_by_json(json), event)
+
+    def test_binary_engine_mismatch(self):
+        repo = Repository()
+        payload = BinaryCodec().encode(AccountCreated.build(repo, 'account1'))
+        amounts.use('integer')
+        with self.assertRaises(ValidationError):
+            BinaryCodec().decode(payload)
+
+if __name__ == '__main__':
+    unittest.main()
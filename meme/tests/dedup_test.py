@@ -0,0 +1,142 @@
+import unittest
+import os
+import shutil
+import tempfile
+import cPickle as pickle
+from meme.me.dedup import DedupIndex, DEFAULT_WINDOW
+from meme.me.transaction import Transaction
+from meme.me.entities import Repository, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated, OrderCanceled
+from meme.me.errors import BalanceError, ConflictedError
+
+class TestDedupIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check_exact(self, index):
+        for revision in range(1, 5001):
+            index.add('id%d' % revision, revision)
+            index.add(revision, revision)
+        self.assertEqual(len(index.segments), 50)
+        self.assertEqual(len(index), 10000)
+        for revision in range(1, 5001):
+            self.assertTrue('id%d' % revision in index)
+            self.assertTrue(revision in index)
+        for i in range(5001, 25001):
+            self.assertFalse('id%d' % i in index)
+            self.assertFalse(i in index)
+        self.assertFalse('1' in index)
+
+    def test_memory_segments(self):
+        self.check_exact(DedupIndex(generation=100))
+
+    def test_bounded_by_default(self):
+        repo = Repository()
+        for index in (repo.credits_index, repo.debits_index, repo.orders_index):
+            self.assertEqual(index.window, DEFAULT_WINDOW)
+        index = DedupIndex(generation=100)
+        for revision in range(1, 1001):
+            index.add('id%d' % revision, revision)
+        index.add('late', DEFAULT_WINDOW + 1000)
+        self.assertFalse('id1' in index)
+        self.assertTrue('late' in index)
+        self.assertEqual(DedupIndex(window=None).window, None)
+
+    def test_disk_segments(self):
+        path = os.path.join(self.dir, 'orders')
+        index = DedupIndex(path, generation=100)
+        self.check_exact(index)
+        self.assertEqual(len(os.listdir(path)), 50)
+        index.close()
+
+    def test_window(self):
+        path = os.path.join(self.dir, 'orders')
+        index = DedupIndex(path, generation=100, window=1000)
+        for revision in range(1, 10001):
+            index.add('id%d' % revision, revision)
+            self.assertTrue('id%d' % max(revision - 1000, 1) in index)
+        self.assertTrue(len(index.segments) <= 11)
+        self.assertEqual(len(os.listdir(path)), len(index.segments))
+        self.assertFalse('id1' in index)
+        self.assertFalse('id8000' in index)
+        self.assertTrue('id9000' in index)
+
+    def test_max_age(self):
+        now = [1000.0]
+        index = DedupIndex(generation=100, window=None, max_age=250)
+        index.clock = lambda: now[0]
+        for revision in range(1, 301):
+            index.add('id%d' % revision, revision)
+            now[0] += 1
+        self.assertEqual([segment.sealed for segment in index.segments], [1099, 1199, 1299])
+        now[0] = 1400
+        index.add('id400', 400)
+        self.assertEqual([segment.generation for segment in index.segments], [1, 2, 3])
+        self.assertFalse('id50' in index)
+        self.assertTrue('id150' in index and 'id300' in index and 'id400' in index)
+
+    def test_repository_dedup_path(self):
+        path = os.path.join(self.dir, 'dedup')
+        os.makedirs(os.path.join(path, 'credits'))
+        open(os.path.join(path, 'credits', '%020d.seg' % 1), 'wb').close()
+        repo = Repository(dedup_path=path, dedup_max_age=3600)
+        self.assertEqual(sorted(os.listdir(path)), ['credits', 'debits', 'orders'])
+        self.assertEqual(os.listdir(os.path.join(path, 'credits')), [])
+        self.assertEqual((repo.orders_index.path, repo.orders_index.max_age), (os.path.join(path, 'orders'), 3600))
+
+    def test_pickle(self):
+        path = os.path.join(self.dir, 'orders')
+        index = DedupIndex(path, generation=100, window=1000)
+        for revision in range(1, 1051):
+            index.add('id%d' % revision, revision)
+        data = pickle.dumps(index, pickle.HIGHEST_PROTOCOL)
+        index.close()
+        shutil.rmtree(path)
+        restored = pickle.loads(data)
+        self.assertEqual(len(restored), 1050)
+        self.assertTrue('id1' in restored and 'id1050' in restored)
+        self.assertFalse('id1051' in restored)
+        self.assertEqual(len(os.listdir(path)), 10)
+        restored.add('id1051', 1051)
+        self.assertTrue('id1051' in restored)
+
+    def test_rollback(self):
+        repo = Repository(orders_index=DedupIndex(generation=2), credits_index=DedupIndex(generation=2))
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        repo.commit(AccountCreated.build(repo, 'account1'))
+        repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 100))
+        with self.assertRaises(ConflictedError):
+            repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 100))
+        with self.assertRaises(BalanceError):
+            repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 1000, 0.01))
+        self.assertFalse('bid1' in repo.orders_index)
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 10, 0.01))
+        repo.commit(OrderCanceled.build(repo, 'bid1'))
+        with self.assertRaises(ConflictedError):
+            repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 10, 0.01))
+        tx = Transaction()
+        tx.add_id(repo.orders_index, 'bid2', repo.revision + 1)
+        self.assertTrue('bid2' in repo.orders_index)
+        tx.rollback()
+        self.assertFalse('bid2' in repo.orders_index)
+        self.assertTrue('bid1' in repo.orders_index)
+
+    def test_resting_order_outside_window(self):
+        repo = Repository(orders_index=DedupIndex(generation=2, window=2))
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        repo.commit(AccountCreated.build(repo, 'account1'))
+        repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 100))
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 10, 0.01))
+        for i in range(10):
+            repo.commit(OrderCreated.build(repo, 'bid%d' % (i + 2), BidOrder, 'account1', 'ltc', 'btc', 1, 1, 0.01))
+        self.assertFalse('bid1' in repo.orders_index)
+        with self.assertRaises(ConflictedError):
+            repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 10, 0.01))
+        repo.commit(OrderCanceled.build(repo, 'bid1'))
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 10, 0.01))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,10 @@
 import unittest
+import random
 from decimal import Decimal
 from collections import namedtuple, deque
 from meme.me.entities import EntitiesSet, AskOrder, BidOrder, Exchange, Account
 from meme.me.values import BalanceRevision
+from meme.me.transaction import Transaction
 from meme.me.errors import NotFoundError
 
 class TestEntitiesSet(unittest.TestCase):
@@ -71,7 +73,7 @@ class TestExchange(unittest.TestCase):
         self.exchange.enqueue(ask1)
         self.exchange.enqueue(ask2)
         self.assertEqual(sorted(map(float, self.exchange.asks.keys())), [0.1, 0.2])
-        self.assertEqual(sorted(self.exchange.asks.values()), [deque([1, 2]), deque([3])])
+        self.assertEqual(sorted(map(list, self.exchange.asks.values())), [[1, 2], [3]])
 
     def test_enqueue2(self):
         bid0 = BidOrder(1, 1, 'ltc', 'btc', price=0.1, amount=1)
@@ -81,7 +83,7 @@ class TestExchange(unittest.TestCase):
         self.exchange.enqueue(bid1)
         self.exchange.enqueue(bid2)
         self.assertEqual(sorted(map(float, self.exchange.bids.keys())), [0.1, 0.2])
-        self.assertEqual(sorted(self.exchange.bids.values()), [deque([1, 2]), deque([3])])
+        self.assertEqual(sorted(map(list, self.exchange.bids.values())), [[1, 2], [3]])
 
     def test_match(self):
         self.exchange.enqueue(BidOrder(1, 1, 'ltc', 'btc', price=0.2, amount=1))
@@ -95,6 +97,88 @@ class TestExchange(unittest.TestCase):
         self.assertEqual(self.exchange.match(pop=True), (4, 6))
         self.assertEqual(self.exchange.match(pop=True), (None, None))
 
+    def test_dequeue_rollback(self):
+        asks = [AskOrder(i, 1, 'ltc', 'btc', price=0.1, amount=1) for i in range(1, 4)]
+        tx = Transaction()
+        for ask in asks:
+            tx.enqueue(self.exchange, ask)
+        tx.dequeue(self.exchange, asks[1])
+        self.assertEqual(list(self.exchange.asks.values()), [deque([1, 3])])
+        tx.rollback()
+        self.assertTrue(self.exchange.is_empty())
+        for ask in asks:
+            self.exchange.enqueue(ask)
+        tx = Transaction()
+        tx.dequeue(self.exchange, asks[1])
+        tx.dequeue(self.exchange, asks[0])
+        tx.dequeue(self.exchange, asks[2])
+        self.assertTrue(self.exchange.is_empty())
+        tx.rollback()
+        self.assertEqual(list(self.exchange.asks.values()), [deque([1, 2, 3])])
+
+    def test_cancel_inside_a_level(self):
+        for i in range(1, 6):
+            self.exchange.enqueue(BidOrder(i, 1, 'ltc', 'btc', price=0.1, amount=1))
+        self.exchange.dequeue(BidOrder(3, 1, 'ltc', 'btc', price=0.1, amount=1))
+        self.assertEqual(self.exchange.dequeue(BidOrder(3, 1, 'ltc', 'btc', price=0.1, amount=1)), None)
+        self.assertEqual(list(self.exchange.bids[Decimal('0.1')]), [1, 2, 4, 5])
+        self.exchange.enqueue(BidOrder(3, 1, 'ltc', 'btc', price=0.1, amount=1))
+        self.assertEqual(list(self.exchange.bids[Decimal('0.1')]), [1, 2, 4, 5, 3])
+        self.exchange.enqueue(AskOrder(6, 1, 'ltc', 'btc', price=0.1, amount=1))
+        self.assertEqual(self.exchange.match(pop=True), (1, 6))
+        self.assertEqual(len(self.exchange.bids[Decimal('0.1')]), 4)
+
+    def test_depth(self):
+        for i, price in enumerate([0.1, 0.2, 0.2, 0.3]):
+            self.exchange.enqueue(BidOrder(i, 1, 'ltc', 'btc', price=price, amount=i + 1))
+        ask = AskOrder(10, 1, 'ltc', 'btc', price=0.4, amount=2)
+        self.exchange.enqueue(ask)
+        self.assertEqual(self.exchange.best_bid(), (Decimal('0.3'), 4, 1))
+        self.assertEqual(self.exchange.best_ask(), (Decimal('0.4'), 2, 1))
+        bids, asks = self.exchange.depth(2)
+        self.assertEqual(bids, [(Decimal('0.3'), 4, 1), (Decimal('0.2'), 5, 2)])
+        self.assertEqual(asks, [(Decimal('0.4'), 2, 1)])
+        tx = Transaction()
+        tx.fill(self.exchange, ask, Decimal('0.5'))
+        self.assertEqual(self.exchange.best_ask(), (Decimal('0.4'), Decimal('1.5'), 1))
+        tx.dequeue(self.exchange, BidOrder(1, 1, 'ltc', 'btc', price=0.2, amount=2))
+        self.assertEqual(self.exchange.depth(5)[0], [(Decimal('0.3'), 4, 1), (Decimal('0.2'), 3, 1), (Decimal('0.1'), 1, 1)])
+        tx.rollback()
+        self.assertEqual(self.exchange.depth(5), (bids + [(Decimal('0.1'), 1, 1)], asks))
+        self.exchange.dequeue(ask)
+        self.assertEqual(self.exchange.best_ask(), None)
+        self.assertEqual(self.exchange.depth(1), ([(Decimal('0.3'), 4, 1)], []))
+
+    def test_clearing_price(self):
+        self.assertEqual(self.exchange.clearing_price(), (None, 0))
+        for i, (price, amount) in enumerate([(0.12, 1), (0.11, 2), (0.1, 3), (0.09, 4)]):
+            self.exchange.enqueue(BidOrder('bid%d' % i, 1, 'ltc', 'btc', price=price, amount=amount))
+        self.exchange.enqueue(AskOrder('ask0', 1, 'ltc', 'btc', price=0.13, amount=1))
+        self.assertEqual(self.exchange.clearing_price(), (None, 0))
+        for i, (price, amount) in enumerate([(0.09, 1), (0.1, 2), (0.11, 2)]):
+            self.exchange.enqueue(AskOrder('ask%d' % (i + 1), 1, 'ltc', 'btc', price=price, amount=amount))
+        # 0.1 and 0.11 both trade 3, 0.11 leaves less unmatched (5 - 3 against 6 - 3)
+        self.assertEqual(self.exchange.clearing_price(), (Decimal('0.11'), 3))
+        self.exchange.enqueue(AskOrder('ask4', 1, 'ltc', 'btc', price=0.1, amount=2))
+        self.assertEqual(self.exchange.clearing_price(), (Decimal('0.1'), 5))
+
+    def test_clearing_price_against_brute_force(self):
+        rand = random.Random(9)
+        for round in range(30):
+            exchange = Exchange('ltc', 'btc')
+            for i in range(rand.randint(1, 30)):
+                klass = rand.choice([BidOrder, AskOrder])
+                exchange.enqueue(klass(i, 1, 'ltc', 'btc', price=Decimal(rand.randint(90, 110)) / 100, amount=rand.randint(1, 5)))
+            prices = sorted(set(exchange.bids.keys()) | set(exchange.asks.keys()))
+            volumes = [min(sum(q.amount for p, q in exchange.bids.items() if p >= price), sum(q.amount for p, q in exchange.asks.items() if p <= price))
+                    for price in prices]
+            price, volume = exchange.clearing_price()
+            self.assertEqual(volume, max(volumes))
+            if volume:
+                self.assertEqual(volumes[prices.index(price)], volume)
+            else:
+                self.assertEqual(price, None)
+
 class TestAccount(unittest.TestCase):
     def test_is_empty(self):
         account = Account.build('account1', {'btc': (10, 0), 'ltc': (0, 0)})
@@ -140,5 +224,64 @@ class TestOrder(unittest.TestCase):
         self.assertEqual(float(ask.rest_freeze_amount), 0.9)
         self.assertEqual(float(bid.rest_freeze_amount), 0.1001)
 
+    def test_filled_totals(self):
+        bid = BidOrder(1, 1, 'ltc', 'btc', price=0.3, amount=1, fee_rate=0.001, timestamp = 2)
+        for i in range(10):
+            ask = AskOrder(i + 2, 1, 'ltc', 'btc', price=0.3, amount=0.1, fee_rate=0.001, timestamp = 1)
+            bid_deal, ask_deal = Exchange.compute_deals(bid, ask)
+            bid.append_deal(bid_deal)
+        self.assertEqual(bid.filled_amount, Decimal('1'))
+        self.assertEqual(bid.filled_outcome, Decimal('0.3003'))
+        self.assertTrue(bid.is_completed())
+        copied = BidOrder(1, 1, 'ltc', 'btc', price=0.3, amount=1, fee_rate=0.001, timestamp = 2, deals=list(bid.deals))
+        self.assertEqual(copied.filled_amount, bid.filled_amount)
+        self.assertEqual(copied.rest_freeze_amount, bid.rest_freeze_amount)
+
+    def test_compact_orders(self):
+        bid1 = BidOrder('bid1', 'account1', 'ltc', 'btc', price='0.3', amount=1, fee_rate='0.001', timestamp=2)
+        bid2 = BidOrder('bid2', 'account1', 'ltc', 'btc', price='0.30', amount=2, fee_rate='0.001', timestamp=2)
+        self.assertFalse(hasattr(bid1, '__dict__'))
+        self.assertIs(bid1.price, bid2.price)
+        self.assertIs(bid1.fee_rate, bid2.fee_rate)
+        self.assertIs(bid1.deals, bid2.deals)
+        self.assertEqual(bid1, bid1.clone())
+        self.assertNotEqual(bid1, bid2)
+        self.assertNotEqual(bid1, Account('account1'))
+        ask = AskOrder('bid1', 'account1', 'ltc', 'btc', price='0.3', amount=1, fee_rate='0.0010', timestamp=2)
+        self.assertEqual(str(ask.fee_rate), '0.0010')
+        bid_deal, ask_deal = Exchange.compute_deals(bid1, ask)
+        cloned = bid1.clone()
+        bid1.append_deal(bid_deal)
+        self.assertEqual(cloned.deals, ())
+        self.assertNotEqual(bid1, cloned)
+        self.assertEqual(bid1.clone(), bid1)
+        self.assertIsNot(bid1.clone().deals, bid1.deals)
+
+    def test_deals_rollback(self):
+        bid = BidOrder(1, 1, 'ltc', 'btc', price=0.3, amount=1, fee_rate=0.001, timestamp = 2)
+        deals = []
+        for i in range(3):
+            ask = AskOrder(i + 2, 1, 'ltc', 'btc', price=0.3, amount=0.1, fee_rate=0.001, timestamp = 1)
+            deals.append(Exchange.compute_deals(bid, ask)[0])
+            bid.append_deal(deals[-1])
+        tx = Transaction()
+        ask = AskOrder(9, 1, 'ltc', 'btc', price=0.3, amount=0.1, fee_rate=0.001, timestamp = 1)
+        tx.append_deal(bid, Exchange.compute_deals(bid, ask)[0])
+        self.assertEqual(len(bid.deals), 4)
+        tx.rollback()
+        self.assertEqual(bid.deals, deals)
+        self.assertEqual(bid.filled_amount, Decimal('0.3'))
+        empty = BidOrder(2, 1, 'ltc', 'btc', price=0.3, amount=1, fee_rate=0.001, timestamp = 2)
+        tx.append_deal(empty, Exchange.compute_deals(empty, ask)[0])
+        tx.rollback()
+        self.assertEqual(empty.deals, ())
+
+    def test_compact_balances(self):
+        revision = BalanceRevision.build('account1', 'btc', 1)
+        self.assertFalse(hasattr(revision, '__dict__'))
+        self.assertEqual(revision, BalanceRevision('account1', 'btc', 0, 0, 1, 0))
+        self.assertNotEqual(revision, BalanceRevision('account1', 'btc', 0, 0, 2, 0))
+        self.assertEqual(Account.build('account1', {'btc': (1, 0)}), Account('account1', {'btc': revision}))
+
 if __name__ == '__main__':
     unittest.main()
@@ -4,8 +4,10 @@ from copy import deepcopy
 from decimal import Decimal
 from collections import namedtuple, deque
 from meme.me.entities import Repository, EntitiesSet, AskOrder, BidOrder, Exchange, Account
-from meme.me.events import AccountCredited, AccountDebited, AccountCreated, AccountCanceled, ExchangeCreated, OrderCreated, OrderCanceled, OrderDealt
-from meme.me.errors import NotFoundError, CancelError, BalanceError
+from meme.me.values import BalanceRevision
+from meme.me.events import AccountCredited, AccountDebited, AccountCreated, AccountCanceled, ExchangeCreated, OrderCreated, OrderCanceled, OrderDealt, OrderTaken, AuctionStarted, AuctionCleared, OrdersMassCanceled
+from meme.me.errors import NotFoundError, CancelError, BalanceError, ConflictedError, ValidationError
+from meme.me.transaction import Transaction
 
 class TestAccountEvents(unittest.TestCase):
     def setUp(self):
@@ -72,7 +74,7 @@ class TestOrderEvents(unittest.TestCase):
             self.repo.commit(OrderCreated.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 50, 0.01))
         self.assertEqual(repo_bak.orders, self.repo.orders)
         self.assertEqual(repo_bak.accounts, self.repo.accounts)
-        # self.assertEqual(repo_bak.exchanges, self.repo.exchanges)
+        self.assertEqual(repo_bak.exchanges, self.repo.exchanges)
 
     def test_compute_balance_revision_for_create(self):
         account = Account.build('account1', {'btc': (10, 0), 'ltc': (10, 0) })
@@ -192,6 +194,44 @@ class TestOrderDealt(unittest.TestCase):
         self.assertEqual((float(ltcbalance1.active + ltcbalance2.active - 200)), 0)
         self.assertEqual((float(btcbalance1.active + btcbalance2.active - 200)), -0.002)
 
+    def test_match_all(self):
+        for i, price in enumerate([0.1, 0.11, 0.12, 0.13, 0.14]):
+            self.repo.commit(OrderCreated.build(self.repo, 'ask%d' % i, AskOrder, 'account2', 'ltc', 'btc', price=price, amount=0.5, fee_rate=0.01, timestamp=i + 1))
+        self.repo.commit(OrderCreated.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', price=0.13, amount=1.8, fee_rate=0.01, timestamp=10))
+        self.repo.commit(OrderCreated.build(self.repo, 'bid2', BidOrder, 'account1', 'ltc', 'btc', price=0.13, amount=0.5, fee_rate=0.01, timestamp=11))
+        events = self.exchange.match_all(self.repo)
+        self.assertEqual([e.ask_deal.order_id for e in events], ['ask0', 'ask1', 'ask2', 'ask3', 'ask3'])
+        self.assertEqual([e.bid_deal.order_id for e in events], ['bid1', 'bid1', 'bid1', 'bid1', 'bid2'])
+        self.assertEqual([float(e.bid_deal.price) for e in events], [0.1, 0.11, 0.12, 0.13, 0.13])
+        self.assertFalse(self.repo.orders.get('bid1'))
+        self.assertEqual(float(self.repo.orders.find('bid2').rest_amount), 0.3)
+        self.assertEqual(self.exchange.depth(5), ([(Decimal('0.13'), Decimal('0.3'), 1)], [(Decimal('0.14'), Decimal('0.5'), 1)]))
+        self.assertEqual(self.exchange.match(), (None, None))
+        self.assertEqual(self.exchange.match_all(self.repo), [])
+        account1 = self.repo.accounts.find('account1')
+        self.assertEqual(float(account1.find_balance('ltc').active), 102)
+
+    def test_deal_rollback(self):
+        self.repo.commit(OrderCreated.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', price=0.1, amount=1, fee_rate=0.01, timestamp=1))
+        self.repo.commit(OrderCreated.build(self.repo, 'ask1', AskOrder, 'account2', 'ltc', 'btc', price=0.1, amount=0.4, fee_rate=0.01, timestamp=2))
+        self.repo.commit(OrderCreated.build(self.repo, 'ask2', AskOrder, 'account2', 'ltc', 'btc', price=0.1, amount=0.4, fee_rate=0.01, timestamp=3))
+        repo_bak = deepcopy(self.repo)
+        bid_deal, ask_deal = self.exchange.match_and_compute_deals(self.repo)
+        event = OrderDealt.build(self.repo, bid_deal, ask_deal)
+        income_revision, outcome_revision = event.ask_balance_revisions
+        event.ask_balance_revisions = (income_revision, BalanceRevision('account2', 'ltc', 1, 0, 1, 0))
+        with self.assertRaises(BalanceError):
+            self.repo.commit(event)
+        self.assertEqual(repo_bak.orders, self.repo.orders)
+        self.assertEqual(repo_bak.accounts, self.repo.accounts)
+        self.assertEqual(self.repo.orders.find('bid1').filled_amount, 0)
+        self.assertEqual(repo_bak.exchanges, self.repo.exchanges)
+        self.assertEqual(self.exchange.match(), ('bid1', 'ask1'))
+        self.repo.commit(OrderDealt.build(self.repo, bid_deal, ask_deal))
+        self.assertFalse(self.repo.orders.get('ask1'))
+        self.assertEqual(self.exchange.depth(1), ([(Decimal('0.1'), Decimal('0.6'), 1)], [(Decimal('0.1'), Decimal('0.4'), 1)]))
+        self.assertEqual(self.exchange.match(), ('bid1', 'ask2'))
+
     @unittest.skip
     def test_deal_from_different_account_with_benchmark2(self):
         timestamp_start = float(time.time())
@@ -247,6 +287,254 @@ class TestOrderDealt(unittest.TestCase):
         self.assertEqual(float(ltcbalance1.active), 99.8)
         self.assertEqual(float(ltcbalance1.frozen), 0.2)
 
+class TestOrderTaken(unittest.TestCase):
+    def setUp(self):
+        self.repo = self.build_repo()
+        self.exchange = self.repo.exchanges.find('ltc-btc')
+
+    def build_repo(self):
+        repo = Repository()
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        for account_id in ['account1', 'account2']:
+            repo.commit(AccountCreated.build(repo, account_id))
+            repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 100))
+            repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 100))
+        for i, price in enumerate([0.1, 0.11, 0.12]):
+            repo.commit(OrderCreated.build(repo, 'ask%d' % i, AskOrder, 'account2', 'ltc', 'btc', price=price, amount=0.5, fee_rate=0.01, timestamp=i + 1))
+        return repo
+
+    def test_market_sweep(self):
+        event = OrderTaken.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '1.2', 0.01, OrderTaken.MARKET, timestamp=10)
+        self.assertEqual([(taker_deal.amount, maker_deal.order_id) for taker_deal, maker_deal in event.deals],
+                [(Decimal('0.5'), 'ask0'), (Decimal('0.5'), 'ask1'), (Decimal('0.2'), 'ask2')])
+        self.assertEqual(event.order.price, Decimal('0.12'))
+        self.assertEqual(len(event.balance_revisions), 4)
+        self.repo.commit(event)
+        self.assertEqual(self.repo.revision, event.revision)
+        self.assertFalse(self.repo.orders.get('bid1'))
+        self.assertIn('bid1', self.repo.orders_index)
+        self.assertEqual(self.exchange.depth(5), ([], [(Decimal('0.12'), Decimal('0.3'), 1)]))
+        # the same trades matched one by one from a resting limit order
+        expected = self.build_repo()
+        expected.commit(OrderCreated.build(expected, 'bid1', BidOrder, 'account1', 'ltc', 'btc', price=0.12, amount='1.2', fee_rate=0.01, timestamp=10))
+        self.assertEqual(len(expected.exchanges.find('ltc-btc').match_all(expected)), 3)
+        self.assertEqual(self.repo.accounts, expected.accounts)
+        self.assertEqual(self.repo.orders, expected.orders)
+
+    def test_ioc_releases_rest(self):
+        event = OrderTaken.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 2, 0.01, OrderTaken.IOC, price=0.11, timestamp=10)
+        self.assertEqual([maker_deal.order_id for taker_deal, maker_deal in event.deals], ['ask0', 'ask1'])
+        self.repo.commit(event)
+        btc, ltc = self.repo.accounts.find('account1').find_balances(['btc', 'ltc'])
+        self.assertEqual(btc.frozen, 0)
+        self.assertEqual(btc.active, Decimal('99.89395'))
+        self.assertEqual(ltc.active, Decimal('101'))
+        self.assertEqual(self.exchange.depth(5), ([], [(Decimal('0.12'), Decimal('0.5'), 1)]))
+
+    def test_ask_taker(self):
+        self.repo.commit(OrderCreated.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', price=0.09, amount=1, fee_rate=0.01, timestamp=4))
+        self.repo.commit(OrderCreated.build(self.repo, 'bid2', BidOrder, 'account1', 'ltc', 'btc', price=0.08, amount=1, fee_rate=0.01, timestamp=5))
+        event = OrderTaken.build(self.repo, 'ask9', AskOrder, 'account2', 'ltc', 'btc', '1.5', 0.01, OrderTaken.MARKET, timestamp=10)
+        self.assertEqual([(maker_deal.order_id, maker_deal.price) for taker_deal, maker_deal in event.deals], [('bid1', Decimal('0.09')), ('bid2', Decimal('0.08'))])
+        self.repo.commit(event)
+        self.assertEqual(self.exchange.depth(5)[0], [(Decimal('0.08'), Decimal('0.5'), 1)])
+        btc, ltc = self.repo.accounts.find('account2').find_balances(['btc', 'ltc'])
+        self.assertEqual(ltc.active, Decimal('97'))
+        self.assertEqual(ltc.frozen, Decimal('1.5'))
+
+    def test_fok_kill(self):
+        accounts = deepcopy(self.repo.accounts)
+        event = OrderTaken.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '1.2', 0.01, OrderTaken.FOK, price=0.11, timestamp=10)
+        self.assertEqual((event.deals, event.balance_revisions), ((), ()))
+        self.repo.commit(event)
+        self.assertEqual(self.repo.accounts, accounts)
+        self.assertEqual(len(self.exchange.depth(5)[1]), 3)
+        with self.assertRaises(ConflictedError):
+            self.repo.commit(OrderTaken.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 0.01, OrderTaken.FOK, price=0.11))
+        event = OrderTaken.build(self.repo, 'bid2', BidOrder, 'account1', 'ltc', 'btc', 1, 0.01, OrderTaken.FOK, price=0.11)
+        self.assertEqual(len(event.deals), 2)
+
+    def test_invalid_amount_and_price(self):
+        revision = self.repo.revision
+        for amount, kind, price in [('-5', OrderTaken.MARKET, None), ('0', OrderTaken.IOC, '0.1'), ('0.000000001', OrderTaken.MARKET, None),
+                ('1', OrderTaken.IOC, '0'), ('1', OrderTaken.FOK, '-0.1')]:
+            with self.assertRaises(ValidationError):
+                OrderTaken.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', amount, 0.01, kind, price)
+        self.assertEqual(self.repo.revision, revision)
+        self.assertNotIn('bid1', self.repo.orders_index)
+
+    def test_self_trade(self):
+        event = OrderTaken.build(self.repo, 'ask9', AskOrder, 'account2', 'ltc', 'btc', 1, 0.01, OrderTaken.MARKET)
+        self.assertEqual(event.deals, ())
+        self.repo.commit(OrderCreated.build(self.repo, 'bid1', BidOrder, 'account2', 'ltc', 'btc', price=0.09, amount=1, fee_rate=0.01, timestamp=4))
+        event = OrderTaken.build(self.repo, 'ask9', AskOrder, 'account2', 'ltc', 'btc', 1, 0.01, OrderTaken.IOC, price=0.09, timestamp=10)
+        self.assertEqual(len(event.balance_revisions), 2)
+        self.repo.commit(event)
+        btc, ltc = self.repo.accounts.find('account2').find_balances(['btc', 'ltc'])
+        self.assertEqual(btc.frozen, 0)
+        self.assertEqual(ltc.frozen, Decimal('1.5'))
+
+    def test_invalid(self):
+        with self.assertRaises(ValidationError):
+            OrderTaken.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 0.01, 'gtc', price=0.1)
+        with self.assertRaises(ValidationError):
+            OrderTaken.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 0.01, OrderTaken.IOC)
+        with self.assertRaises(BalanceError):
+            OrderTaken.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1000, 0.01, OrderTaken.IOC, price=0.12)
+
+    def test_rollback(self):
+        repo_bak = deepcopy(self.repo)
+        event = OrderTaken.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '1.2', 0.01, OrderTaken.MARKET)
+        revision = event.balance_revisions[-1]
+        event.balance_revisions = event.balance_revisions[:-1] + (BalanceRevision(revision.account_id, revision.coin_type, 1, 0, 1, 0),)
+        with self.assertRaises(BalanceError):
+            self.repo.commit(event)
+        self.assertEqual(repo_bak.orders, self.repo.orders)
+        self.assertEqual(repo_bak.accounts, self.repo.accounts)
+        self.assertEqual(repo_bak.exchanges, self.repo.exchanges)
+        self.assertNotIn('bid1', self.repo.orders_index)
+        self.repo.commit(OrderTaken.build(self.repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '1.2', 0.01, OrderTaken.MARKET))
+        self.assertEqual(len(self.repo.orders.entities), 1)
+
+class TestAuction(unittest.TestCase):
+    def setUp(self):
+        self.repo = repo = Repository()
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        for account_id in ['account1', 'account2', 'account3']:
+            repo.commit(AccountCreated.build(repo, account_id))
+            repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 100))
+            repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 100))
+        self.exchange = repo.exchanges.find('ltc-btc')
+        repo.commit(AuctionStarted.build(repo, 'ltc-btc'))
+
+    def order(self, id, klass, account_id, price, amount):
+        self.repo.commit(OrderCreated.build(self.repo, id, klass, account_id, 'ltc', 'btc', price, amount, '0.01', timestamp=len(self.repo.orders.entities) + 1))
+        self.assertEqual(self.exchange.match_all(self.repo), [])
+
+    def test_clear(self):
+        self.order('bid1', BidOrder, 'account1', '0.12', '1')
+        self.order('bid2', BidOrder, 'account1', '0.11', '2')
+        self.order('bid3', BidOrder, 'account3', '0.1', '3')
+        self.order('ask1', AskOrder, 'account2', '0.09', '1')
+        self.order('ask2', AskOrder, 'account2', '0.1', '2')
+        self.order('ask3', AskOrder, 'account3', '0.11', '2')
+        self.order('ask4', AskOrder, 'account2', '0.1', '2')
+        with self.assertRaises(ValidationError):
+            OrderTaken.build(self.repo, 'bid9', BidOrder, 'account1', 'ltc', 'btc', '1', '0.01', OrderTaken.MARKET)
+        with self.assertRaises(ValidationError):
+            AuctionStarted.build(self.repo, 'ltc-btc')
+        event = AuctionCleared.build(self.repo, 'ltc-btc')
+        self.assertEqual(event.price, Decimal('0.1'))
+        self.assertEqual([(bid_deal.order_id, ask_deal.order_id, bid_deal.amount) for bid_deal, ask_deal in event.deals],
+                [('bid1', 'ask1', 1), ('bid2', 'ask2', 2), ('bid3', 'ask4', 2)])
+        self.assertTrue(all(deal.price == event.price for deals in event.deals for deal in deals))
+        self.repo.commit(event)
+        self.assertFalse(self.exchange.auction)
+        self.assertFalse(self.repo.orders.get('bid1'))
+        self.assertFalse(self.repo.orders.get('bid2'))
+        self.assertEqual(self.exchange.depth(5), ([(Decimal('0.1'), 1, 1)], [(Decimal('0.11'), 2, 1)]))
+        # bids paid the clearing price, the rest of their freeze is released
+        btc, ltc = self.repo.accounts.find('account1').find_balances(['btc', 'ltc'])
+        self.assertEqual(btc.frozen, 0)
+        self.assertEqual(btc.active, 100 - Decimal('0.3') * Decimal('1.01'))
+        self.assertEqual(ltc.active, 103)
+        # continuous matching resumes
+        self.repo.commit(OrderCreated.build(self.repo, 'bid4', BidOrder, 'account1', 'ltc', 'btc', '0.11', '1', '0.01'))
+        self.assertEqual(len(self.exchange.match_all(self.repo)), 1)
+
+    def test_clear_without_cross(self):
+        self.order('bid1', BidOrder, 'account1', '0.1', '1')
+        self.order('ask1', AskOrder, 'account2', '0.11', '1')
+        event = AuctionCleared.build(self.repo, 'ltc-btc')
+        self.assertEqual((event.price, event.deals, event.balance_revisions), (None, (), ()))
+        self.repo.commit(event)
+        self.assertFalse(self.exchange.auction)
+        with self.assertRaises(ValidationError):
+            AuctionCleared.build(self.repo, 'ltc-btc')
+
+    def test_rollback(self):
+        self.order('bid1', BidOrder, 'account1', '0.12', '1')
+        self.order('ask1', AskOrder, 'account2', '0.1', '2')
+        repo_bak = deepcopy(self.repo)
+        event = AuctionCleared.build(self.repo, 'ltc-btc')
+        revision = event.balance_revisions[-1]
+        event.balance_revisions = event.balance_revisions[:-1] + (BalanceRevision(revision.account_id, revision.coin_type, 1, 0, 1, 0),)
+        with self.assertRaises(BalanceError):
+            self.repo.commit(event)
+        self.assertTrue(self.exchange.auction)
+        self.assertEqual(repo_bak.orders, self.repo.orders)
+        self.assertEqual(repo_bak.accounts, self.repo.accounts)
+        self.assertEqual(repo_bak.exchanges, self.repo.exchanges)
+
+class TestOrdersMassCanceled(unittest.TestCase):
+    def setUp(self):
+        self.repo = repo = Repository()
+        for coin_type in ['ltc', 'eth']:
+            repo.commit(ExchangeCreated.build(repo, coin_type, 'btc'))
+        for account_id in ['account1', 'account2']:
+            repo.commit(AccountCreated.build(repo, account_id))
+            for coin_type in ['btc', 'ltc', 'eth']:
+                repo.commit(AccountCredited.build(repo, '%s-%s' % (coin_type, account_id), account_id, coin_type, 100))
+        for i, (klass, coin_type, price) in enumerate([(BidOrder, 'ltc', '0.1'), (BidOrder, 'ltc', '0.2'), (AskOrder, 'ltc', '0.5'), (BidOrder, 'eth', '0.1'), (AskOrder, 'eth', '0.3')]):
+            repo.commit(OrderCreated.build(repo, 'order%d' % i, klass, 'account1', coin_type, 'btc', price, '1', '0.01', timestamp=i + 1))
+        repo.commit(OrderCreated.build(repo, 'other', BidOrder, 'account2', 'ltc', 'btc', '0.1', '1', '0.01', timestamp=10))
+        repo.commit(OrderCreated.build(repo, 'ask-other', AskOrder, 'account2', 'ltc', 'btc', '0.2', '0.5', '0.01', timestamp=11))
+        repo.exchanges.find('ltc-btc').match_all(repo)
+
+    def test_index(self):
+        orders = self.repo.orders
+        self.assertEqual(orders.ids_by_account('account1'), ['order0', 'order1', 'order2', 'order3', 'order4'])
+        self.assertEqual(orders.ids_by_account('account2'), ['other'])
+        self.assertEqual(orders.ids_by_account('account3'), [])
+        self.repo.commit(OrderCanceled.build(self.repo, 'order0'))
+        self.repo.commit(OrderCreated.build(self.repo, 'order9', AskOrder, 'account2', 'ltc', 'btc', '0.2', '0.5', '0.01'))
+        self.repo.exchanges.find('ltc-btc').match_all(self.repo)
+        self.assertEqual(orders.ids_by_account('account1'), ['order2', 'order3', 'order4'])
+        tx = Transaction()
+        tx.remove(orders, 'order2')
+        tx.add(orders, BidOrder('order8', 'account1', 'ltc', 'btc', '0.1', '1'))
+        self.assertEqual(orders.ids_by_account('account1'), ['order3', 'order4', 'order8'])
+        tx.rollback()
+        self.assertEqual(orders.ids_by_account('account1'), ['order2', 'order3', 'order4'])
+
+    def test_cancel_all(self):
+        repo = self.repo
+        btc, ltc, eth = repo.accounts.find('account1').find_balances(['btc', 'ltc', 'eth'])
+        event = OrdersMassCanceled.build(repo, 'account1')
+        self.assertEqual(event.order_ids, ('order0', 'order1', 'order2', 'order3', 'order4'))
+        self.assertEqual([revision.coin_type for revision in event.balance_revisions], ['btc', 'ltc', 'eth'])
+        repo.commit(event)
+        self.assertEqual(repo.orders.ids_by_account('account1'), [])
+        self.assertEqual(sorted(repo.orders.entities), ['other'])
+        account = repo.accounts.find('account1')
+        for balance in account.find_balances(['btc', 'ltc', 'eth']):
+            self.assertEqual(balance.frozen, 0)
+        self.assertEqual(account.find_balance('btc').active, btc.active + btc.frozen)
+        self.assertEqual(account.find_balance('eth').active, 100)
+        exchange = repo.exchanges.find('ltc-btc')
+        self.assertEqual(exchange.depth(5), ([(Decimal('0.1'), 1, 1)], []))
+        self.assertTrue(repo.exchanges.find('eth-btc').is_empty())
+
+    def test_filters(self):
+        repo = self.repo
+        event = OrdersMassCanceled.build(repo, 'account1', exchange_id='ltc-btc', side='bid')
+        self.assertEqual(event.order_ids, ('order0', 'order1'))
+        self.assertEqual(len(event.balance_revisions), 1)
+        repo.commit(event)
+        self.assertEqual(repo.orders.ids_by_account('account1'), ['order2', 'order3', 'order4'])
+        self.assertEqual(OrdersMassCanceled.build(repo, 'account1', side='ask').order_ids, ('order2', 'order4'))
+        self.assertEqual(OrdersMassCanceled.build(repo, 'account2', exchange_id='eth-btc').order_ids, ())
+        with self.assertRaises(ValidationError):
+            OrdersMassCanceled.build(repo, 'account1', side='buy')
+
+    def test_foreign_order(self):
+        event = OrdersMassCanceled.build(self.repo, 'account1')
+        event.order_ids += ('other',)
+        accounts = deepcopy(self.repo.accounts)
+        with self.assertRaises(CancelError):
+            self.repo.commit(event)
+        self.assertEqual(self.repo.accounts, accounts)
+        self.assertEqual(self.repo.orders.ids_by_account('account1'), ['order0', 'order1', 'order2', 'order3', 'order4'])
 
 if __name__ == '__main__':
     unittest.main()
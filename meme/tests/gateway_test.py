@@ -0,0 +1,174 @@
+import unittest
+import os
+import errno
+import socket
+import asyncore
+import shutil
+import tempfile
+from json import dumps, loads
+from meme.me.entities import Repository, Exchange
+from meme.me.journal import Journal, SYNC_ALWAYS
+from meme.me.events import ExchangeCreated
+from meme.api.gateway import Gateway
+
+class Client(object):
+    def __init__(self, address):
+        family = socket.AF_UNIX if isinstance(address, basestring) else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(10)
+        self.socket.connect(address)
+        self.file = self.socket.makefile('r')
+
+    def send(self, commands):
+        self.socket.sendall(''.join(dumps(command) + '\n' for command in commands))
+
+    def receive(self, count):
+        return [loads(self.file.readline()) for i in range(count)]
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+def commands():
+    yield {'seq': 1, 'command': 'account', 'account_id': 'account1'}
+    yield {'seq': 2, 'command': 'account', 'account_id': 'account2'}
+    for i, account_id in enumerate(['account1', 'account2']):
+        yield {'seq': 3 + i * 2, 'command': 'credit', 'id': 'btc-' + account_id, 'account_id': account_id, 'coin_type': 'btc', 'amount': '100'}
+        yield {'seq': 4 + i * 2, 'command': 'credit', 'id': 'ltc-' + account_id, 'account_id': account_id, 'coin_type': 'ltc', 'amount': '100'}
+    yield {'seq': 7, 'command': 'order', 'order_id': 'bid1', 'side': 'bid', 'account_id': 'account1', 'coin_type': 'ltc', 'price_type': 'btc', 'price': '0.1', 'amount': '2', 'fee_rate': '0.001', 'timestamp': 1}
+    yield {'seq': 8, 'command': 'order', 'order_id': 'ask1', 'side': 'ask', 'account_id': 'account2', 'coin_type': 'ltc', 'price_type': 'btc', 'price': '0.1', 'amount': '1', 'fee_rate': '0.001', 'timestamp': 2}
+    yield {'seq': 9, 'command': 'order', 'order_id': 'bid2', 'side': 'bid', 'account_id': 'account1', 'coin_type': 'ltc', 'price_type': 'btc', 'price': '0.1', 'amount': '10000', 'fee_rate': '0.001'}
+    yield {'seq': 10, 'command': 'cancel', 'order_id': 'bid1'}
+    yield {'seq': 11, 'command': 'debit', 'id': 'debit1', 'account_id': 'account2', 'coin_type': 'ltc', 'amount': '1'}
+    yield {'seq': 12, 'command': 'unknown'}
+    yield {'seq': 13, 'command': 'order', 'order_id': 'ioc1', 'side': 'bid', 'account_id': 'account1', 'coin_type': 'ltc', 'price_type': 'btc', 'price': '0.1', 'amount': '1', 'fee_rate': '0.001', 'kind': 'ioc'}
+
+class TestGateway(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.repo = Repository()
+        self.repo.commit(ExchangeCreated.build(self.repo, 'ltc', 'btc'))
+
+    def tearDown(self):
+        self.gateway.stop()
+        shutil.rmtree(self.dir)
+
+    def check(self, address, **options):
+        self.gateway = Gateway(self.repo, address, **options)
+        self.gateway.start()
+        client = Client(self.gateway.address)
+        client.send(commands())
+        replies = client.receive(13)
+        client.close()
+        self.assertEqual([reply['seq'] for reply in replies], range(1, 14))
+        self.assertEqual([reply.get('revision') for reply in replies[:8]], range(2, 10))
+        self.assertEqual(replies[8]['error'], 'BalanceError')
+        # bid1 filled by ask1 at revision 10, then canceled
+        self.assertEqual(replies[9]['revision'], 11)
+        self.assertEqual(replies[10]['revision'], 12)
+        self.assertEqual(replies[11]['error'], 'ValueError')
+        # nothing left to take, the whole order is released in one event
+        self.assertEqual(replies[12]['revision'], 13)
+        account1 = self.repo.accounts.find('account1')
+        self.assertEqual(account1.find_balance('ltc').active, 101)
+        self.assertEqual(account1.find_balance('btc').frozen, 0)
+
+    def test_tcp(self):
+        self.check(('127.0.0.1', 0))
+
+    def test_unix_socket(self):
+        self.check(os.path.join(self.dir, 'gateway.sock'))
+
+    def test_malformed(self):
+        self.gateway = Gateway(self.repo, ('127.0.0.1', 0))
+        self.gateway.start()
+        client = Client(self.gateway.address)
+        client.send([[1], {'seq': 1, 'command': 'account', 'account_id': 'account1'},
+            {'seq': 2, 'command': 'credit', 'id': 'credit1', 'account_id': 'account1', 'coin_type': 'btc', 'amount': None},
+            {'seq': 3, 'command': 'credit', 'id': 'credit1', 'account_id': 'account1', 'coin_type': 'btc', 'amount': '1'}])
+        replies = client.receive(4)
+        client.close()
+        self.assertEqual(replies[0], {'seq': None, 'error': 'ValueError', 'message': 'Command must be a JSON object'})
+        self.assertEqual(replies[1], {'seq': 1, 'revision': 2})
+        self.assertEqual(replies[2]['error'], 'TypeError')
+        self.assertEqual(replies[3], {'seq': 3, 'revision': 3})
+
+    def test_match_failure(self):
+        match_all = Exchange.match_all
+        def fail(exchange, repo):
+            raise RuntimeError("matching failed")
+        Exchange.match_all = fail
+        try:
+            self.gateway = Gateway(self.repo, ('127.0.0.1', 0))
+            self.gateway.start()
+            client = Client(self.gateway.address)
+            client.send([{'seq': 1, 'command': 'account', 'account_id': 'account1'},
+                {'seq': 2, 'command': 'credit', 'id': 'credit1', 'account_id': 'account1', 'coin_type': 'btc', 'amount': '1'},
+                {'seq': 3, 'command': 'order', 'order_id': 'bid1', 'side': 'bid', 'account_id': 'account1', 'coin_type': 'ltc',
+                 'price_type': 'btc', 'price': '0.1', 'amount': '1', 'fee_rate': '0'},
+                {'seq': 4, 'command': 'cancel', 'order_id': 'bid1'}])
+            replies = client.receive(4)
+        finally:
+            Exchange.match_all = match_all
+        client.close()
+        self.assertEqual(replies[2], {'seq': 3, 'error': 'RuntimeError', 'message': 'matching failed'})
+        self.assertEqual(replies[3]['error'], 'NotFoundError')
+        self.assertEqual(self.repo.revision, 3)
+        self.assertEqual(self.repo.accounts.find('account1').find_balance('btc').frozen, 0)
+
+    def test_journal_failure(self):
+        journal = Journal(os.path.join(self.dir, 'events.log'), sync=SYNC_ALWAYS)
+        self.repo = Repository(journal=journal)
+        self.repo.commit(ExchangeCreated.build(self.repo, 'ltc', 'btc'))
+        flush = journal._flush
+        def fail():
+            journal._flush = flush
+            raise IOError("disk full")
+        journal._flush = fail
+        self.gateway = Gateway(self.repo, ('127.0.0.1', 0))
+        first, second = Client(self.gateway.address), Client(self.gateway.address)
+        first.send([{'seq': 1, 'command': 'account', 'account_id': 'account1'}])
+        second.send([{'seq': 1, 'command': 'account', 'account_id': 'account2'}])
+        # both commands are queued before the matcher starts, so they share one batch
+        while self.gateway.queue.qsize() < 2:
+            asyncore.loop(timeout=0.01, map=self.gateway.map, count=1)
+        self.gateway.start()
+        self.assertEqual(first.receive(1)[0]['error'], 'IOError')
+        self.assertEqual(second.receive(1)[0]['error'], 'IOError')
+        self.assertEqual(self.repo.revision, 1)
+        first.send([{'seq': 2, 'command': 'account', 'account_id': 'account1'}])
+        self.assertEqual(first.receive(1)[0], {'seq': 2, 'revision': 2})
+        first.close()
+        second.close()
+        journal.close()
+
+    def test_flush_failure(self):
+        journal = Journal(os.path.join(self.dir, 'events.log'), group_interval=0)
+        self.repo = Repository(journal=journal)
+        self.repo.commit(ExchangeCreated.build(self.repo, 'ltc', 'btc'))
+        fsync = os.fsync
+        def fail(fd):
+            os.fsync = fsync
+            raise OSError(errno.EIO, "I/O error")
+        os.fsync = fail
+        try:
+            self.gateway = Gateway(self.repo, ('127.0.0.1', 0))
+            self.gateway.start()
+            client = Client(self.gateway.address)
+            client.send([{'seq': 1, 'command': 'account', 'account_id': 'account1'}])
+            self.assertEqual(client.receive(1)[0]['error'], 'OSError')
+        finally:
+            os.fsync = fsync
+        self.assertEqual(self.repo.revision, 1)
+        self.assertEqual(self.repo.accounts.get('account1'), None)
+        client.send([{'seq': 2, 'command': 'account', 'account_id': 'account1'}])
+        self.assertEqual(client.receive(1)[0], {'seq': 2, 'revision': 2})
+        self.assertEqual([event.revision for event in journal.read()], [1, 2])
+        client.close()
+        journal.close()
+
+    def test_backpressure(self):
+        self.check(('127.0.0.1', 0), queue_size=1, batch_size=1)
+
+if __name__ == '__main__':
+    unittest.main()
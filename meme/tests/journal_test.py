@@ -0,0 +1,221 @@
+import unittest
+import os
+import copy
+import time
+import shutil
+import tempfile
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated, OrderCanceled
+from meme.me import journal as journals
+from meme.me.journal import Journal, SYNC_ALWAYS, SYNC_GROUP, SYNC_ASYNC
+from meme.me.errors import BalanceError, JournalError
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'events.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def build_repo(self, journal):
+        repo = Repository(journal=journal)
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        repo.commit(AccountCreated.build(repo, 'account1'))
+        repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 100))
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 10, 0.01))
+        with self.assertRaises(BalanceError):
+            repo.commit(OrderCreated.build(repo, 'bid2', BidOrder, 'account1', 'ltc', 'btc', 1, 100, 0.01))
+        repo.commit(OrderCanceled.build(repo, 'bid1'))
+        return repo
+
+    def test_sync_always(self):
+        journal = Journal(self.path, sync=SYNC_ALWAYS)
+        repo = self.build_repo(journal)
+        self.assertEqual(repo.revision, 5)
+        self.assertEqual(journal.flushed_revision, 5)
+        self.assertEqual([e.revision for e in journal.read()], [1, 2, 3, 4, 5])
+        self.assertEqual([e.revision for e in journal.read(3)], [4, 5])
+        journal.close()
+
+    def test_group_commit(self):
+        journal = Journal(self.path, sync=SYNC_GROUP, group_size=4, group_interval=0)
+        repo = self.build_repo(journal)
+        self.assertEqual(journal.flushed_revision, 4)
+        self.assertEqual(len(list(journal.read())), 4)
+        repo.flush()
+        self.assertEqual(journal.flushed_revision, 5)
+        journal.close()
+
+    def test_async(self):
+        with self.assertRaises(ValueError):
+            Journal(self.path, sync=SYNC_ASYNC, group_interval=0)
+        journal = Journal(self.path, sync=SYNC_ASYNC, group_interval=60000)
+        self.build_repo(journal)
+        self.assertEqual(list(journal.read()), [])
+        journal.close()
+        journal = Journal(self.path, sync=SYNC_ALWAYS)
+        self.assertEqual(len(list(journal.read())), 5)
+        journal.close()
+
+    def test_async_failure(self):
+        journal = Journal(self.path, sync=SYNC_ASYNC, group_interval=1)
+        flush = journal._flush
+        journal._flush = lambda: None
+        repo = self.build_repo(journal)
+        def fail():
+            journal._flush = flush
+            raise IOError("disk full")
+        journal._flush = fail
+        while journal._flush is not flush:
+            time.sleep(0.001)
+        with self.assertRaises(IOError):
+            with repo.batch():
+                repo.commit(AccountCreated.build(repo, 'account2'))
+        self.assertEqual(repo.revision, 5)
+        repo.commit(AccountCreated.build(repo, 'account2'))
+        journal.flush()
+        self.assertEqual([e.revision for e in journal.read()], [1, 2, 3, 4, 5, 6])
+        journal.close()
+
+    def test_sync_from_journal(self):
+        journal = Journal(self.path, sync=SYNC_ALWAYS)
+        repo = self.build_repo(journal)
+        journal.close()
+        restored = Repository(journal=Journal(self.path, sync=SYNC_ALWAYS))
+        restored.sync()
+        self.assertEqual(restored.revision, 5)
+        self.assertEqual(restored.accounts, repo.accounts)
+        self.assertEqual(restored.orders, repo.orders)
+        restored.commit(AccountCreated.build(restored, 'account2'))
+        self.assertEqual(restored.journal.revision, 6)
+        with self.assertRaises(JournalError):
+            restored.journal.append(AccountCreated.build(repo, 'account3'))
+        restored.journal.close()
+
+    def test_truncate_torn_tail(self):
+        journal = Journal(self.path, sync=SYNC_ALWAYS)
+        self.build_repo(journal)
+        journal.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 3)
+        journal = Journal(self.path, sync=SYNC_ALWAYS)
+        self.assertEqual(journal.revision, 4)
+        self.assertEqual([e.revision for e in journal.read()], [1, 2, 3, 4])
+        journal.close()
+
+    def test_checksum_mismatch(self):
+        journal = Journal(self.path, sync=SYNC_ALWAYS)
+        self.build_repo(journal)
+        journal.close()
+        with open(self.path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write('\0' if last != '\0' else '\1')
+        journal = Journal(self.path, sync=SYNC_ALWAYS)
+        self.assertEqual(journal.revision, 4)
+        journal.close()
+
+    def test_sparse_index(self):
+        interval = journals.INDEX_INTERVAL
+        journals.INDEX_INTERVAL = 4
+        try:
+            journal = Journal(self.path, sync=SYNC_GROUP, group_size=3, group_interval=0)
+            repo = Repository(journal=journal)
+            repo.commit(AccountCreated.build(repo, 'account1'))
+            for i in range(20):
+                repo.commit(AccountCredited.build(repo, 'credit%d' % i, 'account1', 'btc', 1))
+            repo.flush()
+            self.assertEqual(journal.index_revisions, [1, 5, 9, 13, 17, 21])
+            starts = []
+            records = journal._records
+            journal._records = lambda offset=0: starts.append(offset) or records(offset)
+            for since in range(22):
+                self.assertEqual([e.revision for e in journal.read(since)], range(since + 1, 22))
+            self.assertEqual(starts[0], 0)
+            self.assertEqual(starts[-1], journal.index_offsets[-1])
+            journal.close()
+            reopened = Journal(self.path, sync=SYNC_ALWAYS)
+            self.assertEqual((reopened.index_revisions, reopened.index_offsets), (journal.index_revisions, journal.index_offsets))
+            reopened.close()
+        finally:
+            journals.INDEX_INTERVAL = interval
+
+    def test_batch(self):
+        journal = Journal(self.path, sync=SYNC_ALWAYS)
+        flushes = []
+        flush = journal._flush
+        journal._flush = lambda: flushes.append(journal.revision) or flush()
+        repo = Repository(journal=journal)
+        published = []
+        repo.subscribers.append(published.append)
+        with repo.batch() as events:
+            repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+            repo.commit(AccountCreated.build(repo, 'account1'))
+            repo.commit(AccountCredited.build(repo, 'credit1', 'account1', 'btc', 100))
+            repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', 1, 10, 0.01))
+            with self.assertRaises(BalanceError):
+                repo.commit(OrderCreated.build(repo, 'bid2', BidOrder, 'account1', 'ltc', 'btc', 1, 100, 0.01))
+            with self.assertRaises(ValueError):
+                with repo.batch():
+                    repo.commit(AccountCreated.build(repo, 'account2'))
+                    raise ValueError
+            self.assertEqual((repo.revision, len(events)), (4, 4))
+            with repo.batch():
+                repo.commit(OrderCanceled.build(repo, 'bid1'))
+            self.assertEqual(repo.revision, 5)
+            self.assertEqual(published, [])
+            self.assertEqual(journal.revision, 0)
+        self.assertEqual([e.revision for e in events], [1, 2, 3, 4, 5])
+        self.assertEqual(published, events)
+        self.assertEqual(flushes, [5])
+        self.assertEqual([e.revision for e in journal.read()], [1, 2, 3, 4, 5])
+        self.assertEqual(float(repo.accounts.find('account1').find_balance('btc').active), 100)
+        self.assertEqual(repo.accounts.get('account2'), None)
+        journal.close()
+
+    def test_batch_rollback(self):
+        journal = Journal(self.path, sync=SYNC_ALWAYS)
+        repo = self.build_repo(journal)
+        accounts, orders = copy.deepcopy(repo.accounts), copy.deepcopy(repo.orders)
+        with self.assertRaises(BalanceError):
+            with repo.batch():
+                repo.commit(OrderCreated.build(repo, 'bid2', BidOrder, 'account1', 'ltc', 'btc', 1, 50, 0.01))
+                repo.commit(AccountCreated.build(repo, 'account2'))
+                repo.commit(OrderCreated.build(repo, 'bid3', BidOrder, 'account1', 'ltc', 'btc', 1, 60, 0.01))
+        self.assertEqual(repo.revision, 5)
+        self.assertEqual(repo.accounts, accounts)
+        self.assertEqual(repo.orders, orders)
+        self.assertEqual(journal.revision, 5)
+        repo.commit(AccountCreated.build(repo, 'account2'))
+        self.assertEqual([e.revision for e in journal.read()], [1, 2, 3, 4, 5, 6])
+        journal.close()
+
+    def test_batch_journal_failure(self):
+        journal = Journal(self.path, sync=SYNC_ALWAYS)
+        repo = self.build_repo(journal)
+        published = []
+        repo.subscribers.append(published.append)
+        accounts = copy.deepcopy(repo.accounts)
+        flush = journal._flush
+        def fail():
+            journal._flush = flush
+            raise IOError("disk full")
+        journal._flush = fail
+        with self.assertRaises(IOError):
+            with repo.batch():
+                repo.commit(AccountCreated.build(repo, 'account2'))
+                repo.commit(AccountCredited.build(repo, 'credit2', 'account2', 'btc', 1))
+        self.assertEqual((repo.revision, journal.revision), (5, 5))
+        self.assertEqual(repo.accounts, accounts)
+        self.assertEqual(published, [])
+        with repo.batch():
+            repo.commit(AccountCreated.build(repo, 'account2'))
+        self.assertEqual([e.revision for e in journal.read()], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([e.revision for e in published], [6])
+        journal.close()
+
+if __name__ == '__main__':
+    unittest.main()
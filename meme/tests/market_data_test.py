@@ -0,0 +1,86 @@
+import unittest
+import random
+from decimal import Decimal
+from meme.me import amounts
+from meme.me.values import Deal
+from meme.api.market_data import MarketData, Ticker
+
+DAY = 17361 * 86400
+
+def deal(price, amount, timestamp):
+    engine = amounts.engine
+    price, amount = engine.price(price), engine.amount(amount)
+    return Deal('bid1', 'ask1', price, amount, 0, 0, amount, price, 0, timestamp)
+
+class TestMarketData(unittest.TestCase):
+    def test_candles(self):
+        market_data = MarketData()
+        for args in [('1.0', '2', DAY + 10), ('1.5', '1', DAY + 20), ('0.5', '1', DAY + 30), ('1.2', '1', DAY + 70), ('1.1', '1', DAY + 5)]:
+            market_data.add('ltc-btc', deal(*args))
+        candles = market_data.markets['ltc-btc'].candles
+        self.assertEqual(candles['1m'].items(), [
+            [DAY, 1, Decimal('1.5'), Decimal('0.5'), Decimal('0.5'), 4, 4, 3],
+            [DAY + 60, Decimal('1.2'), Decimal('1.2'), Decimal('1.1'), Decimal('1.1'), 2, Decimal('2.3'), 2]])
+        self.assertEqual(candles['1d'].items(), [[DAY, 1, Decimal('1.5'), Decimal('0.5'), Decimal('1.1'), 6, Decimal('6.3'), 5]])
+        self.assertEqual(candles['5m'].items(), candles['1d'].items())
+        self.assertEqual(market_data.candles_json('ltc-btc', '1h'), [[DAY, '1.00000000', '1.50000000', '0.50000000', '1.10000000', '6.00000000', '6.30000000', 5]])
+        self.assertEqual(market_data.candles_json('ltc-btc', '2m'), None)
+        self.assertEqual(market_data.candles_json('eth-btc', '1m'), [])
+        self.assertEqual(market_data.ticker('eth-btc'), None)
+
+    def test_ring(self):
+        market_data = MarketData(capacity=3)
+        for i in range(5):
+            market_data.add('ltc-btc', deal(i + 1, '1', DAY + i * 120))
+        candles = market_data.markets['ltc-btc'].candles['1m']
+        self.assertEqual([candle[0] for candle in candles.items()], [DAY + 360, DAY + 480])
+        self.assertEqual([candle[4] for candle in candles.items(1)], [5])
+        self.assertEqual(len(candles.slots), 3)
+
+    def test_ticker(self):
+        ticker = Ticker()
+        self.assertEqual(ticker.as_json(), None)
+        ticker.add(Decimal(2), 1, 2, DAY)
+        ticker.add(Decimal(1), 1, 1, DAY + 3600)
+        ticker.add(Decimal('1.5'), 1, Decimal('1.5'), DAY + 86400 + 30)
+        self.assertEqual(ticker.as_json(), {'since': DAY + 3600, 'open': '1', 'high': '1.5', 'low': '1', 'last': '1.5',
+            'volume': '2', 'quote_volume': '2.5', 'count': 2})
+        ticker.add(Decimal(3), 1, 3, DAY + 3 * 86400)
+        self.assertEqual(ticker.as_json()['count'], 1)
+        self.assertEqual(ticker.as_json()['low'], '3')
+
+    def test_ticker_advance(self):
+        market_data = MarketData()
+        market_data.add('ltc-btc', deal('2', '1', DAY + 10))
+        market_data.add('ltc-btc', deal('1', '1', DAY + 7200))
+        ticker = market_data.ticker('ltc-btc')
+        self.assertEqual(ticker.expires, DAY + 86400)
+        self.assertEqual(market_data.ticker('ltc-btc', DAY + 86399).as_json()['count'], 2)
+        self.assertEqual(market_data.ticker('ltc-btc', DAY + 86400).as_json()['high'], '1.00000000')
+        self.assertEqual(ticker.expires, DAY + 7200 + 86400)
+        self.assertEqual(market_data.ticker('ltc-btc', DAY + 3 * 86400).as_json(), None)
+        self.assertEqual(ticker.expires, None)
+        # deals behind the horizon are ignored and the window never moves back
+        market_data.add('ltc-btc', deal('5', '1', DAY + 86400))
+        self.assertEqual(market_data.ticker('ltc-btc', DAY).as_json(), None)
+        market_data.add('ltc-btc', deal('3', '1', DAY + 2 * 86400 + 90))
+        self.assertEqual(market_data.ticker('ltc-btc').as_json()['count'], 1)
+        self.assertEqual(market_data.ticker('ltc-btc').as_json()['last'], '3.00000000')
+
+    def test_ticker_against_rescan(self):
+        rand = random.Random(9)
+        ticker = Ticker()
+        deals = []
+        timestamp = DAY
+        for i in range(600):
+            timestamp += int(rand.expovariate(1 / 300.0))
+            price = rand.randint(50, 150)
+            deals.append((timestamp - timestamp % 60, price))
+            ticker.add(price, 1, price, timestamp)
+            window = [p for start, p in deals if start > deals[-1][0] - 86400]
+            self.assertEqual((ticker.count, ticker.volume, ticker.quote_volume), (len(window), len(window), sum(window)))
+            self.assertEqual((ticker.minutes.get(ticker.first)[1], ticker.highs[0][1], ticker.lows[0][1]), (window[0], max(window), min(window)))
+            self.assertLessEqual(len(ticker.highs), 1440)
+
+if __name__ == '__main__':
+    unittest.main()
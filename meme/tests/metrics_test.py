@@ -0,0 +1,102 @@
+import unittest
+import random
+from meme.me import metrics
+from meme.me.metrics import Histogram
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated, OrderCanceled
+
+class TestHistogram(unittest.TestCase):
+    def test_percentile(self):
+        histogram = Histogram()
+        values = [random.randint(0, 10 ** 6) for i in range(10000)]
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for p in (0.5, 0.99, 0.999):
+            expected = values[int(len(values) * p) - 1]
+            self.assertTrue(abs(histogram.percentile(p) - expected) <= expected / 16.0 + 1)
+        self.assertEqual(histogram.count, 10000)
+        self.assertEqual(histogram.max, values[-1])
+        self.assertEqual(histogram.total, sum(values))
+
+    def test_small_values_are_exact(self):
+        histogram = Histogram()
+        for value in range(64):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(0.5), 31)
+        self.assertEqual(histogram.count_below(9), 10)
+
+    def test_upper(self):
+        for value in [0, 63, 64, 65, 1000, 123456789]:
+            histogram = Histogram()
+            histogram.record(value)
+            index = len(histogram.counts) - 1
+            self.assertTrue(value <= Histogram.upper(index))
+            self.assertTrue(index == 0 or Histogram.upper(index - 1) < value)
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.commit = Repository.__dict__['commit']
+        self.build = OrderCreated.__dict__['build']
+        metrics.enable()
+        self.repo = repo = Repository()
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        for account_id in ['account1', 'account2']:
+            repo.commit(AccountCreated.build(repo, account_id))
+            repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 100))
+            repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 100))
+
+    def tearDown(self):
+        metrics.disable()
+
+    def test_events(self):
+        repo = self.repo
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '0.1', 2, '0.01'))
+        repo.commit(OrderCreated.build(repo, 'bid2', BidOrder, 'account1', 'ltc', 'btc', '0.2', 1, '0.01'))
+        repo.commit(OrderCreated.build(repo, 'ask1', AskOrder, 'account2', 'ltc', 'btc', '0.1', 1, '0.01'))
+        repo.exchanges.find('ltc-btc').match_all(repo)
+        repo.commit(OrderCanceled.build(repo, 'bid1'))
+        event = OrderCreated.build(repo, 'bid3', BidOrder, 'account1', 'ltc', 'btc', '0.1', 1, '0.01')
+        event.revision += 1
+        self.assertRaises(ValueError, repo.commit, event)
+        result = metrics.collect(repo)
+        self.assertEqual(result['events']['AccountCredited']['count'], 4)
+        self.assertEqual(result['events']['OrderCreated']['count'], 3)
+        self.assertEqual(result['events']['OrderCreated']['errors'], 1)
+        self.assertEqual(result['events']['OrderCreated']['build_us']['count'], 4)
+        self.assertEqual(result['events']['OrderDealt']['count'], 1)
+        self.assertEqual(result['events']['OrderDealt']['build_us']['count'], 1)
+        self.assertEqual(result['events']['OrderCanceled']['apply_us']['count'], 1)
+        self.assertEqual(result['repo']['orders'], 0)
+        self.assertEqual(result['repo']['dedup']['credits'], 4)
+        self.assertEqual(result['repo']['dedup']['orders'], 3)
+        self.assertEqual(result['repo']['exchanges']['ltc-btc'], {'bid_levels': 0, 'ask_levels': 0, 'bid_orders': 0, 'ask_orders': 0})
+
+    def test_book_sizes(self):
+        repo = self.repo
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '0.1', 1, '0.01'))
+        repo.commit(OrderCreated.build(repo, 'bid2', BidOrder, 'account1', 'ltc', 'btc', '0.1', 1, '0.01'))
+        repo.commit(OrderCreated.build(repo, 'bid3', BidOrder, 'account1', 'ltc', 'btc', '0.2', 1, '0.01'))
+        repo.commit(OrderCreated.build(repo, 'ask1', AskOrder, 'account2', 'ltc', 'btc', '0.3', 1, '0.01'))
+        result = metrics.collect(repo)
+        self.assertEqual(result['repo']['orders'], 4)
+        self.assertEqual(result['repo']['exchanges']['ltc-btc'], {'bid_levels': 2, 'ask_levels': 1, 'bid_orders': 3, 'ask_orders': 1})
+        text = metrics.render(repo)
+        self.assertIn('meme_events_total{type="OrderCreated"} 4\n', text)
+        self.assertIn('meme_book_orders{exchange="ltc-btc",side="bid"} 3\n', text)
+        self.assertIn('meme_dedup_entries{index="orders"} 4\n', text)
+        self.assertIn('meme_event_apply_seconds_bucket{le="+Inf",type="OrderCreated"} 4\n', text)
+        self.assertIn('meme_event_apply_seconds_count{type="OrderCreated"} 4\n', text)
+
+    def test_disable(self):
+        self.assertIsNot(Repository.__dict__['commit'], self.commit)
+        metrics.disable()
+        self.assertIs(Repository.__dict__['commit'], self.commit)
+        self.assertIs(OrderCreated.__dict__['build'], self.build)
+        self.assertFalse(metrics.enabled)
+        repo = self.repo
+        repo.commit(OrderCreated.build(repo, 'bid1', BidOrder, 'account1', 'ltc', 'btc', '0.1', 1, '0.01'))
+        self.assertEqual(metrics.collect(repo)['events']['OrderCreated']['count'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
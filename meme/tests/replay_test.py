@@ -0,0 +1,138 @@
+import unittest
+import os
+import sys
+import random
+import shutil
+import tempfile
+from decimal import Decimal
+from StringIO import StringIO
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountDebited, AccountCreated, AccountCanceled, ExchangeCreated, OrderCreated, OrderCanceled, OrderTaken, AuctionStarted, AuctionCleared, OrdersMassCanceled
+from meme.me.journal import Journal, SYNC_ALWAYS
+from meme.me.replay import replay_events, replay_journal, main, _scan_binary, _scan_event
+from meme.me.codecs import BinaryCodec, PickleCodec
+from meme.me.errors import ReplayError
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.dir, 'events.log')
+        self.journal = Journal(self.journal_path, sync=SYNC_ALWAYS)
+        self.repo = Repository(journal=self.journal)
+        self.events = []
+        self.trade()
+        self.journal.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def commit(self, event):
+        self.repo.commit(event)
+        self.events.append(event)
+
+    def trade(self):
+        repo = self.repo
+        pairs = [('ltc', 'btc'), ('eth', 'btc'), ('doge', 'ltc')]
+        for coin_type, price_type in pairs:
+            self.commit(ExchangeCreated.build(repo, coin_type, price_type))
+        accounts = ['account%d' % i for i in range(4)]
+        for account_id in accounts + ['temp']:
+            self.commit(AccountCreated.build(repo, account_id))
+            for coin_type in ['btc', 'ltc', 'eth', 'doge']:
+                self.commit(AccountCredited.build(repo, '%s-%s' % (coin_type, account_id), account_id, coin_type, 1000))
+        rand = random.Random(11)
+        for i in range(300):
+            if i == 100:
+                self.commit(AuctionStarted.build(repo, 'ltc-btc'))
+            elif i == 200:
+                self.commit(AuctionCleared.build(repo, 'ltc-btc'))
+            elif i == 250:
+                self.commit(OrdersMassCanceled.build(repo, 'account1'))
+            coin_type, price_type = rand.choice(pairs)
+            klass = rand.choice([BidOrder, AskOrder])
+            price = Decimal(rand.randint(90, 110)) / 100
+            amount = Decimal(rand.randint(1, 500)) / 100
+            self.commit(OrderCreated.build(repo, 'order%d' % i, klass, rand.choice(accounts), coin_type, price_type, price, amount, '0.002', timestamp=i + 1))
+            self.events.extend(repo.exchanges.find('%s-%s' % (coin_type, price_type)).match_all(repo))
+            if i % 10 == 9 and not repo.exchanges.find('%s-%s' % (coin_type, price_type)).auction:
+                kind = OrderTaken.KINDS[i // 10 % 3]
+                price = None if kind == OrderTaken.MARKET else price
+                self.commit(OrderTaken.build(repo, 'taker%d' % i, klass, rand.choice(accounts), coin_type, price_type, amount, '0.002', kind, price, timestamp=i + 1))
+            if rand.random() < 0.2:
+                order_id = rand.choice(sorted(repo.orders.entities.keys()))
+                self.commit(OrderCanceled.build(repo, order_id))
+        for coin_type in ['btc', 'ltc', 'eth', 'doge']:
+            self.commit(AccountDebited.build(repo, 'debit-%s' % coin_type, 'temp', coin_type, 1000))
+        self.commit(AccountCanceled.build(repo, 'temp'))
+        self.commit(AccountCreated.build(repo, 'temp'))
+
+    def test_replay_events(self):
+        replayed = replay_events(self.events, processes=2, verify=True)
+        self.assertEqual(replayed, self.repo)
+        self.assertEqual(len(replayed.exchanges.entities), 3)
+        self.assertTrue(replayed.orders.entities)
+        self.assertEqual(replayed.accounts.find('temp').balances, {})
+        self.assertTrue('order1' in replayed.orders_index)
+        self.assertTrue('debit-btc' in replayed.debits_index)
+
+    def test_replay_journal(self):
+        journal = Journal(self.journal_path, sync=SYNC_ALWAYS)
+        replayed = replay_journal(journal, processes=1, verify=True)
+        journal.close()
+        self.assertEqual(replayed, self.repo)
+
+    def test_scan(self):
+        codec = BinaryCodec()
+        for event in self.events:
+            payload = codec.encode(event)
+            self.assertEqual(_scan_binary(codec, payload), _scan_event(codec, payload))
+
+    def test_replay_pickle_journal(self):
+        path = os.path.join(self.dir, 'pickle.log')
+        journal = Journal(path, sync=SYNC_ALWAYS, codec=PickleCodec())
+        journal.extend(self.events)
+        replayed = replay_journal(journal, processes=2, verify=True)
+        journal.close()
+        self.assertEqual(replayed, self.repo)
+
+    def test_verify_detects_mismatch(self):
+        events = list(self.events)
+        event = events[-1]
+        self.assertTrue(isinstance(event, AccountCreated))
+        events.append(AccountCreated(event.revision + 1, 'extra'))
+        replayed = replay_events(events, processes=1)
+        replayed.accounts.remove('extra')
+        from meme.me import replay
+        with self.assertRaises(ReplayError):
+            replay._verify(replayed, events)
+
+    def test_verify_journal_indexes(self):
+        from meme.me import replay
+        from meme.me.dedup import DedupIndex
+        original = replay._replay
+        def corrupt(*args):
+            repo = original(*args)
+            repo.credits_index = DedupIndex()
+            return repo
+        replay._replay = corrupt
+        journal = Journal(self.journal_path, sync=SYNC_ALWAYS)
+        try:
+            with self.assertRaisesRegexp(ReplayError, 'credits_index'):
+                replay_journal(journal, processes=1, verify=True)
+        finally:
+            replay._replay = original
+            journal.close()
+
+    def test_main(self):
+        snapshot_path = os.path.join(self.dir, 'repo.snapshot')
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            main([self.journal_path, '--processes', '2', '--verify', '--snapshot', snapshot_path])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertTrue(output.startswith('replayed 5 accounts, 3 exchanges'))
+        self.assertEqual(Repository.load_snapshot(snapshot_path), self.repo)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+from decimal import Decimal, InvalidOperation
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated, OrderCanceled
+from meme.me.shard import Ledger, Matcher, ShardedEngine, ORDER_SIDES
+from meme.me.errors import BalanceError, NotFoundError, ShardError
+
+PAIRS = [('ltc', 'btc'), ('eth', 'btc'), ('doge', 'ltc')]
+ACCOUNTS = ['account1', 'account2', 'account3']
+COINS = ['btc', 'ltc', 'eth', 'doge']
+
+def build_orders(rand, count):
+    orders = []
+    for i in range(count):
+        coin_type, price_type = rand.choice(PAIRS)
+        orders.append({
+            'id': 'order%d' % i,
+            'side': rand.choice(['bid', 'ask']),
+            'account_id': rand.choice(ACCOUNTS),
+            'coin_type': coin_type,
+            'price_type': price_type,
+            'price': Decimal(rand.randint(90, 110)) / 100,
+            'amount': Decimal(rand.randint(1, 500)) / 100,
+            'fee_rate': '0.002',
+            'timestamp': i + 1,
+        })
+    return orders
+
+class TestShard(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def fund(self, create_account, credit, amount=10000):
+        for account_id in ACCOUNTS:
+            create_account(account_id)
+            for coin_type in COINS:
+                credit('%s-%s' % (coin_type, account_id), account_id, coin_type, amount)
+
+    def sequential(self, orders, cancels):
+        repo = Repository()
+        for coin_type, price_type in PAIRS:
+            repo.commit(ExchangeCreated.build(repo, coin_type, price_type))
+        self.fund(lambda account_id: repo.commit(AccountCreated.build(repo, account_id)),
+                lambda *args: repo.commit(AccountCredited.build(repo, *args)))
+        for i, json in enumerate(orders):
+            repo.commit(OrderCreated.build(repo, json['id'], ORDER_SIDES[json['side']], json['account_id'], json['coin_type'], json['price_type'], json['price'], json['amount'], json['fee_rate'], json['timestamp']))
+            repo.exchanges.find('%s-%s' % (json['coin_type'], json['price_type'])).match_all(repo)
+            if i in cancels and repo.orders.get(cancels[i]):
+                repo.commit(OrderCanceled.build(repo, cancels[i]))
+        return repo
+
+    def assertBalances(self, expected, balances):
+        for account_id in ACCOUNTS:
+            account = expected.accounts.find(account_id)
+            self.assertEqual(balances(account_id), dict((coin_type, (b.active, b.frozen)) for coin_type, b in account.balances.items()))
+
+    def test_in_process(self):
+        rand = random.Random(5)
+        orders = build_orders(rand, 300)
+        cancels = dict((i, 'order%d' % rand.randint(0, i)) for i in range(0, 300, 7))
+        ledger = Ledger(Repository())
+        self.fund(ledger.create_account, ledger.credit)
+        matchers = [Matcher('shard0', Repository(), ledger, PAIRS[:1]), Matcher('shard1', Repository(), ledger, PAIRS[1:])]
+        route = lambda json: matchers[0 if (json['coin_type'], json['price_type']) == PAIRS[0] else 1]
+        for i, json in enumerate(orders):
+            matcher = route(json)
+            self.assertEqual(matcher.submit([json]), [None])
+            if i in cancels:
+                cancel = orders[int(cancels[i][5:])]
+                route(cancel).cancel([cancels[i]])
+                self.assertEqual(route(cancel).repo.orders.get(cancels[i]), None)
+        expected = self.sequential(orders, cancels)
+
+        def balances(account_id):
+            totals = ledger.balances(account_id)
+            for matcher in matchers:
+                for coin_type, (active, frozen) in matcher.balances(account_id).items():
+                    self.assertEqual(active, 0)
+                    totals[coin_type] = (totals[coin_type][0], totals[coin_type][1] + frozen)
+            return totals
+        self.assertBalances(expected, balances)
+        for matcher in matchers:
+            for exchange_id, exchange in matcher.repo.exchanges.entities.items():
+                self.assertEqual(exchange, expected.exchanges.find(exchange_id))
+            for order_id, order in matcher.repo.orders.entities.items():
+                self.assertEqual(order.rest_amount, expected.orders.find(order_id).rest_amount)
+
+    def test_reserve_failures(self):
+        ledger = Ledger(Repository())
+        ledger.create_account('account1')
+        ledger.credit('credit1', 'account1', 'btc', 10)
+        matcher = Matcher('shard0', Repository(), ledger, PAIRS[:1])
+        order = {'id': 'bid1', 'side': 'bid', 'account_id': 'account1', 'coin_type': 'ltc', 'price_type': 'btc', 'price': 1, 'amount': 5, 'fee_rate': 0}
+        results = matcher.submit([order, dict(order, id='bid2'), dict(order, id='bid1'), dict(order, id='bid3', account_id='account2'), dict(order, id='bid4', price='x')])
+        self.assertEqual(results[:2], [None, None])
+        self.assertTrue(all(results[2:]))
+        self.assertTrue(isinstance(results[3], NotFoundError))
+        self.assertEqual(ledger.balances('account1'), {'btc': (0, 0)})
+        self.assertEqual(matcher.balances('account1'), {'btc': (0, 10)})
+        self.assertTrue(isinstance(matcher.submit([dict(order, id='bid5')])[0], BalanceError))
+        self.assertEqual(matcher.cancel(['bid1', 'bid6'])[0], None)
+        self.assertEqual(ledger.balances('account1'), {'btc': (5, 0)})
+        self.assertEqual(matcher.balances('account1'), {'btc': (0, 5)})
+
+    def test_processes(self):
+        rand = random.Random(9)
+        orders = build_orders(rand, 200)
+        engine = ShardedEngine([PAIRS[:1], PAIRS[1:]], path=self.dir)
+        engine.start()
+        try:
+            self.fund(engine.create_account, engine.credit)
+            for i in range(0, 200, 50):
+                self.assertEqual(engine.submit(orders[i:i + 50]), [None] * 50)
+            self.assertEqual(len(engine.cancel('ltc-btc', ['order0', 'missing'])), 2)
+            balances = dict((account_id, engine.balances(account_id)) for account_id in ACCOUNTS)
+        finally:
+            engine.stop()
+        expected = self.sequential(orders, {})
+        for account_id in ACCOUNTS:
+            for coin_type in COINS:
+                active, frozen = balances[account_id][coin_type]
+                b = expected.accounts.find(account_id).find_balance(coin_type)
+                self.assertEqual(active + frozen, b.active + b.frozen)
+        self.assertEqual(sorted(os.listdir(self.dir)), ['ledger.log', 'ledger.log.dedup', 'shard0.log', 'shard0.log.dedup', 'shard1.log', 'shard1.log.dedup'])
+
+        engine = ShardedEngine([PAIRS[:1], PAIRS[1:]], path=self.dir)
+        engine.start()
+        try:
+            self.assertEqual(dict((account_id, engine.balances(account_id)) for account_id in ACCOUNTS), balances)
+        finally:
+            engine.stop()
+
+    def test_process_failures(self):
+        engine = ShardedEngine([PAIRS[:1], PAIRS[1:]])
+        engine.start()
+        try:
+            engine.create_account('account1')
+            self.assertRaises(InvalidOperation, engine.credit, 'credit1', 'account1', 'btc', 'abc')
+            engine.credit('credit1', 'account1', 'btc', 1)
+            self.assertEqual(engine.ledger.balances('account1'), {'btc': (1, 0)})
+            engine.processes[0].terminate()
+            engine.processes[0].join()
+            self.assertRaises(ShardError, engine.matchers[0].balances, 'account1')
+            self.assertEqual(engine.matchers[1].balances('account1'), {})
+        finally:
+            engine.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+from decimal import Decimal
+from meme.me import amounts
+from meme.me.entities import Repository, AskOrder, BidOrder
+from meme.me.events import AccountCredited, AccountCreated, ExchangeCreated, OrderCreated, OrderCanceled, AuctionStarted, AuctionCleared
+from meme.me.journal import Journal, SYNC_ALWAYS
+from meme.me.errors import SnapshotError
+
+def trade(repo, rand, start, steps):
+    exchange = repo.exchanges.find('ltc-btc')
+    for i in range(start, start + steps):
+        if rand.random() < 0.2 and repo.orders.entities:
+            repo.commit(OrderCanceled.build(repo, rand.choice(sorted(repo.orders.entities.keys()))))
+            continue
+        klass = rand.choice([BidOrder, AskOrder])
+        price = Decimal(rand.randint(90, 110)) / 100
+        amount = Decimal(rand.randint(1, 1000)) / 100
+        repo.commit(OrderCreated.build(repo, 'order%d' % i, klass, rand.choice(['account1', 'account2']), 'ltc', 'btc', price, amount, '0.001', timestamp=i + 1))
+        exchange.match_all(repo)
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.dir, 'repo.snapshot')
+        self.journal_path = os.path.join(self.dir, 'events.log')
+
+    def tearDown(self):
+        amounts.use('decimal')
+        shutil.rmtree(self.dir)
+
+    def build_repo(self, journal=None):
+        repo = Repository(journal=journal)
+        repo.commit(ExchangeCreated.build(repo, 'ltc', 'btc'))
+        for account_id in ['account1', 'account2']:
+            repo.commit(AccountCreated.build(repo, account_id))
+            repo.commit(AccountCredited.build(repo, 'btc-' + account_id, account_id, 'btc', 10000))
+            repo.commit(AccountCredited.build(repo, 'ltc-' + account_id, account_id, 'ltc', 10000))
+        return repo
+
+    def check_snapshot_and_journal_tail(self):
+        rand = random.Random(7)
+        journal = Journal(self.journal_path, sync=SYNC_ALWAYS)
+        repo = self.build_repo(journal)
+        trade(repo, rand, 0, 200)
+        repo.save_snapshot(self.snapshot_path)
+        snapshot_revision = repo.revision
+        trade(repo, rand, 200, 200)
+        journal.close()
+
+        restored = Repository.load_snapshot(self.snapshot_path)
+        self.assertEqual(restored.revision, snapshot_revision)
+        self.assertTrue(restored.orders.entities._offsets)
+        journal = Journal(self.journal_path, sync=SYNC_ALWAYS)
+        restored = Repository.load_snapshot(self.snapshot_path, journal)
+        self.assertEqual(restored.revision, repo.revision)
+        self.assertEqual(restored, repo)
+        self.assertTrue('credit1' not in restored.credits_index)
+        self.assertTrue('btc-account1' in restored.credits_index)
+        self.assertTrue('order1' in restored.orders_index)
+        self.assertEqual(restored.orders.ids_by_account('account1'), sorted(order.id for order in repo.orders.entities.values() if order.account_id == 'account1'))
+        restored.save_snapshot(self.snapshot_path)
+        self.assertEqual(Repository.load_snapshot(self.snapshot_path), repo)
+        journal.close()
+
+    def test_auction(self):
+        repo = self.build_repo()
+        repo.commit(AuctionStarted.build(repo, 'ltc-btc'))
+        trade(repo, random.Random(3), 0, 50)
+        repo.save_snapshot(self.snapshot_path)
+        restored = Repository.load_snapshot(self.snapshot_path)
+        self.assertTrue(restored.exchanges.find('ltc-btc').auction)
+        self.assertEqual(restored, repo)
+        restored.commit(AuctionCleared.build(restored, 'ltc-btc'))
+        repo.commit(AuctionCleared.build(repo, 'ltc-btc'))
+        self.assertEqual(restored.accounts, repo.accounts)
+
+    def test_decimal_snapshot(self):
+        self.check_snapshot_and_journal_tail()
+
+    def test_integer_snapshot(self):
+        amounts.use('integer')
+        self.check_snapshot_and_journal_tail()
+        amounts.use('decimal')
+        with self.assertRaises(SnapshotError):
+            Repository.load_snapshot(self.snapshot_path)
+
+    def test_lazy_orders(self):
+        repo = self.build_repo()
+        repo.commit(OrderCreated.build(repo, 1, BidOrder, 'account1', 'ltc', 'btc', 1, 10, 0.01))
+        repo.commit(OrderCreated.build(repo, 'bid2', BidOrder, 'account1', 'ltc', 'btc', 1, 10, 0.01))
+        repo.save_snapshot(self.snapshot_path)
+        restored = Repository.load_snapshot(self.snapshot_path)
+        self.assertEqual(len(restored.orders.entities), 2)
+        self.assertEqual(restored.orders.find(1), repo.orders.find(1))
+        self.assertEqual(sorted(restored.orders.entities._offsets.keys()), ['bid2'])
+        restored.commit(OrderCanceled.build(restored, 'bid2'))
+        self.assertFalse(restored.orders.get('bid2'))
+        self.assertEqual(restored.exchanges.find('ltc-btc').match(), (None, None))
+        self.assertEqual(list(restored.exchanges.find('ltc-btc').bids.values()), [[1]])
+
+if __name__ == '__main__':
+    unittest.main()